@@ -0,0 +1,179 @@
+"""Parse many files without starting the editor and report the results as
+JSON lines.
+
+Usage: python3 batchparse.py [options] FILE...
+
+Source files are imported like `File > Import` does in the editor and are
+parsed with the language given via --lang. Eco documents (`.eco` files) are
+loaded with the languages they were saved with. The files are distributed
+over a pool of worker processes. Each worker keeps the grammars it has loaded
+in its grammar cache, so every grammar is only loaded once per process.
+
+For every file one line of JSON is written to stdout, e.g.
+
+    {"errors": [{"column": 5, "language": "Python 2.7.5", "line": 3,
+    "offset": 22, "token": ")"}], "file": "a.py", "language": "Python 2.7.5",
+    "status": "error", "times": {"load": 0.001, "parse": 0.008}}
+
+where status is one of "ok", "error" (syntax errors) or "failed" (the file
+couldn't be loaded or parsed, see "message"). The exit code is 0 if all
+files parsed without errors, 1 otherwise.
+
+The grammars are found relative to this file, so the script can be run from
+any directory."""
+
+import sys
+import contextlib
+import json
+import time
+import multiprocessing
+from optparse import OptionParser
+
+from grammars.grammars import lang_dict
+from grammar_parser.gparser import MagicTerminal, IndentationTerminal
+from incparser.astree import EOS
+from treemanager import TreeManager
+
+document_exts = (".eco", ".nb", ".eco.bak", ".eco.swp")
+
+def preload(languages):
+    """Load the grammars of `languages` into this process' grammar cache."""
+    with contextlib.redirect_stdout(sys.stderr):
+        for lang in languages:
+            lang_dict[lang].load()
+
+def load_source(filename, lang):
+    with open(filename) as f:
+        text = f.read()
+    parser, lexer = lang_dict[lang].load()
+    treemanager = TreeManager()
+    treemanager.add_parser(parser, lexer, lang)
+    return treemanager, lambda: treemanager.import_file(text)
+
+def load_document(filename):
+    from jsonmanager import JsonManager
+    language_boxes = JsonManager().load(filename)
+    treemanager = TreeManager()
+    return treemanager, lambda: treemanager.load_file(language_boxes)
+
+def find_errors(treemanager):
+    """Return the syntax errors of all language boxes in text order. Lines
+    and columns start at 1, offsets at 0."""
+    errors = {}
+    for parser, _, lang, _, _ in treemanager.parsers:
+        for node in parser.error_nodes:
+            errors[id(node)] = {"token": node.symbol.name, "language": lang,
+                                "line": None, "column": None, "offset": None}
+    found = []
+    offset = 0
+    line = column = 1
+    node = treemanager.get_bos()
+    while errors:
+        error = errors.pop(id(node), None)
+        if error:
+            error.update(line=line, column=column, offset=offset)
+            found.append(error)
+        if isinstance(node, EOS):
+            lbox = node.get_root().get_magicterminal()
+            if lbox is None:
+                break
+            node = lbox.next_term
+            continue
+        if isinstance(node.symbol, MagicTerminal):
+            node = node.symbol.ast.children[0]
+            continue
+        if not isinstance(node.symbol, IndentationTerminal):
+            text = node.symbol.name
+            offset += len(text)
+            if text == "\r":
+                line += 1
+                column = 1
+            else:
+                column += len(text)
+        node = node.next_term
+    # errors on nodes that are not part of the text (e.g. deleted nodes)
+    found.extend(errors.values())
+    return found
+
+def initial_parse_stats(treemanager):
+    """Statistics of the parse that created the tree of the main language."""
+    if treemanager.parse_stats:
+        return treemanager.parse_stats[min(treemanager.parse_stats)]
+    # documents are parsed without creating a new version
+    return treemanager.get_mainparser().stats
+
+def parse_file(job):
+    filename, lang, with_stats = job
+    result = {"file": filename, "language": lang}
+    try:
+        # keep stdout clean for the results
+        with contextlib.redirect_stdout(sys.stderr):
+            start = time.time()
+            if filename.endswith(document_exts):
+                treemanager, parse = load_document(filename)
+            elif lang is None:
+                raise ValueError("No language given")
+            else:
+                treemanager, parse = load_source(filename, lang)
+            loaded = time.time()
+            parse()
+            end = time.time()
+    except Exception as e:
+        result["status"] = "failed"
+        result["message"] = "%s: %s" % (type(e).__name__, e)
+        return result
+    result["language"] = treemanager.parsers[0][2]
+    result["errors"] = find_errors(treemanager)
+    result["status"] = "error" if result["errors"] else "ok"
+    result["times"] = {"load": loaded - start, "parse": end - loaded}
+    if with_stats:
+        result["stats"] = initial_parse_stats(treemanager).as_dict()
+    return result
+
+def batch_parse(filenames, lang=None, jobs=None, stats=False):
+    """Parse `filenames` using `jobs` worker processes (default: one per
+    core) and yield the results in the order of `filenames`."""
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    work = [(filename, lang, stats) for filename in filenames]
+    languages = [lang] if lang in lang_dict else []
+    # Load the grammar before forking so the workers inherit the cache
+    preload(languages)
+    if jobs <= 1 or len(work) <= 1:
+        for job in work:
+            yield parse_file(job)
+        return
+    pool = multiprocessing.Pool(min(jobs, len(work)), preload, (languages,))
+    try:
+        for result in pool.imap(parse_file, work):
+            yield result
+    finally:
+        pool.terminate()
+
+def main():
+    usage = "usage: python3 %prog [options] FILE..."
+    optp = OptionParser(usage=usage)
+    optp.add_option("-l", "--lang", default=None, help="Language of the source files (see `lang_dict` in grammars/grammars.py)")
+    optp.add_option("-j", "--jobs", type="int", default=None, help="Number of worker processes (default: number of cores)")
+    optp.add_option("-s", "--stats", action="store_true", default=False, help="Include the parser statistics of each file")
+    (options, args) = optp.parse_args()
+
+    if not args:
+        optp.print_help()
+        sys.exit(1)
+    if options.lang is not None and options.lang not in lang_dict:
+        sys.stderr.write("Unknown language: %s\n" % options.lang)
+        sys.exit(1)
+
+    start = time.time()
+    count = {"ok": 0, "error": 0, "failed": 0}
+    for result in batch_parse(args, options.lang, options.jobs, options.stats):
+        count[result["status"]] += 1
+        sys.stdout.write(json.dumps(result, sort_keys=True) + "\n")
+        sys.stdout.flush()
+    sys.stderr.write("%s files: %s ok, %s with errors, %s failed (%.2fs)\n" % (
+        len(args), count["ok"], count["error"], count["failed"], time.time() - start))
+    sys.exit(0 if count["ok"] == len(args) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""Benchmarks for Eco's incremental parsing infrastructure.
+
+Usage: python3 benchmark.py COMMAND [options] [args]
+
+The grammars are found relative to this file, so the script can be run from
+any directory."""
+
+import sys, os
+import random
+import time
+from optparse import OptionParser
+
+from grammars.grammars import lang_dict
+from treemanager import TreeManager
+from utils import KEY_UP as UP, KEY_DOWN as DOWN, KEY_LEFT as LEFT, KEY_RIGHT as RIGHT
+
+ext_to_lang = {
+    ".py": "Python 2.7.5",
+    ".java": "Java",
+}
+
+def setup_treemanager(lang):
+    parser, lexer = lang_dict[lang].load()
+    treemanager = TreeManager()
+    treemanager.add_parser(parser, lexer, lang)
+    return treemanager
+
+def read_program(filename, lang=None):
+    if lang is None:
+        _, ext = os.path.splitext(filename)
+        lang = ext_to_lang[ext]
+    with open(filename) as f:
+        program = f.read()
+    return program, lang
+
+def edit_session(treemanager, edits, seed=0, snapshot=20):
+    """Scripted editing session: type or delete single characters at random
+    (but reproducible) positions and take an undo snapshot every `snapshot`
+    edits."""
+    rand = random.Random(seed)
+    for i in range(edits):
+        treemanager.cursor_reset()
+        for _ in range(rand.randrange(len(treemanager.lines))):
+            treemanager.cursor_movement(DOWN)
+        treemanager.key_end()
+        if rand.random() < 0.5:
+            treemanager.key_normal(rand.choice("abcxyz0123"))
+        else:
+            treemanager.key_backspace()
+        if i % snapshot == snapshot - 1:
+            treemanager.undo_snapshot()
+
+# ================================ PARSING ================================= #
+
+def count_terminals(root):
+    count = 0
+    node = root.children[0].next_term
+    while node.next_term is not None:
+        count += 1
+        node = node.next_term
+    return count
+
+def bench_parse(options, args):
+    """Time full (non-incremental) parses of already lexed files."""
+    for filename in args:
+        program, lang = read_program(filename, options.lang)
+        treemanager = setup_treemanager(lang)
+        treemanager.import_file(program)
+        parser = treemanager.get_mainparser()
+        parser.set_tracing(options.trace)
+        tokens = count_terminals(parser.previous_version.parent)
+        times = []
+        for i in range(options.runs):
+            start = time.time()
+            parser.reparse()
+            times.append(time.time() - start)
+        best = min(times)
+        print("%s (%s, %s tokens): %.1f ms, %.2f us/token" % (filename, lang, tokens, best * 1000, best * 1e6 / tokens))
+
+def bench_import(options, args):
+    """Time importing files, with and without the bulk parser."""
+    for filename in args:
+        program, lang = read_program(filename, options.lang)
+        for bulk in [False, True]:
+            times = []
+            for i in range(options.runs):
+                treemanager = setup_treemanager(lang)
+                if not bulk:
+                    treemanager.get_mainparser().bulk_parse = lambda: False
+                start = time.time()
+                treemanager.import_file(program)
+                times.append(time.time() - start)
+            print("%s (%s, %s): %.1f ms" % (filename, lang, "bulk" if bulk else "incremental", min(times) * 1000))
+
+def bench_recovery(options, args):
+    """Time error recovery of syntax errors at the end of files."""
+    for filename in args:
+        program, lang = read_program(filename, options.lang)
+        treemanager = setup_treemanager(lang)
+        treemanager.import_file(program)
+        errors = 0
+        recovery = parse = 0
+        # Append a closing parenthesis (usually a syntax error) to each of the
+        # last lines in turn and remove it again
+        lines = len(treemanager.lines)
+        for line in range(max(0, lines - options.edits), lines):
+            treemanager.cursor.line = line
+            treemanager.key_end()
+            treemanager.key_normal(")")
+            stats = treemanager.get_parse_stats()
+            if stats.recoveries:
+                errors += 1
+                recovery += stats.times.get("recovery", 0)
+                parse += stats.times["parse"]
+            treemanager.key_backspace()
+        if errors == 0:
+            print("%s (%s): no errors" % (filename, lang))
+            continue
+        print("%s (%s, %s errors): recovery %.3f ms, parse %.3f ms" % (filename, lang, errors, recovery * 1000 / errors, parse * 1000 / errors))
+
+def identifier_offsets(treemanager):
+    """Offsets of the ends of all identifiers (tokens that aren't keywords)."""
+    offsets = []
+    offset = 0
+    for node in treemanager.text_nodes():
+        offset += len(node.symbol.name)
+        if node.symbol.name.isidentifier() and node.lookup != node.symbol.name:
+            offsets.append(offset)
+    return offsets
+
+def bench_edits(options, args):
+    """Time renaming identifiers with one batch of edits versus one at a time."""
+    for filename in args:
+        program, lang = read_program(filename, options.lang)
+        results = []
+        for batch in [False, True]:
+            treemanager = setup_treemanager(lang)
+            treemanager.import_file(program)
+            rand = random.Random(options.seed)
+            offsets = identifier_offsets(treemanager)
+            offsets = sorted(rand.sample(offsets, min(options.edits, len(offsets))))
+            edits = [(offset, 0, "_") for offset in offsets]
+            version = treemanager.version
+            start = time.time()
+            if batch:
+                treemanager.apply_edits(edits)
+            else:
+                for edit in reversed(edits):
+                    treemanager.apply_edits([edit])
+            results.append((time.time() - start, treemanager.version - version))
+        print("%s (%s, %s edits): single %.1f ms (%s versions), batch %.1f ms (%s versions)" % (
+            filename, lang, len(edits), results[0][0] * 1000, results[0][1], results[1][0] * 1000, results[1][1]))
+
+# ================================= LEXING ================================= #
+
+def bench_lex(options, args):
+    """Time lexing files repeated to doubling sizes with the batch lexer."""
+    for filename in args:
+        program, lang = read_program(filename, options.lang)
+        _, lexer = lang_dict[lang].load()
+        # newlines and tabs as converted by TreeManager.import_file
+        text = program.replace("\r\n", "\r").replace("\n", "\r").replace("\t", "    ")
+        while True:
+            times = []
+            for i in range(options.runs):
+                start = time.time()
+                tokens = lexer.lexer.lex(text)
+                times.append(time.time() - start)
+            best = min(times)
+            print("%s (%s, %8.1f KiB, %7s tokens): %8.1f ms, %.3f us/char" % (
+                filename, lang, len(text) / 1024.0, len(tokens), best * 1000, best * 1e6 / len(text)))
+            if len(text) >= options.max_size * 1024:
+                break
+            text += text
+
+# ================================ MEMORY ================================== #
+
+# Attributes stored per version by the former full-snapshot history
+legacy_attrs = ["children", "parent", "left", "right", "next_term", "prev_term",
+    "deleted", "indent", "changed", "nested_changes", "nested_errors",
+    "local_error", "textlen", "position", "isolated", "symbol.name", "lookup"]
+
+def legacy_history_size(node):
+    """Size in bytes the node's history would have using the former storage,
+    which saved every attribute under an `(attr, version)` key each time the
+    node was saved."""
+    log = {}
+    size = 0
+    for v in node.versions:
+        for attr in legacy_attrs:
+            try:
+                value = node.get_attr(attr, v)
+            except AttributeError:
+                continue
+            if attr == "children":
+                value = list(value)
+                size += sys.getsizeof(value)
+            log[(attr, v)] = value
+        log[("version", v)] = v
+        if node.is_new(v):
+            log[("new", v)] = True
+    size += sys.getsizeof(log)
+    size += sum(sys.getsizeof(key) for key in log)
+    return size
+
+def bench_memory(options, args):
+    """Compare the size of the node history after a scripted editing session
+    with the size the former full-snapshot storage would have needed."""
+    program, lang = read_program(args[0], options.lang)
+    treemanager = setup_treemanager(lang)
+    treemanager.option_history_limit = options.history_limit
+    start = time.time()
+    treemanager.import_file(program)
+    edit_session(treemanager, options.edits, options.seed)
+    end = time.time()
+    root = treemanager.get_mainparser().previous_version.parent
+    nodes = list(treemanager.get_history_nodes(root))
+    new = sum(n.history_size() for n in nodes)
+    old = sum(legacy_history_size(n) for n in nodes)
+    print("Language:  %s" % lang)
+    print("Edits:     %s (%s versions, %.2fs)" % (options.edits, treemanager.get_max_version(), end - start))
+    print("Snapshots: %s (undo possible back to version %s)" % (len(treemanager.undo_snapshots), treemanager.min_version))
+    print("Nodes:     %s" % len(nodes))
+    print("Legacy:    %10.2f KiB" % (old / 1024.0))
+    print("Current:   %10.2f KiB (%.1f%%)" % (new / 1024.0, 100.0 * new / old))
+
+# ================================= UNDO =================================== #
+
+def bench_undo(options, args):
+    """Measure the latency of undoing and redoing single character edits."""
+    program, lang = read_program(args[0], options.lang)
+    treemanager = setup_treemanager(lang)
+    treemanager.import_file(program)
+    rand = random.Random(options.seed)
+    undo = redo = 0
+    for i in range(options.edits):
+        treemanager.cursor_reset()
+        for _ in range(rand.randrange(len(treemanager.lines))):
+            treemanager.cursor_movement(DOWN)
+        treemanager.key_end()
+        treemanager.key_normal(rand.choice("abcxyz0123"))
+        treemanager.undo_snapshot()
+        start = time.time()
+        treemanager.key_ctrl_z()
+        undo += time.time() - start
+        start = time.time()
+        treemanager.key_shift_ctrl_z()
+        redo += time.time() - start
+    print("Language:  %s" % lang)
+    print("Lines:     %s" % len(treemanager.lines))
+    print("Undo:      %8.3f ms" % (1000 * undo / options.edits))
+    print("Redo:      %8.3f ms" % (1000 * redo / options.edits))
+
+# ================================ STATS =================================== #
+
+def bench_stats(options, args):
+    """Sum up the parse statistics of a scripted editing session."""
+    from incparser.stats import ParseStats
+    program, lang = read_program(args[0], options.lang)
+    treemanager = setup_treemanager(lang)
+    treemanager.import_file(program)
+    start = treemanager.version
+    edit_session(treemanager, options.edits, options.seed)
+    total = ParseStats()
+    parses = 0
+    for v, stats in treemanager.parse_stats.items():
+        if v <= start:
+            continue
+        parses += 1
+        total.merge(stats)
+    print("Language:  %s" % lang)
+    print("Parses:    %s" % parses)
+    for name in ParseStats.counters:
+        print("%-18s %8.1f" % (name + ":", getattr(total, name) / float(parses)))
+    for phase, t in sorted(total.times.items()):
+        print("%-18s %8.3f ms" % (phase + ":", 1000 * t / parses))
+
+# ============================ SYNTAX TABLES =============================== #
+
+def build_syntaxtable(lang, lr_type):
+    """Build the syntax table of a grammar from scratch (bypassing all caches).
+    Returns the parser, the number of conflicts and the time it took."""
+    import io, contextlib
+    from grammar_parser.bootstrap import BootstrapParser
+    from jsonmanager import JsonManager
+    root, _, whitespaces = JsonManager(unescape=True).load(lang.filename)[0]
+    bootstrap = BootstrapParser(lr_type=lr_type, whitespaces=whitespaces)
+    bootstrap.ast = root
+    bootstrap.extra_alternatives = lang.alts
+    bootstrap.change_startrule = lang.extract
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        bootstrap.read_options()
+        bootstrap.parse_both()
+        start = time.time()
+        bootstrap.create_parser()
+        end = time.time()
+    return bootstrap.incparser, output.getvalue().count("conflict"), end - start
+
+def bench_tables(options, args):
+    """Time building the syntax tables of grammars with LR(1) and LALR(1)."""
+    from grammars.grammars import EcoFile
+    from incparser.constants import LR1, LALR
+    if not args:
+        args = sorted(name for name, lang in lang_dict.items() if isinstance(lang, EcoFile) and lang.filename)
+    for name in args:
+        lang = lang_dict[name]
+        results = []
+        for lr_type, label in [(LR1, "LR(1)"), (LALR, "LALR(1)")]:
+            times = []
+            try:
+                for i in range(options.runs):
+                    parser, conflicts, t = build_syntaxtable(lang, lr_type)
+                    times.append(t)
+            except Exception as e:
+                results.append("%s failed (%s)" % (label, e))
+                continue
+            states = parser.syntaxtable.states
+            results.append("%s %8.1f ms, %5s states, %3s conflicts" % (label, min(times) * 1000, states, conflicts))
+        print("%-24s %s | %s" % (name, results[0], results[1]))
+
+def bench_tablesize(options, args):
+    """Report the memory and load time of the compressed syntax tables."""
+    import pickle
+    from grammars.grammars import EcoFile
+    from incparser.constants import LR1
+    if not args:
+        args = sorted(name for name, lang in lang_dict.items() if isinstance(lang, EcoFile) and lang.filename)
+    for name in args:
+        try:
+            parser, _, _ = build_syntaxtable(lang_dict[name], LR1)
+        except Exception as e:
+            print("%-24s failed (%s)" % (name, e))
+            continue
+        table = parser.syntaxtable
+        arrays = [table.base, table.check, table.packed, table.default, table.default_on, table.may_reduce]
+        size = sum(a.itemsize * len(a) if hasattr(a, "itemsize") else len(a) for a in arrays)
+        # a flat array of all actions plus one byte per entry for may_reduce
+        dense = table.states * table.width * 5
+        data = pickle.dumps(table)
+        times = []
+        for i in range(options.runs):
+            start = time.time()
+            pickle.loads(data)
+            times.append(time.time() - start)
+        print("%-24s %5s states, %4s symbols: %7.1f KB (dense %7.1f KB), pickled %7.1f KB, load %6.2f ms" % (
+            name, table.states, table.width, size / 1024, dense / 1024, len(data) / 1024, min(times) * 1000))
+
+commands = {
+    "parse": (bench_parse, "FILE..."),
+    "import": (bench_import, "FILE..."),
+    "recovery": (bench_recovery, "FILE..."),
+    "edits": (bench_edits, "FILE..."),
+    "lex": (bench_lex, "FILE..."),
+    "memory": (bench_memory, "FILE"),
+    "undo": (bench_undo, "FILE"),
+    "stats": (bench_stats, "FILE"),
+    "tables": (bench_tables, "[LANGUAGE...]"),
+    "tablesize": (bench_tablesize, "[LANGUAGE...]"),
+}
+
+if __name__ == "__main__":
+    usage = "usage: python3 %prog COMMAND [options] [args]\n\nCommands:\n"
+    for name in sorted(commands):
+        usage += "  %s %s\n      %s\n" % (name, commands[name][1], commands[name][0].__doc__.split("\n")[0])
+    optp = OptionParser(usage=usage)
+    optp.add_option("-l", "--lang", default=None, help="Language name (default: guessed from file extension)")
+    optp.add_option("-e", "--edits", type="int", default=200, help="Number of edits in editing sessions (default: %default)")
+    optp.add_option("-s", "--seed", type="int", default=0, help="Random seed for editing sessions (default: %default)")
+    optp.add_option("-r", "--runs", type="int", default=5, help="Number of runs, reporting the fastest (default: %default)")
+    optp.add_option("-t", "--trace", action="store_true", default=False, help="Parse with debug tracing compiled in (but logging disabled)")
+    optp.add_option("-m", "--max-size", type="int", default=4096, help="Size in KiB up to which inputs are doubled when lexing (default: %default)")
+    optp.add_option("-H", "--history-limit", type="int", default=None, help="Maximum number of undo snapshots to keep (default: unbounded)")
+    (options, args) = optp.parse_args()
+
+    if len(args) < 1 or args[0] not in commands:
+        optp.print_help()
+        sys.exit(1)
+
+    command = commands[args[0]][0]
+    command(options, args[1:])
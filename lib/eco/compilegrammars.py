@@ -0,0 +1,69 @@
+"""Compile the grammars of all languages into a bundle, so that starting Eco
+and opening files doesn't need to build any syntax tables or lexers.
+
+Usage: python3 compilegrammars.py [options] [LANGUAGE...]
+
+Without arguments every language registered in grammars/grammars.py
+(including those from grammars/include/*.json) is compiled. The bundle is
+written to the user's cache directory, or to the file given by --output or
+the ECO_GRAMMAR_BUNDLE environment variable, from where EcoFile.load reads it.
+Languages whose grammar changes after compiling are built as usual until the
+bundle is compiled again.
+
+The grammars are found relative to this file, so the script can be run from
+any directory."""
+
+import sys
+import contextlib
+import time
+from optparse import OptionParser
+
+from grammars.grammars import lang_dict, EcoFile
+from grammars import bundle
+
+def compile_grammars(names, path=None):
+    """Compile the languages `names` into the bundle at `path`, keeping the
+    other languages already bundled there. Yields the name and compile time of
+    each language, or the exception it failed with."""
+    languages = bundle.read(path)
+    try:
+        for name in names:
+            lang = lang_dict[name]
+            start = time.time()
+            try:
+                with contextlib.redirect_stdout(sys.stderr):
+                    b = lang.compile()
+            except Exception as e:
+                yield name, e
+                continue
+            syntaxtable, whitespace = b.incparser.syntaxtable, b.incparser.whitespaces
+            languages[name] = bundle.entry(lang, syntaxtable, whitespace, b.inclexer, b.lexer_rules)
+            yield name, time.time() - start
+    finally:
+        bundle.write(languages, path)
+        bundle.reset()
+
+def main():
+    usage = "usage: python3 %prog [options] [LANGUAGE...]"
+    optp = OptionParser(usage=usage)
+    optp.add_option("-o", "--output", default=None, help="Bundle file to write (default: %s)" % bundle.bundle_path())
+    (options, args) = optp.parse_args()
+
+    names = args or sorted(name for name, lang in lang_dict.items() if isinstance(lang, EcoFile) and lang.filename)
+    for name in names:
+        if not isinstance(lang_dict.get(name), EcoFile):
+            sys.stderr.write("Unknown language: %s\n" % name)
+            sys.exit(1)
+
+    failed = 0
+    for name, result in compile_grammars(names, options.output):
+        if isinstance(result, Exception):
+            failed += 1
+            print("%-28s failed (%s: %s)" % (name, type(result).__name__, result))
+        else:
+            print("%-28s %6.2fs" % (name, result))
+    print("Wrote %s" % (options.output or bundle.bundle_path()))
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -515,9 +515,8 @@ class GraphRenderer:
             commands.append(cmd)
             if node.name in self.highlightwords:
                 realnode = self.highlightwords[node.name]
-                try:
-                    v = int(realnode.get_attr("version", self.graphlayout.pgviewer.version))
-                except AttributeError:
+                v = realnode.find_version(self.graphlayout.pgviewer.version)
+                if v is None:
                     v = int(realnode.version)
                 try:
                     changed = int(realnode.get_attr("changed", self.graphlayout.pgviewer.version))
@@ -328,6 +328,8 @@ class SettingsView(QMainWindow):
         self.ui.app_fontsize.setValue(size)
         self.ui.app_theme.setCurrentIndex(settings.value("app_themeindex", 0, type=int))
         self.ui.app_custom.setChecked(settings.value("app_custom", False, type=bool))
+        self.ui.gen_reparse_delay.setValue(settings.value("reparse_delay", 0, type=int))
+        self.ui.gen_background_parse.setChecked(settings.value("background_parse", False, type=bool))
         self.foreground = settings.value("app_foreground", "#000000", type=str)
         self.background = settings.value("app_background", "#ffffff", type=str)
         self.change_color(self.ui.app_foreground, self.foreground)
@@ -379,6 +381,8 @@ class SettingsView(QMainWindow):
         settings.setValue("app_foreground", self.foreground)
         settings.setValue("app_background", self.background)
         settings.setValue("highlight_line", self.ui.app_highlight_line.isChecked())
+        settings.setValue("reparse_delay", self.ui.gen_reparse_delay.value())
+        settings.setValue("background_parse", self.ui.gen_background_parse.isChecked())
         # Profiling pane.
         settings.setValue("tool-font-family", self.ui.tool_info_fontfamily.currentFont().family())
         settings.setValue("tool-font-size", self.ui.tool_info_fontsize.value())
@@ -418,6 +422,8 @@ class SettingsView(QMainWindow):
         app.heatmap_high = settings.value("heatmap_high")
         app.heatmap_alpha = settings.value("heatmap_alpha")
         app.graalvm_pic_size = settings.value("graalvm_pic_size")
+        app.reparse_delay = settings.value("reparse_delay", 0, type=int)
+        app.background_parse = settings.value("background_parse", False, type=bool)
 
         self.window.refreshTheme()
         self.close()
@@ -923,12 +929,19 @@ class Window(QMainWindow):
 
 
     def preload(self):
+        from grammars.preload import preload
+        langs = []
         for l in newfile_langs + submenu_langs:
-            try:
-                print("Preloading %s" % (l.name))
-                l.load()
-            except AttributeError:
-                pass
+            if l not in langs:
+                langs.append(l)
+        loaded = []
+        def progress(lang, error):
+            loaded.append(lang)
+            if error is None:
+                print("Preloaded %s (%s/%s)" % (lang.name, len(loaded), len(langs)))
+            elif not isinstance(error, AttributeError):
+                print("Failed to preload %s: %s" % (lang.name, error))
+        preload(langs, progress=progress)
 
     def cli_export(self, source, dest, fast):
         print("Exporting...")
@@ -1648,6 +1661,8 @@ def main():
     app.heatmap_high = settings.value("heatmap_high")
     app.heatmap_alpha = settings.value("heatmap_alpha")
     app.graalvm_pic_size = settings.value("graalvm_pic_size")
+    app.reparse_delay = settings.value("reparse_delay", 0, type=int)
+    app.background_parse = settings.value("background_parse", False, type=bool)
 
     app.showindent = False
 
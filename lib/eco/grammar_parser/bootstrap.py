@@ -460,8 +460,9 @@ class BootstrapParser(object):
         for t in undefined_terminals:
             names.insert(0, t)
             regexs.insert(0,re.escape(t))
+        self.lexer_rules = (names, regexs)
         if not buildlexer:
-            self.inclexer = (names, regexs)
+            self.inclexer = self.lexer_rules
             return
         self.inclexer = IncrementalLexerCF()
         self.inclexer.from_name_and_regex(names, regexs)
@@ -0,0 +1,114 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Bundle of precompiled grammars (see compilegrammars.py).
+
+The bundle maps each language's name to its compiled syntax table, lexer,
+lexer rules and whitespace setting, together with a key of the grammar's
+content, so that EcoFile.load can use them without running the bootstrap
+parser. Languages are only unpickled when they are loaded and are ignored if
+their grammar changed since the bundle was created."""
+
+import os
+import pickle
+import hashlib
+import tempfile
+import logging
+
+from incparser import tablecache
+
+# Needs to be increased whenever the format or the compiled grammars change
+FORMAT_VERSION = 3
+
+_bundle = None
+
+def bundle_path():
+    path = os.environ.get("ECO_GRAMMAR_BUNDLE")
+    if path:
+        return path
+    return os.path.join(tablecache.cache_dir(), "grammars.bundle")
+
+def grammar_key(lang):
+    """Return a key identifying the content of an EcoFile's grammar."""
+    m = hashlib.sha256()
+    m.update(("%s|%s|" % (FORMAT_VERSION, tablecache.FORMAT_VERSION)).encode("utf-8"))
+    m.update(lang.pickleid(None).encode("utf-8"))
+    return m.hexdigest()
+
+def read(path=None):
+    """Return the languages of a bundle (or an empty dict if there is no
+    bundle)."""
+    if path is None:
+        path = bundle_path()
+    try:
+        with open(path, "rb") as f:
+            version, languages = pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logging.warning("Ignoring grammar bundle %s: %s", path, e)
+        return {}
+    if version != FORMAT_VERSION:
+        return {}
+    return languages
+
+def write(languages, path=None):
+    """Atomically write a bundle of `languages`, a dict of language names and
+    entries created by `entry`."""
+    if path is None:
+        path = bundle_path()
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmpname = tempfile.mkstemp(".tmp", os.path.basename(path), directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((FORMAT_VERSION, languages), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpname, path)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+def entry(lang, syntaxtable, whitespace, lexer, lexer_rules):
+    data = pickle.dumps((syntaxtable, whitespace, lexer, lexer_rules), pickle.HIGHEST_PROTOCOL)
+    return (grammar_key(lang), data)
+
+def load(lang):
+    """Return the syntax table, whitespace setting, lexer and lexer rules of an
+    EcoFile from the bundle, or None if it isn't bundled or its grammar has
+    changed."""
+    global _bundle
+    if _bundle is None:
+        _bundle = read()
+    if lang.name not in _bundle:
+        return None
+    key, data = _bundle[lang.name]
+    try:
+        if key != grammar_key(lang):
+            logging.debug("Bundled grammar of %s is outdated", lang.name)
+            return None
+    except OSError:
+        return None
+    return pickle.loads(data)
+
+def reset():
+    """Forget the bundle that has been read (e.g. after it was rewritten)."""
+    global _bundle
+    _bundle = None
@@ -20,6 +20,9 @@
 # IN THE SOFTWARE.
 
 import os, json
+import threading
+from collections.abc import Sequence
+from incparser.constants import LR1
 
 try:
     import __pypy__
@@ -60,13 +63,21 @@ class EcoFile(object):
         self.auto_exclude = None
         self.nb_file = os.path.splitext(filename)[0] + ".nb"
         self.auto_limit_new = False
+        self.lr_type = LR1
 
     def load(self, buildlexer=True):
-        from grammar_parser.bootstrap import BootstrapParser
-        from jsonmanager import JsonManager
         from incparser.incparser import IncParser
+        from grammars import bundle
 
-        if self.name + "::parser" in _cache:
+        # Without building the lexer only its rules are returned (names and
+        # regular expressions), see BootstrapParser.create_lexer
+        lexer_key = self.name + ("::lexer" if buildlexer else "::lexrules")
+        if not self.is_cached(buildlexer):
+            compiled = bundle.load(self)
+            if compiled is not None:
+                self.add_to_cache(*compiled)
+
+        if self.is_cached(buildlexer):
 
             syntaxtable, whitespaces = _cache[self.name + "::parser"]
             incparser = IncParser()
@@ -75,36 +86,58 @@ class EcoFile(object):
             incparser.init_ast()
             incparser.lang = self.name
 
-            inclexer = _cache[self.name + "::lexer"]
+            inclexer = _cache[lexer_key]
             incparser.lexer = inclexer # give parser a reference to its lexer (needed for multiline comments)
             incparser.previous_version.parent.name = self.name
 
             return (incparser, inclexer)
         else:
-            manager = JsonManager(unescape=True)
-            root, language, whitespaces = manager.load(self.filename)[0]
+            bootstrap = self.compile(buildlexer)
+            return (bootstrap.incparser, bootstrap.inclexer)
 
-            bootstrap = BootstrapParser(lr_type=1, whitespaces=whitespaces)
-            bootstrap.ast = root
-            bootstrap.extra_alternatives = self.alts
-            bootstrap.change_startrule = self.extract
-            bootstrap.read_options()
-            whitespace = bootstrap.implicit_ws()
+    def is_cached(self, buildlexer=True):
+        lexer_key = self.name + ("::lexer" if buildlexer else "::lexrules")
+        return self.name + "::parser" in _cache and lexer_key in _cache
+
+    def add_to_cache(self, syntaxtable, whitespace, inclexer, lexer_rules):
+        """Add a compiled grammar (e.g. from the grammar bundle or another
+        process) to the grammar cache."""
+        _cache[self.name + "::lexer"] = inclexer
+        _cache[self.name + "::lexrules"] = lexer_rules
+        _cache[self.name + "::parser"] = (syntaxtable, whitespace)
+
+    def compile(self, buildlexer=True):
+        """Build the parser and lexer of this grammar with the bootstrap
+        parser and add them to the grammar cache."""
+        from grammar_parser.bootstrap import BootstrapParser
+        from jsonmanager import JsonManager
 
-            pickle_id = self.pickleid(whitespace)
+        manager = JsonManager(unescape=True)
+        root, language, whitespaces = manager.load(self.filename)[0]
 
-            bootstrap.parse_both()
-            bootstrap.create_parser(pickle_id)
-            bootstrap.create_lexer(buildlexer)
+        bootstrap = BootstrapParser(lr_type=self.lr_type, whitespaces=whitespaces)
+        bootstrap.ast = root
+        bootstrap.extra_alternatives = self.alts
+        bootstrap.change_startrule = self.extract
+        bootstrap.read_options()
+        whitespace = bootstrap.implicit_ws()
 
+        pickle_id = self.pickleid(whitespace)
+
+        bootstrap.parse_both()
+        bootstrap.create_parser(pickle_id)
+        bootstrap.create_lexer(buildlexer)
+
+        if buildlexer:
             _cache[self.name + "::lexer"] = bootstrap.inclexer
-            _cache[self.name + "::json"] = (root, language, whitespaces)
-            _cache[self.name + "::parser"] = (bootstrap.incparser.syntaxtable, whitespace)
+        _cache[self.name + "::lexrules"] = bootstrap.lexer_rules
+        _cache[self.name + "::json"] = (root, language, whitespaces)
+        _cache[self.name + "::parser"] = (bootstrap.incparser.syntaxtable, whitespace)
 
-            bootstrap.incparser.lang = self.name
-            bootstrap.incparser.previous_version.parent.name = self.name
-            bootstrap.incparser.lexer = bootstrap.inclexer
-            return (bootstrap.incparser, bootstrap.inclexer)
+        bootstrap.incparser.lang = self.name
+        bootstrap.incparser.previous_version.parent.name = self.name
+        bootstrap.incparser.lexer = bootstrap.inclexer
+        return bootstrap
 
     def add_alternative(self, nonterminal, language):
         if isinstance(language, EcoFile):
@@ -167,6 +200,8 @@ class EcoFile(object):
             return False
         if self.nb_file != other.nb_file:
             return False
+        if self.lr_type != other.lr_type:
+            return False
         return True
 
     def pickleid(self, whitespace):
@@ -177,70 +212,186 @@ class EcoFile(object):
             m.update(repr(self.alts).encode("latin-1"))
             m.update(str(self.extract).encode("latin-1"))
             m.update(str(whitespace).encode("latin-1"))
+            if self.lr_type != LR1:
+                m.update(str(self.lr_type).encode("latin-1"))
             return m.hexdigest()
 
-languages = []
-newfile_langs = []
-submenu_langs = []
-lang_dict = {}
+class LanguageRegistry(dict):
+    """Dictionary of all languages by name that creates languages when they
+    are first looked up.
+
+    The configs in grammars/include are only indexed (by the names of the
+    languages they define) when a language is first looked up or all
+    languages are listed. A language's EcoFile is only created, and its
+    compositions resolved, when it is looked up. Iterating over the registry
+    or listing its items creates all languages."""
+
+    def __init__(self):
+        dict.__init__(self)
+        self.lock = threading.RLock()
+        self.index = None   # name -> function creating the language
+        self.order = []     # names in the order they have been registered
+        self.new = set()    # names shown in the new file dialog
+        self.sub = set()    # names shown in the language box menu
+
+    def build_index(self):
+        with self.lock:
+            if self.index is not None:
+                return
+            self.index = {}
+            self.register(regex.name, lambda: regex, True, False)
+            if not __pypy__:
+                self.register("Ruby", create_ruby, True, True)
+            for root, dirs, files in os.walk(include_dir):
+                dirs.sort()
+                for filename in sorted(files):
+                    if not filename.endswith(".json"):
+                        continue
+                    with open(os.path.join(root, filename)) as f:
+                        self.index_config(json.load(f), filename)
+
+    def index_config(self, cfg, filename):
+        for c in cfg.get("compositions", []):
+            if "file" in c:
+                self.index_config(c, filename)
+        visibility = cfg["visibility"]
+        self.register(cfg["name"], lambda: self.create_from_config(cfg, filename),
+                      "newfile" in visibility, "submenu" in visibility, cfg)
+        return cfg["name"]
+
+    def register(self, name, create, new=False, sub=False, cfg=None):
+        with self.lock:
+            if name in self.index:
+                # if two language definitions are identical we only need to
+                # add one of them
+                if cfg is not None and self.index[name][1] == cfg:
+                    return
+                raise ValueError("Multiple definitions for language '{}'".format(name))
+            self.index[name] = (create, cfg)
+            self.order.append(name)
+            if new:
+                self.new.add(name)
+            if sub:
+                self.sub.add(name)
+
+    def create_from_config(self, cfg, filename):
+        main = EcoFile(cfg["name"], os.path.join(eco_dir, cfg["file"]), cfg["base"])
+        if "limit_historic_tokens" in cfg:
+            main.auto_limit_new = cfg["limit_historic_tokens"]
+        if "subset" in cfg and cfg["subset"]:
+            main.change_start(cfg["subset"])
+        if "custom_namebinding" in cfg:
+            main.set_custom_nb(cfg["custom_namebinding"])
+        for c in cfg.get("compositions", []):
+            if c["name"] not in self:
+                raise ValueError("Error in '{}': Referenced language '{}' doesn't exist.".format(filename, c["name"]))
+            main.add_alternative(c["location"], c["name"])
+        return main
+
+    def __missing__(self, name):
+        self.build_index()
+        with self.lock:
+            if dict.__contains__(self, name):
+                return dict.__getitem__(self, name)
+            if name not in self.index:
+                raise KeyError(name)
+            lang = self.index[name][0]()
+            dict.__setitem__(self, name, lang)
+            return lang
+
+    def __contains__(self, name):
+        if dict.__contains__(self, name):
+            return True
+        self.build_index()
+        return name in self.index
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def load_all(self):
+        """Create all languages that haven't been looked up yet."""
+        self.build_index()
+        for name in list(self.order):
+            self[name]
+
+    def languages(self, names=None):
+        self.load_all()
+        return [self[name] for name in self.order if names is None or name in names]
+
+    def __iter__(self):
+        self.load_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self.load_all()
+        return dict.__len__(self)
+
+    def keys(self):
+        self.load_all()
+        return dict.keys(self)
+
+    def values(self):
+        self.load_all()
+        return dict.values(self)
+
+    def items(self):
+        self.load_all()
+        return dict.items(self)
+
+class LanguageList(Sequence):
+    """Read-only list of the registered languages that only creates the
+    languages when it is used (see LanguageRegistry)."""
+
+    def __init__(self, registry, names=None):
+        self.registry = registry
+        self.names = names
+
+    def list(self):
+        return self.registry.languages(self.names)
+
+    def __getitem__(self, i):
+        return self.list()[i]
+
+    def __len__(self):
+        return len(self.list())
+
+    def __iter__(self):
+        return iter(self.list())
+
+    def __add__(self, other):
+        return self.list() + list(other)
+
+    def __radd__(self, other):
+        return list(other) + self.list()
+
+def create_ruby():
+    from rubyparser.rubyparser import RubyProxy
+    return RubyProxy()
 
 def add_lang(lang, new=False, sub=False):
-    if lang in languages:
-        # if two language definitions are identical we only need to add one of
-        # them
+    """Register a language that has already been created."""
+    lang_dict.build_index()
+    if lang.name in lang_dict.index and lang_dict[lang.name] == lang:
         return
-    languages.append(lang)
-    if lang.name in lang_dict:
-        print("Error: Multiple definitions for language '{}'".format(lang))
-        exit()
-    lang_dict[lang.name] = lang
-    if new:
-        newfile_langs.append(lang)
-    if sub:
-        submenu_langs.append(lang)
-
-regex = EcoFile("Regex", "grammars/regex.eco", "Regex")
-add_lang(regex, True, False)
-
-if not __pypy__:
-    from rubyparser.rubyparser import RubyProxy
-    ruby = RubyProxy()
-    add_lang(ruby, True, True)
-
-# import languages from grammars/include
+    lang_dict.register(lang.name, lambda: lang, new, sub)
 
 def create_grammar_from_config(cfg, filename):
-    main = EcoFile(cfg["name"], cfg["file"], cfg["base"])
-    if "limit_historic_tokens" in cfg:
-        main.auto_limit_new = cfg["limit_historic_tokens"]
-    if "subset" in cfg and cfg["subset"]:
-        main.change_start(cfg["subset"])
-    if "custom_namebinding" in cfg:
-        main.set_custom_nb(cfg["custom_namebinding"])
-    if "compositions" in cfg:
-        for c in cfg["compositions"]:
-            if "file" not in c:
-                sub = c["name"]
-                reused.append((filename, sub))
-            else:
-                sub = create_grammar_from_config(c, filename)
-            main.add_alternative(c["location"], sub)
-    show_newfile = "newfile" in cfg["visibility"]
-    show_submenu = "submenu" in cfg["visibility"]
-    add_lang(main, show_newfile, show_submenu)
-    return main.name
-
-reused = []
-for root, _, files in os.walk("grammars/include/"):
-    for filename in files:
-        with open(os.path.join(root, filename)) as f:
-            grmcfg = json.load(f)
-            create_grammar_from_config(grmcfg, filename)
-    error = False
-
-for r in reused:
-    if not r[1] in lang_dict:
-        error = True
-        print("Error in '{}': Referenced language '{}' doesn't exist.".format(r[0], r[1]))
-if error:
-    exit()
+    """Register the languages of a composition config (e.g. a file in
+    grammars/include) and return the name of its main language."""
+    lang_dict.build_index()
+    name = lang_dict.index_config(cfg, filename)
+    lang_dict[name]
+    return name
+
+eco_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+include_dir = os.path.join(eco_dir, "grammars", "include")
+
+regex = EcoFile("Regex", os.path.join(eco_dir, "grammars", "regex.eco"), "Regex")
+
+lang_dict = LanguageRegistry()
+languages = LanguageList(lang_dict)
+newfile_langs = LanguageList(lang_dict, lang_dict.new)
+submenu_langs = LanguageList(lang_dict, lang_dict.sub)
@@ -0,0 +1,94 @@
+# Copyright (c) 2012--2014 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Load the grammars of many languages at once.
+
+Grammars that are in the grammar cache or the grammar bundle are loaded
+directly. All others are compiled in a pool of worker processes (which also
+load their syntax tables from the table cache if possible), and the tables
+and lexers they send back are added to the grammar cache of this process."""
+
+import sys
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from grammars.grammars import lang_dict, EcoFile
+from grammars import bundle
+
+def compile_language(name):
+    """Compile a language in a worker process and return what is added to the
+    grammar cache (see EcoFile.add_to_cache)."""
+    with contextlib.redirect_stdout(sys.stderr):
+        b = lang_dict[name].compile()
+    return (b.incparser.syntaxtable, b.incparser.whitespaces, b.inclexer, b.lexer_rules)
+
+def preload(langs, jobs=None, progress=None):
+    """Load the grammars of `langs` into the grammar cache, using up to `jobs`
+    processes (default: one per core). `progress(lang, error)` is called
+    whenever a language has been loaded, with the exception it failed with or
+    None."""
+    if progress is None:
+        progress = lambda lang, error: None
+    missing = []
+    for lang in langs:
+        if not isinstance(lang, EcoFile):
+            # e.g. languages that are parsed externally
+            try:
+                lang.load()
+            except Exception as e:
+                progress(lang, e)
+            else:
+                progress(lang, None)
+            continue
+        if not lang.is_cached():
+            # Bundled grammars are unpickled here rather than in the pool: a
+            # worker would have to pickle them again to send them back, which
+            # costs more than unpickling them (a few ms per grammar)
+            compiled = bundle.load(lang)
+            if compiled is None:
+                missing.append(lang)
+                continue
+            lang.add_to_cache(*compiled)
+        progress(lang, None)
+
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if jobs <= 1 or len(missing) <= 1:
+        for lang in missing:
+            try:
+                lang.add_to_cache(*compile_language(lang.name))
+            except Exception as e:
+                progress(lang, e)
+            else:
+                progress(lang, None)
+        return
+
+    with ProcessPoolExecutor(min(jobs, len(missing))) as executor:
+        futures = dict((executor.submit(compile_language, lang.name), lang) for lang in missing)
+        for future in as_completed(futures):
+            lang = futures[future]
+            try:
+                lang.add_to_cache(*future.result())
+            except Exception as e:
+                progress(lang, e)
+            else:
+                progress(lang, None)
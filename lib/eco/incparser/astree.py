@@ -20,6 +20,8 @@
 # IN THE SOFTWARE.
 
 import re
+import sys
+from bisect import bisect_left, bisect_right
 from grammar_parser.gparser import Nonterminal, Terminal, IndentationTerminal
 from .syntaxtable import FinishSymbol
 
@@ -40,31 +42,10 @@ class AST(object):
     def get_bos(self):
         return self.parent.children[0]
 
-    def find_node_at_pos(self, pos, node=None): #recursive
-        if node is None:
-           node = self.parent.children[1]
-
-        if isinstance(node.symbol, Nonterminal):
-            for child in node.children:
-                result = self.find_node_at_pos(pos, child)
-                if result:
-                    return result
-
-        if node.pos + len(node.symbol.name) >= pos:
-            return node
-
-
-    def find_node_at_pos_iterative(self, pos): #not working
-        stack = []
-        stack.append(self.parent.children[1]) # skip bos
-        #XXX speed things up later by having a list/dict of all terminal nodes
-        while stack != []:
-            e = stack.pop(0)
-            if isinstance(e.symbol, Nonterminal):
-                stack.extend(e.children)
-                continue
-            if e.pos + len(e.symbol.name) >= pos:
-                return e
+    def find_node_at_pos(self, pos, version=None):
+        """Find the terminal left of character offset `pos` (see
+        OffsetIndex.node_at)."""
+        return OffsetIndex(version).node_at(self.parent, pos)
 
     def find_common_parent(self, start, end):
         start_parents = []
@@ -103,8 +84,89 @@ class AST(object):
         self.parent.cprint(output)
         return "\n".join(output)
 
+class OffsetIndex(object):
+    """Answers character offset queries on one version of a parse tree. The
+    offsets of nodes and the offsets of children relative to their parents are
+    cached, so once the spine of a node has been seen, looking up its offset
+    only needs to walk up to the first known ancestor, and finding the node at
+    an offset is a binary search per tree level. The index becomes invalid as
+    soon as the tree in that version changes."""
+
+    def __init__(self, version=None):
+        self.version = version
+        self.offsets = {}   # node -> character offset
+        self.children = {}  # parent -> (children, offsets relative to parent)
+        self.indices = {}   # node -> position in its parent's children
+
+    def child_offsets(self, parent):
+        entry = self.children.get(parent)
+        if entry is None:
+            children = parent.get_attr("children", self.version)
+            starts = []
+            offset = 0
+            for i, child in enumerate(children):
+                starts.append(offset)
+                offset += child.textlength(self.version)
+                self.indices[child] = i
+            entry = self.children[parent] = (children, starts)
+        return entry
+
+    def offset(self, node):
+        """Get the character offset of `node`."""
+        version = self.version
+        path = []
+        while node not in self.offsets:
+            parent = node.get_attr("parent", version)
+            if parent is None:
+                # reached the root
+                self.offsets[node] = 0
+                break
+            # offset within the parent
+            children, starts = self.child_offsets(parent)
+            path.append((node, starts[self.indices[node]]))
+            node = parent
+        offset = self.offsets[node]
+        for node, relative in reversed(path):
+            offset += relative
+            self.offsets[node] = offset
+        return offset
+
+    def node_at(self, root, pos):
+        """Find the terminal left of character offset `pos` below `root`, i.e.
+        the one whose text contains the character before `pos`. Returns BOS for
+        offset 0 and None if `pos` is outside of the tree."""
+        if pos < 0 or pos > root.textlength(self.version):
+            return None
+        node = root
+        while True:
+            children, starts = self.child_offsets(node)
+            if not children:
+                return node
+            i = bisect_left(starts, pos) - 1
+            if i < 0:
+                # zero-length nodes at the start, e.g. BOS
+                i = 0
+            pos -= starts[i]
+            node = children[i]
+
+def unchanged(old, new):
+    """Checks if a value saved in a node's history is still the same. Nodes are
+    compared by identity (Node.__eq__ compares entire subtrees)."""
+    if old is new:
+        return True
+    if type(old) is not type(new) or isinstance(old, Node):
+        return False
+    if type(old) is list:
+        if len(old) != len(new):
+            return False
+        for a, b in zip(old, new):
+            if not unchanged(a, b):
+                return False
+        return True
+    return old == new
+
 class Node(object):
-    __slots__ = ["symbol", "state", "parent", "left", "right", "prev_term", "next_term", "magic_parent", "children", "annotations", "log", "max_version"]
+    __slots__ = ["symbol", "state", "parent", "left", "right", "prev_term", "next_term", "magic_parent", "children", "annotations", "log", "versions", "max_version"]
     def __init__(self, symbol, state, children):
         self.symbol = symbol
         self.state = state
@@ -118,6 +180,7 @@ class Node(object):
             children = []
         self.set_children(children)
         self.log = {}
+        self.versions = [] # sorted list of versions this node was saved in
         self.max_version = None
         self.annotations = []
 
@@ -187,80 +250,241 @@ class Node(object):
                 break
 
     def save(self, version):
-        # XXX version set, e.g. set(0,1,5,6,9) that contains all versions in
-        # which this node has been saved. this way we can easily check if a
-        # the node has changes in that version and quickly get the closest
-        # versions to it if not
-        self.log[("children", version)] = list(self.children)
-        self.log[("parent", version)] = self.parent
-        self.log[("left", version)] = self.left
-        self.log[("right", version)] = self.right
-        self.log[("next_term", version)] = self.next_term
-        self.log[("prev_term", version)] = self.prev_term
-        self.log[("deleted", version)] = self.deleted
-        self.log[("indent", version)] = self.indent
-        self.log[("changed", version)] = self.changed
-        self.log[("nested_changes", version)] = self.nested_changes
-        self.log[("nested_errors", version)] = self.nested_errors
-        self.log[("local_error", version)] = self.local_error
-        self.log[("textlen", version)] = self.textlen
-        self.log[("position", version)] = self.position
-        self.log[("isolated", version)] = self.isolated
-        self.log[("version", version)] = version
+        self.add_version(version)
+        self.record("children", version, list(self.children))
+        self.record("parent", version, self.parent)
+        self.record("left", version, self.left)
+        self.record("right", version, self.right)
+        self.record("next_term", version, self.next_term)
+        self.record("prev_term", version, self.prev_term)
+        self.record("deleted", version, self.deleted)
+        self.record("indent", version, self.indent)
+        self.record("changed", version, self.changed)
+        self.record("nested_changes", version, self.nested_changes)
+        self.record("nested_errors", version, self.nested_errors)
+        self.record("local_error", version, self.local_error)
+        self.record("textlen", version, self.textlen)
+        self.record("position", version, self.position)
+        self.record("isolated", version, self.isolated)
         if self.new:
-            self.log[("new", version)] = True
+            self.record("new", version, True)
             self.new = False
         # XXX save lookback
         self.version = version
 
+    def add_version(self, version):
+        """Record that this node has been saved in `version`, keeping
+        `self.versions` sorted."""
+        versions = self.versions
+        if not versions or versions[-1] < version:
+            versions.append(version)
+            return
+        i = bisect_left(versions, version)
+        if i == len(versions) or versions[i] != version:
+            versions.insert(i, version)
+
+    def find_version(self, version):
+        """Return the latest version smaller or equal to `version` in which
+        this node has been saved, or None if there is no such version."""
+        i = bisect_right(self.versions, version)
+        if i == 0:
+            return None
+        return self.versions[i-1]
+
+    def next_version(self, version):
+        """Return the earliest version greater than `version` in which this
+        node has been saved, or None if there is no such version."""
+        i = bisect_right(self.versions, version)
+        if i == len(self.versions):
+            return None
+        return self.versions[i]
+
+    # The history of a node only stores the values of attributes that differ
+    # from the previously saved version. For each attribute `self.log` holds
+    # either a single `(version, value)` tuple or, once the attribute has
+    # changed, a pair of lists `[versions, values]` sorted by version. The
+    # value of an attribute in a version is the value stored under the latest
+    # version smaller or equal to it.
+
+    def get_history(self, attr):
+        entry = self.log.get(attr)
+        if entry is None:
+            return [], []
+        if type(entry) is tuple:
+            return [entry[0]], [entry[1]]
+        return entry[0], entry[1]
+
+    def set_history(self, attr, versions, values):
+        if not versions:
+            self.log.pop(attr, None)
+        elif len(versions) == 1:
+            self.log[attr] = (versions[0], values[0])
+        else:
+            self.log[attr] = [versions, values]
+
+    def record(self, attr, version, value):
+        """Save `value` as the value of `attr` in `version`, unless it's the
+        same as in the previously saved version."""
+        entry = self.log.get(attr)
+        if entry is None:
+            self.log[attr] = (version, value)
+            return
+        if version != self.versions[-1]:
+            # Saving into the middle of the history
+            self.set_attr(attr, version, value)
+            return
+        if type(entry) is tuple:
+            last_version, last = entry
+            if last_version == version:
+                self.log[attr] = (version, value)
+            elif last_version > version:
+                self.set_attr(attr, version, value)
+            elif not unchanged(last, value):
+                self.log[attr] = [[last_version, version], [last, value]]
+        else:
+            versions, values = entry
+            if versions[-1] == version:
+                values[-1] = value
+            elif versions[-1] > version:
+                self.set_attr(attr, version, value)
+            elif not unchanged(values[-1], value):
+                versions.append(version)
+                values.append(value)
+
+    def set_attr(self, attr, version, value):
+        """Overwrite the value of `attr` in `version`. Saved versions after
+        `version` keep their previous value."""
+        versions, values = self.get_history(attr)
+        i = bisect_left(versions, version)
+        if i < len(versions) and versions[i] == version:
+            values[i] = value
+            self.set_history(attr, versions, values)
+            return
+        if i > 0:
+            # Later versions might share the value of the previous entry.
+            # Store it explicitly for the next saved version to retain it.
+            nxt = self.next_version(version)
+            if nxt is not None and (i == len(versions) or versions[i] > nxt):
+                versions.insert(i, nxt)
+                values.insert(i, values[i-1])
+        versions.insert(i, version)
+        values.insert(i, value)
+        self.set_history(attr, versions, values)
+
+    def unset_attr(self, attr, version):
+        """Remove the value of `attr` stored for `version`. Saved versions
+        after `version` keep their value."""
+        versions, values = self.get_history(attr)
+        i = bisect_left(versions, version)
+        if i == len(versions) or versions[i] != version:
+            return
+        nxt = self.next_version(version)
+        if nxt is not None and (i + 1 == len(versions) or versions[i+1] > nxt):
+            versions[i] = nxt
+        else:
+            del versions[i]
+            del values[i]
+        self.set_history(attr, versions, values)
+
     def load(self, version):
-        while version >= 0:
-            if ("parent", version) in self.log:
-                self.parent = self.log[("parent", version)]
-                self.children = list(self.log[("children", version)])
-                self.left = self.log[("left", version)]
-                self.right = self.log[("right", version)]
-                self.next_term = self.log[("next_term", version)]
-                self.prev_term = self.log[("prev_term", version)]
-                self.deleted = self.log[("deleted", version)]
-                self.indent = self.log[("indent", version)]
-                self.changed = self.log[("changed", version)]
-                self.nested_changes = self.log[("nested_changes", version)]
-                self.local_error = self.log[("local_error", version)]
-                self.nested_errors = self.log[("nested_errors", version)]
-                self.textlen = self.log[("textlen", version)]
-                self.position = self.log[("position", version)]
-                self.isolated = self.log[("isolated", version)]
-                self.version = version
-                return
-            version -= 1
+        version = self.find_version(version)
+        if version is None:
+            return
+        get = self.get_attr
+        self.parent = get("parent", version)
+        self.children = list(get("children", version))
+        self.left = get("left", version)
+        self.right = get("right", version)
+        self.next_term = get("next_term", version)
+        self.prev_term = get("prev_term", version)
+        self.deleted = get("deleted", version)
+        self.indent = get("indent", version)
+        self.changed = get("changed", version)
+        self.nested_changes = get("nested_changes", version)
+        self.local_error = get("local_error", version)
+        self.nested_errors = get("nested_errors", version)
+        self.textlen = get("textlen", version)
+        self.position = get("position", version)
+        self.isolated = get("isolated", version)
+        self.version = version
 
     def delete_version(self, version):
-        if not ("parent", version) in self.log:
+        i = bisect_left(self.versions, version)
+        if i == len(self.versions) or self.versions[i] != version:
             return
         assert version <= self.max_version
-        for attr in ["parent", "children", "left", "right", "next_term", "prev_term", "deleted", "indent",\
-                "changed", "nested_changes", "local_error", "nested_errors", "symbol.name", "lookup", "version"]:
-            if (attr, version) in self.log:
-                self.log.pop((attr, version))
+        for attr in list(self.log):
+            self.unset_attr(attr, version)
+        del self.versions[i]
         # reset max_version
-        new_max = version - 1
-        while not ("parent", new_max) in self.log:
-            if new_max == 0:
-                break
-            new_max -= 1
+        new_max = self.find_version(version - 1)
+        if new_max is None:
+            new_max = 0
         self.max_version = new_max
 
+    def delete_versions_from(self, version):
+        """Remove all history entries of versions newer than `version`."""
+        i = bisect_right(self.versions, version)
+        if i == len(self.versions):
+            return
+        for attr in list(self.log):
+            versions, values = self.get_history(attr)
+            j = bisect_right(versions, version)
+            if j < len(versions):
+                self.set_history(attr, versions[:j], values[:j])
+        del self.versions[i:]
+        if self.versions:
+            self.max_version = self.versions[-1]
+
+    def compact(self, version):
+        """Squash all saved versions up to `version` into the latest of them,
+        dropping history entries that are no longer needed to load `version`
+        or any later version."""
+        base = self.find_version(version)
+        if base is None:
+            return
+        i = bisect_left(self.versions, base)
+        if i == 0:
+            return
+        del self.versions[:i]
+        for attr in list(self.log):
+            versions, values = self.get_history(attr)
+            j = bisect_right(versions, base)
+            if attr == "new":
+                # A node is only new in the version it has been saved with
+                # `new` set. Older entries are irrelevant for `base`.
+                j = bisect_left(versions, base)
+                self.set_history(attr, versions[j:], values[j:])
+            elif j > 0:
+                versions = [base] + versions[j:]
+                values = values[j-1:]
+                self.set_history(attr, versions, values)
+
+    def history_size(self):
+        """Approximate size in bytes of the containers making up this node's
+        history. Values shared with the tree (nodes, strings, numbers) are not
+        counted."""
+        size = sys.getsizeof(self.log) + sys.getsizeof(self.versions)
+        for attr in self.log:
+            entry = self.log[attr]
+            size += sys.getsizeof(entry)
+            if type(entry) is list:
+                size += sys.getsizeof(entry[0]) + sys.getsizeof(entry[1])
+            if attr == "children":
+                size += sum(sys.getsizeof(c) for c in self.get_history(attr)[1])
+        return size
+
     def get_attr(self, attr, version):
         if version is None:
             return getattr(self, attr)
-        if self.max_version and version > self.max_version:
-            return self.log[(attr, self.max_version)]
-        while version >= 0:
-            try:
-                return self.log[(attr, version)]
-            except KeyError:
-                version -= 1
+        entry = self.log.get(attr)
+        if type(entry) is tuple:
+            if entry[0] <= version:
+                return entry[1]
+        elif entry is not None:
+            i = bisect_right(entry[0], version)
+            if i > 0:
+                return entry[1][i-1]
         raise AttributeError("Attribute %s for version %s not found." % (attr, version))
 
     def remove_child(self, child, remove=False):
@@ -302,30 +526,48 @@ class Node(object):
         return type(self) is MultiTextNode
 
     def insert_after_node(self, node, newnode):
-        i = 0
-        for c in self.children:
-            if c is node:
-                self.children.insert(i+1, newnode)
-                self.mark_changed()
-                newnode.parent = self
-                newnode.mark_changed()
-                # update siblings
-                newnode.left = c
-                newnode.right = c.right
-                c.right = newnode
-                c.changed = True
-                if newnode.right:
-                    newnode.right.left = newnode
-                    newnode.right.changed = True
-                # update terminal pointers
-                newnode.prev_term = node
-                node.next_term.prev_term = newnode
-                node.next_term.mark_changed()
-                newnode.next_term = node.next_term
-                node.next_term = newnode
-                newnode.magic_parent = node.magic_parent
-                return
-            i += 1
+        i = self.child_index(node)
+        self.children.insert(i+1, newnode)
+        self.mark_changed()
+        newnode.parent = self
+        newnode.mark_changed()
+        # update siblings
+        newnode.left = node
+        newnode.right = node.right
+        node.right = newnode
+        node.changed = True
+        if newnode.right:
+            newnode.right.left = newnode
+            newnode.right.changed = True
+        # update terminal pointers
+        newnode.prev_term = node
+        node.next_term.prev_term = newnode
+        node.next_term.mark_changed()
+        newnode.next_term = node.next_term
+        node.next_term = newnode
+        newnode.magic_parent = node.magic_parent
+
+    def child_index(self, node):
+        """Find the position of the child `node`. Walks the siblings of `node`
+        in both directions at once, which is fast if `node` is close to either
+        end of a long list of children (e.g. when importing a file)."""
+        left = node.left
+        right = node.right
+        steps = 0
+        while left is not None and right is not None:
+            left = left.left
+            right = right.right
+            steps += 1
+        if left is None:
+            i = steps
+        else:
+            i = len(self.children) - 1 - steps
+        if 0 <= i < len(self.children) and self.children[i] is node:
+            return i
+        # sibling pointers are out of date
+        for i in range(len(self.children)):
+            if self.children[i] is node:
+                return i
         assert False
 
     def right_sibling(self, version=None):
@@ -462,8 +704,29 @@ lowercase = set(list(string.ascii_lowercase))
 uppercase = set(list(string.ascii_uppercase))
 digits = set(list(string.digits))
 
+_regex_chars = {}
+
+def regex_chars(regex):
+    """Return the characters that may occur in tokens matching `regex` as
+    guessed by TextNode.char_in_regex: the characters of the regex itself plus
+    all letters or digits if it contains a range like [a-z]. The result is
+    cached, as there are only few distinct regexes."""
+    try:
+        return _regex_chars[regex]
+    except KeyError:
+        pass
+    chars = set(regex)
+    if re.search(r"\[.*a-z.*\]", regex):
+        chars |= lowercase
+    if re.search(r"\[.*A-Z.*\]", regex):
+        chars |= uppercase
+    if re.search(r"\[.*0-9.*\]", regex):
+        chars |= digits
+    _regex_chars[regex] = chars = frozenset(chars)
+    return chars
+
 class TextNode(Node):
-    __slots__ = ["autobox", "tbd", "name", "log", "max_version", "version", "position", "changed", "exists", "isolated", "textlen", "local_error", "nested_errors", "nested_changes", "new", "deleted", "image", "image_src", "plain_mode", "alternate", "lookahead", "lookback", "lookup", "parent_lbox", "magic_backpointer", "indent"]
+    __slots__ = ["autobox", "tbd", "name", "log", "versions", "max_version", "version", "position", "changed", "exists", "isolated", "textlen", "local_error", "nested_errors", "nested_changes", "new", "deleted", "image", "image_src", "plain_mode", "alternate", "lookahead", "lookback", "lookup", "parent_lbox", "magic_backpointer", "indent", "first_lookup"]
     def __init__(self, symbol, state=-1, children=None, pos=-1, lookahead=0):
         if children is None:
             children = []
@@ -482,6 +745,7 @@ class TextNode(Node):
         self.lookahead = lookahead
         self.lookup = ""
         self.log = {}
+        self.versions = []
         self.version = 0
         self.indent = None
         self.textlen = -1
@@ -491,6 +755,16 @@ class TextNode(Node):
         self.name = None
         self.tbd = False
         self.autobox = None
+        self.first_lookup = None # (version, lookup id of the first terminal)
+
+    def delete_version(self, version):
+        # version numbers are reused after this
+        self.first_lookup = None
+        Node.delete_version(self, version)
+
+    def delete_versions_from(self, version):
+        self.first_lookup = None
+        Node.delete_versions_from(self, version)
 
     def get_magicterminal(self):
         try:
@@ -528,16 +802,8 @@ class TextNode(Node):
         return False
 
     def char_in_regex(self, c):
-        if c in self.regex:
-            #XXX be careful to not accidentally match chars with non-escaped regex chars like ., [, etc
-            return True
-        if c in lowercase and re.findall("\[.*a-z.*\]", self.regex):
-            return True
-        if c in uppercase and re.findall("\[.*A-Z.*\]", self.regex):
-            return True
-        if c in digits and re.findall("\[.*0-9.*\]", self.regex):
-            return True
-        return False
+        #XXX be careful to not accidentally match chars with non-escaped regex chars like ., [, etc
+        return c in regex_chars(self.regex)
 
     def change_pos(self, i):
         self.pos += i
@@ -555,17 +821,15 @@ class TextNode(Node):
 
     def save(self, version):
         Node.save(self, version)
-        self.log[("symbol.name", version)] = self.symbol.name
-        self.log[("lookup", version)] = self.lookup
-        self.max_version = version
+        self.record("symbol.name", version, self.symbol.name)
+        self.record("lookup", version, self.lookup)
+        self.max_version = self.versions[-1]
 
     def load(self, version):
         Node.load(self, version)
-        while version >= 0:
-            if ("parent", version) in self.log:
-                self.lookup = self.log[("lookup", version)]
-                break
-            version -= 1
+        saved = self.find_version(version)
+        if saved is not None:
+            self.lookup = self.get_attr("lookup", saved)
 
         if not isinstance(self.symbol, Terminal):
             return
@@ -576,7 +840,7 @@ class TextNode(Node):
             pass
 
     def is_new(self, version):
-        return ("new", version) in self.log
+        return version in self.get_history("new")[0]
 
     def textlength(self, version = None):
         if version is not None:
@@ -592,9 +856,9 @@ class TextNode(Node):
             self.textlen = len(self.symbol.name)
 
     def has_unsaved_changes(self):
-        if self.changed != self.log[("changed", self.version)]:
+        if self.changed != self.get_attr("changed", self.version):
             return True
-        if self.nested_changes != self.log[("nested_changes", self.version)]:
+        if self.nested_changes != self.get_attr("nested_changes", self.version):
             return True
         return False
 
@@ -607,11 +871,10 @@ class TextNode(Node):
         return self.nested_errors or self.local_error
 
     def get_text(self, version):
-        while version >= 0:
-            if ("symbol.name", version) in self.log:
-                return self.log[("symbol.name", version)]
-            version -= 1
-        return self.symbol.name
+        try:
+            return self.get_attr("symbol.name", version)
+        except AttributeError:
+            return self.symbol.name
 
     def insert(self, char, pos):
         l = list(self.symbol.name)
@@ -1,19 +1,31 @@
-from .astree import FinishSymbol, BOS, EOS, Nonterminal
+from bisect import bisect_left
+from .astree import FinishSymbol, BOS, EOS, Nonterminal, OffsetIndex
 from .syntaxtable import Goto
+from . import tracing
 import logging
 
 class RecoveryManager(object):
 
-    def __init__(self, previous_version, root, stack, syntaxtable):
+    def __init__(self, previous_version, root, stack, syntaxtable, trace=None):
         self.previous_version = previous_version
         self.root = root
         self.stack = stack
         self.syntaxtable = syntaxtable
         self.rejects = set()
+        # Character offsets at the end of each node on the stack, i.e. their
+        # cumulative text lengths. Kept in sync with the stack during recovery.
+        self.offsets = []
+        # Character offsets of nodes in the previous version, which doesn't
+        # change while parsing (created on demand)
+        self.tree_offsets = None
 
         self.new_state = None
         self.iso_node = None
 
+        if trace is None:
+            trace = tracing.tracing_enabled()
+        tracing.set_tracing(self, trace)
+
     def recover(self, error_node):
         """Takes a node causing a parsing error as input and attempts
         to find a subtree containing that nodes that can be reverted to allow
@@ -33,14 +45,17 @@ class RecoveryManager(object):
             # Can't recover if EOS caused the error. But why?
             return False
 
+        self.offsets = self.stack_offsets()
+
         # Get the character offset of the top node on the stack
-        error_offset = self.stack_offset(len(self.stack))
+        error_offset = self.offsets[-1]
 
         node = self.stack[-1]
         while not isinstance(node, EOS):
             if node.new:
                 # Can't recover a newly created subtree
                 self.stack.pop()
+                self.offsets.pop()
                 node = self.stack[-1]
                 continue
 
@@ -65,6 +80,7 @@ class RecoveryManager(object):
             # Couldn't find elegible parent. Now try more previously parsed subtrees
             # on the stack
             self.stack.pop()
+            self.offsets.pop()
             node = self.stack[-1]
         return False
 
@@ -140,6 +156,7 @@ class RecoveryManager(object):
             # position where we can push the subtree and setup the parser so
             # parsing can continue.
             self.stack[:] = self.stack[:cut+1]
+            del self.offsets[cut+1:]
             self.new_state = element.action
             self.iso_node = node
             self.iso_node.state = self.new_state
@@ -150,64 +167,46 @@ class RecoveryManager(object):
 
         return False
 
+    def stack_offsets(self):
+        """Get the cumulative character offsets at the end of each node on the
+        stack."""
+        offsets = []
+        offset = 0
+        for n in self.stack:
+            offset += n.textlength()
+            offsets.append(offset)
+        return offsets
+
     def get_cut(self, node):
         """Get the stack index at which the character offset is equal to the
         character offset of `node` in the previous version of the tree."""
         old_offset = self.offset(node, self.previous_version)
-        index = 0
-        length = 0
-        last_index = -1
-        for n in self.stack:
-            length += n.textlength()
-            if length == old_offset:
-                return index
-            if length > old_offset:
-                return -1
-            index += 1
+        return self.find_offset(old_offset)
+
+    def find_offset(self, offset):
+        """Binary search the stack for the node that ends at `offset`. Returns
+        the first such index or -1 if no node ends there."""
+        i = bisect_left(self.offsets, offset)
+        if i < len(self.offsets) and self.offsets[i] == offset:
+            return i
         return -1
 
     def find_cut_point(self, offset):
         """Finds the position on the stack to which we need to reset the parser
         to to continue parsing after isolating a subtree."""
-        cut_point = 0
-        length = 0
-        while cut_point < len(self.stack):
-            cur_node = self.stack[cut_point]
-            length += cur_node.textlength()
-            if length == offset:
-                last_valid_cutpoint = cut_point
-                return cut_point
-            if length > offset:
-                # We are already past the target offset. Abort!
-                break
-            cut_point += 1
-        assert False
+        cut_point = self.find_offset(offset)
+        assert cut_point != -1
+        return cut_point
 
     def stack_offset(self, cut):
         """Get the character offset of the stack node at the position `cut`."""
-        offset = 0
-        i = 0
-        for n in self.stack:
-            offset += n.textlength()
-            if i == cut:
-                break
-            i += 1
-        return offset
+        return self.offsets[min(cut, len(self.offsets) - 1)]
 
     def offset(self, node, version = None):
-        """Calculates the character offset of `node`. This is an optimised
-        version that goes backwards through the tree starting at the node,
-        instead of starting at BOS which requires looking into each subtree to
-        find `node`."""
-        offset = 0
-        while True:
-            if isinstance(node, BOS):
-                # Reached the beginning of the parse tree
-                break
-            left = node.get_attr("left", version)
-            if left:
-                node = left
-                offset += node.textlength(version = version)
-            else:
-                node = node.get_attr("parent", version)
-        return offset
+        """Calculates the character offset of `node`. Offsets in the previous
+        version are cached and share the work of walking up the tree."""
+        if version == self.previous_version:
+            if self.tree_offsets is None:
+                self.tree_offsets = OffsetIndex(version)
+            return self.tree_offsets.offset(node)
+        return OffsetIndex(version).offset(node)
@@ -41,7 +41,135 @@ class Helper(object):
         self.calculate_first()
         self.calculate_follow()
         self.goto_count = {}
+        self.items = {}
+        self.item_ids = {}
+        self.item_list = []
+        self.item_info = []
+        self.closures = {}
+
+    def intern(self, item):
+        """Return the integer id of an LR item, i.e. of its (production, dot)
+        pair. All items with the same production and dot share one id, and
+        `item_list` maps the id back to the first such item."""
+        _id = self.item_ids.get(item)
+        if _id is None:
+            _id = self.item_ids[item] = len(self.item_list)
+            self.item_list.append(item)
+            self.item_info.append(None)
+        return _id
+
+    def start_items(self, symbol):
+        """Return the LR(0) items `symbol ::= .alternative` of all alternatives
+        of a nonterminal (the same items closure_1 creates)."""
+        items = self.items.get(symbol)
+        if items is None:
+            items = []
+            rule = self.grammar[symbol]
+            for i, a in enumerate(rule.alternatives):
+                if a == []:
+                    a = [epsilon]
+                p = Production(symbol, a, rule.annotations[i], rule.precs[i])
+                if i in rule.inserts:
+                    insert = rule.inserts[i]
+                    p.inserts[insert[0]] = insert[1]
+                s = LR0Element(p, 0)
+                if a == [epsilon]:
+                    s.d = 1
+                items.append(self.item_list[self.intern(s)])
+            self.items[symbol] = items
+        return items
+
+    def info(self, _id):
+        """Return the next symbol of an item, the ids of the items added by
+        its closure, FIRST of the symbols after the next one (without epsilon),
+        whether those symbols are nullable, and the id of the item with the
+        dot moved over the next symbol."""
+        info = self.item_info[_id]
+        if info is None:
+            item = self.item_list[_id]
+            symbol = item.next_symbol()
+            if symbol is None:
+                info = (None, (), None, False, None)
+            else:
+                if isinstance(symbol, Nonterminal):
+                    starts = tuple(self.intern(s) for s in self.start_items(symbol))
+                else:
+                    starts = ()
+                beta = item.remaining_symbols()
+                first = self.first_list(beta)
+                first.discard(epsilon)
+                nullable = all(epsilon in self.first(s) for s in beta)
+                advanced = self.intern(LR0Element(item.p, item.d + 1))
+                info = (symbol, starts, frozenset(first), nullable, advanced)
+            self.item_info[_id] = info
+        return info
+
+    def closure_plan(self, kernel):
+        """Compute the LR(1) closure of a kernel, given as a sorted tuple of
+        item ids, independently of the kernel's lookaheads. Returns the ids of
+        the items in the closure (kernel first), the lookaheads each item gets
+        on its own, the kernel positions whose lookaheads it inherits, and the
+        kernels reached from it as (symbol, kernel, closure positions) triples.
+        Plans are cached, as many LR(1) states share the same kernel."""
+        plan = self.closures.get(kernel)
+        if plan is not None:
+            return plan
+        items = list(kernel)
+        index = {}
+        spont = []
+        prop = []
+        for i, _id in enumerate(kernel):
+            index[_id] = i
+            spont.append(set())
+            prop.append(set([i]))
+        todo = list(range(len(kernel)))
+        while todo:
+            i = todo.pop()
+            _, starts, first, nullable, _ = self.info(items[i])
+            if not starts:
+                continue
+            if nullable:
+                first = first | spont[i]
+                inherited = prop[i]
+            else:
+                inherited = ()
+            for _id in starts:
+                j = index.get(_id)
+                if j is None:
+                    index[_id] = j = len(items)
+                    items.append(_id)
+                    spont.append(set(first))
+                    prop.append(set(inherited))
+                elif first <= spont[j] and prop[j].issuperset(inherited):
+                    continue
+                else:
+                    spont[j] |= first
+                    prop[j].update(inherited)
+                todo.append(j)
+        gotos = {}
+        for i, _id in enumerate(items):
+            symbol, _, _, _, advanced = self.info(_id)
+            if symbol is not None:
+                gotos.setdefault(symbol, []).append((advanced, i))
+        gotos = [(symbol, tuple(sorted(l))) for symbol, l in gotos.items()]
+        gotos = [(symbol, tuple(a for a, _ in l), tuple(i for _, i in l)) for symbol, l in gotos]
+        plan = (tuple(items), [frozenset(s) for s in spont], [tuple(sorted(p)) for p in prop], gotos)
+        self.closures[kernel] = plan
+        return plan
+
+    def closure_lookaheads(self, plan, lookaheads):
+        """Return the lookaheads of all items in the closure `plan` of a
+        kernel whose items have the given lookaheads."""
+        result = []
+        for spont, prop in zip(plan[1], plan[2]):
+            la = set(spont)
+            for i in prop:
+                la.update(lookaheads[i])
+            result.append(la)
+        return result
 
+    def nullable(self, symbol):
+        return epsilon in self.first(symbol)
 
     def first(self, symbol):
         if isinstance(symbol, list):
@@ -170,67 +298,13 @@ class Helper(object):
         return self.closure_0(result)
 
     def closure_1(self, state_set):
-        la_dict = {}
-        result = set()
-        working_set = set()
-        # Step 1
-        for element in state_set.elements:
-            la_dict[element] = state_set.get_lookahead(element)
-            result.add(element)
-            working_set.add(element)
-        # Step 2
-        i=0
-        temp = working_set
-        while 1:
-            newelements = set()
-            for state in temp:
-                if state.isfinal():
-                    continue
-                symbol = state.next_symbol()
-                if isinstance(symbol, Nonterminal):
-                    f = set()
-                    for l in la_dict[state]:
-                        betaL = []
-                        betaL.extend(state.remaining_symbols())
-                        betaL.append(l)
-                        f |= self.first(betaL)
-                    alternatives = self.grammar[symbol].alternatives
-                    i = -1
-                    for a in alternatives:
-                        i = i + 1
-                        # create epsilon symbol if alternative is empty
-                        if a == []:
-                            a = [Epsilon()]
-                        p = Production(symbol, a, self.grammar[symbol].annotations[i], self.grammar[symbol].precs[i])
-                        if i in self.grammar[symbol].inserts:
-                            insert = self.grammar[symbol].inserts[i]
-                            p.inserts[insert[0]] = insert[1]
-                        s = LR0Element(p, 0)
-                        if a == [epsilon]:
-                            s.d = 1
-                        # NEW ELEMENT:
-                        # 1. completely new (+lookahead): add to result
-                        # 2. new lookahead: update lookahead in la_dict
-                        # -> add to new working set
-                        # 3. already known: ignore
-                        if s in result:
-                            if f.issubset(la_dict[s]):   # lookahead in combination with state already known
-                                continue
-                            else:
-                                la_dict[s] |= f   # new lookahead
-                        else:
-                            la_dict[s] = set(f)        # completely new
-                        result.add(s)
-                        newelements.add(s)
-            temp = newelements
-            if len(temp) == 0:
-                break
-            i += 1
-        # add lookaheads
-        final_result = StateSet()
-        for element in result:
-            final_result.add(element, la_dict[element])
-        return final_result
+        kernel = sorted((self.intern(e), e) for e in state_set.elements)
+        plan = self.closure_plan(tuple(_id for _id, _ in kernel))
+        lookaheads = [state_set.get_lookahead(e) for _, e in kernel]
+        result = StateSet()
+        for _id, la in zip(plan[0], self.closure_lookaheads(plan, lookaheads)):
+            result.add(self.item_list[_id], la)
+        return result
 
     def goto_1(self, state_set, symbol):
         try:
@@ -21,20 +21,18 @@
 
 
 
-try:
-    import pickle as pickle
-except:
-    import pickle
-
 import time, os
 
 from grammar_parser.gparser import Parser, Nonterminal, Terminal, Epsilon, IndentationTerminal, MagicTerminal
-from .syntaxtable import SyntaxTable, FinishSymbol, Reduce, Accept, Shift
+from .syntaxtable import SyntaxTable, FinishSymbol, Reduce, Accept, Shift, SHIFT, REDUCE, ACCEPT, ACTION_NAMES
 from .stategraph import StateGraph
-from .constants import LR0, LALR
+from .constants import LR0
 from .astree import AST, TextNode, BOS, EOS
 from ip_plugins.plugin import PluginManager
 from .error_recovery import RecoveryManager
+from .stats import ParseStats
+from . import tablecache
+from . import tracing
 from autolboxdetector import NewAutoLboxDetector
 
 import logging
@@ -42,6 +40,10 @@ import logging
 Node = TextNode
 
 
+class ParseCancelled(Exception):
+    """Raised by IncParser.inc_parse if the parse has been cancelled (see
+    IncParser.cancelled)."""
+
 def printc(text, color):
     print("\033[%sm%s\033[0m" % (color, text))
 
@@ -57,36 +59,25 @@ def printline(start):
 
 class IncParser(object):
 
-    def __init__(self, grammar=None, lr_type=LR0, whitespaces=False, startsymbol=None):
+    def __init__(self, grammar=None, lr_type=LR0, whitespaces=False, startsymbol=None, trace=None):
 
         if grammar:
             logging.debug("Parsing Grammar")
             parser = Parser(grammar, whitespaces)
             parser.parse()
 
-            filename = "".join([os.path.dirname(__file__), "/../pickle/", str(hash(grammar) ^ hash(whitespaces)), ".pcl"])
-            try:
-                logging.debug("Try to unpickle former stategraph")
-                f = open(filename, "rb")
-                start = time.time()
-                self.graph = pickle.load(f)
-                end = time.time()
-                logging.debug("unpickling done in %s", end-start)
-            except IOError:
-                logging.debug("could not unpickle old graph")
+            name = tablecache.table_id(grammar, whitespaces, lr_type)
+            self.graph = None
+            self.syntaxtable = tablecache.load(name, parser.rules)
+            if self.syntaxtable is None:
                 logging.debug("Creating Stategraph")
                 self.graph = StateGraph(parser.start_symbol, parser.rules, lr_type)
                 logging.debug("Building Stategraph")
                 self.graph.build()
-                logging.debug("Pickling")
-                pickle.dump(self.graph, open(filename, "wb"))
-
-            if lr_type == LALR:
-                self.graph.convert_lalr()
-
-            logging.debug("Creating Syntaxtable")
-            self.syntaxtable = SyntaxTable(None, lr_type)
-            self.syntaxtable.build(self.graph)
+                logging.debug("Creating Syntaxtable")
+                self.syntaxtable = SyntaxTable(None, lr_type)
+                self.syntaxtable.build(self.graph)
+                tablecache.store(name, self.syntaxtable)
 
         self.stack = []
         self.ast_stack = []
@@ -103,12 +94,30 @@ class IncParser(object):
         self.prev_version = 0
 
         self.ooc = None
+        self.stats = ParseStats()
+
+        # Parses can be cancelled from another thread by setting `cancelled`.
+        # This is only possible while `touched` is a dict, which records the
+        # nodes changed by the parse so they can be reverted by `rollback`.
+        self.cancelled = False
+        self.touched = None
 
         self.autolboxes = None
         self.autodetector = None
         self.option_autolbox_find = False
         self.lang = None
 
+        if trace is None:
+            trace = tracing.tracing_enabled()
+        self.set_tracing(trace)
+
+    def set_tracing(self, enabled):
+        """Enable or disable debug logging of the parsing process. Without
+        tracing, the parser runs copies of its methods that have all
+        `logging.debug` calls removed."""
+        self.tracing = enabled
+        tracing.set_tracing(self, enabled)
+
     def is_valid_symbol(self, state, token):
         return self.syntaxtable.lookup(state, token) is not None
 
@@ -116,20 +125,15 @@ class IncParser(object):
         self.graph = None
         self.syntaxtable = None
         if pickle_id:
-            filename = "".join([os.path.dirname(__file__), "/../pickle/", str(pickle_id), ".pcl"])
-            try:
-                with open(filename, "rb") as f:
-                    self.syntaxtable = pickle.load(f)
-            except IOError:
-                pass
+            name = tablecache.table_id(pickle_id)
+            self.syntaxtable = tablecache.load(name, rules)
         if self.syntaxtable is None:
             self.graph = StateGraph(startsymbol, rules, lr_type)
             self.graph.build()
             self.syntaxtable = SyntaxTable(prod_ids, lr_type)
             self.syntaxtable.build(self.graph, precedences)
             if pickle_id:
-                with open(filename, "wb") as f:
-                    pickle.dump(self.syntaxtable, f)
+                tablecache.store(name, self.syntaxtable)
 
         self.whitespaces = whitespaces
 
@@ -154,6 +158,21 @@ class IncParser(object):
         self.inc_parse([], True)
 
     def inc_parse(self, line_indents=[], needs_reparse=False, state=0, stack = []):
+        """Incrementally parse the changes made to the tree since the last
+        parse. Returns True if the parse was successful. Statistics about the
+        parse are collected in `self.stats`."""
+        if not self.ooc:
+            # out-of-context analyses share the stats of the outer parser
+            self.stats = ParseStats()
+        start = time.time()
+        try:
+            return self.parse_changes(needs_reparse, state, stack)
+        finally:
+            self.stats.iterations += self.loopcount
+            if not self.ooc:
+                self.stats.add_time("parse", time.time() - start)
+
+    def parse_changes(self, needs_reparse, state, stack):
         logging.debug("============ NEW %s PARSE ================= ", "OOC" if self.ooc else "INCREMENTAL")
         logging.debug("= starting in state %s ", state)
         self.validating = False
@@ -175,7 +194,11 @@ class IncParser(object):
             rmroot = self.ooc[1]
         else:
             rmroot = self.previous_version.parent
-        self.rm = RecoveryManager(self.prev_version, rmroot, self.stack, self.syntaxtable)
+        self.rm = RecoveryManager(self.prev_version, rmroot, self.stack, self.syntaxtable, self.tracing)
+        if self.touched is not None:
+            self.touch(self.previous_version.parent)
+            self.touch(bos)
+            self.touch(eos)
 
         USE_OPT = True
 
@@ -184,6 +207,8 @@ class IncParser(object):
         while(True):
             logging.debug("\x1b[35mProcessing\x1b[0m %s %s %s %s", la, la.changed, id(la), la.indent)
             self.loopcount += 1
+            if self.cancelled and self.touched is not None:
+                raise ParseCancelled()
 
 
 
@@ -199,9 +224,9 @@ class IncParser(object):
                         # if OOC is Nonterminal, use first terminal to apply
                         # reductions
                         first_term = la.find_first_terminal(self.prev_version)
-                        lookup = self.get_lookup(first_term)
+                        lookup = self.get_lookup_id(first_term)
                     else:
-                        lookup = self.get_lookup(la)
+                        lookup = self.get_lookup_id(la)
                     while True:
                         # OOC is complete if we reached the expected state and
                         # there are no more reductions left to do
@@ -211,19 +236,18 @@ class IncParser(object):
                             return True
                         # Otherwise apply more reductions to reach the wanted
                         # state or an error occurs
-                        element = self.syntaxtable.lookup(self.current_state, lookup)
-                        if not isinstance(element, Reduce):
+                        action = self.syntaxtable.action(self.current_state, lookup)
+                        if action & 3 != REDUCE:
                             logging.debug("No more reductions")
                             break
                         else:
-                            self.reduce(element)
+                            self.reduce(action >> 2)
                     logging.debug("======= OOC parse failed =========")
                     self.last_status = False
                     return False
 
             if isinstance(la.symbol, Terminal) or isinstance(la.symbol, FinishSymbol) or la.symbol == Epsilon():
-                    lookup_symbol = self.get_lookup(la)
-                    result = self.parse_terminal(la, lookup_symbol)
+                    result = self.parse_terminal(la, self.get_lookup_id(la))
                     if result == "Accept":
                         logging.debug("============ INCREMENTAL PARSE END (ACCEPT) ================= ")
                         # With error recovery we can end up in the accepting
@@ -252,13 +276,17 @@ class IncParser(object):
                             # skip this node immediately.
                             la = self.left_breakdown(la)
                             continue
-                        goto = self.syntaxtable.lookup(self.current_state, la.symbol)
+                        table = self.syntaxtable
+                        goto = table.action(self.current_state, table.symbol_id(la.symbol))
                         # Only opt-shift if the nonterminal has children to
                         # avoid a bug in the retainability algorithm. See
                         # test/test_eco.py::Test_RetainSubtree::test_bug1
                         if goto and la.children: # can we shift this Nonterminal in the current state?
-                            logging.debug("OPTShift: %s in state %s -> %s", la.symbol, self.current_state, goto)
-                            follow_id = goto.action
+                            follow_id = goto >> 2
+                            self.stats.optimistic_shifts += 1
+                            logging.debug("OPTShift: %s in state %s -> %s", la.symbol, self.current_state, follow_id)
+                            if self.touched is not None:
+                                self.touch(la)
                             self.stack.append(la)
                             la.deleted = False
                             la.state = follow_id #XXX this fixed goto error (I should think about storing the states on the stack instead of inside the elements)
@@ -273,15 +301,17 @@ class IncParser(object):
                             la = self.pop_lookahead(la)
                             self.validating = True
                             continue
+                        elif la.textlen > 0 and not table.reduces_in(self.current_state, table.symbol_id(la.symbol)):
+                            # no terminal this subtree can start with causes a
+                            # reduction in this state (empty subtrees need to
+                            # look at the terminal that follows them)
+                            la = self.left_breakdown(la)
                         else:
-                            #XXX can be made faster by providing more information in syntax tables
-                            first_term = la.find_first_terminal(self.prev_version)
-
-                            lookup_symbol = self.get_lookup(first_term)
-                            element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
-                            if isinstance(element, Reduce):
-                                logging.debug("OPT Reduce: %s", element)
-                                self.reduce(element)
+                            lookup = self.first_lookup_id(la)
+                            action = table.action(self.current_state, lookup)
+                            if action & 3 == REDUCE:
+                                logging.debug("OPT Reduce: %s", table.reductions[action >> 2])
+                                self.reduce(action >> 2)
                             else:
                                 la = self.left_breakdown(la)
                     else:
@@ -301,13 +331,144 @@ class IncParser(object):
                         else:
                             la = self.left_breakdown(la)
 
-    def parse_terminal(self, la, lookup_symbol):
-        """Lookup the current lookahead symbol in the syntax table and apply the received action."""
-        element = None
+    def bulk_parse(self):
+        """Parse a freshly lexed token stream, i.e. a tree whose root only
+        contains new terminals, from scratch. This skips the incremental
+        machinery (lookahead traversal, node reuse, error recovery) and builds
+        the new tree directly, which makes it much faster than `inc_parse` for
+        large inputs. Returns False if the input contains a syntax error, in
+        which case `inc_parse` has to be used to parse it with error recovery.
+        The tokens are then left as they were, apart from their (recomputed)
+        text lengths."""
+        root = self.previous_version.parent
+        tokens = []
+        for la in root.children[1:-1]:
+            if self.is_empty_subtree(la):
+                # empty tree from a previous parse (e.g. of an empty file)
+                continue
+            if not la.new or la.deleted or type(la.symbol) is Nonterminal:
+                return False
+            tokens.append(la)
+        self.stats = ParseStats()
+        start = time.time()
+        table = self.syntaxtable
+        base = table.base
+        check = table.check
+        packed = table.packed
+        bos = root.children[0]
+        eos = root.children[-1]
+        bos.calc_textlength()
+        eos.calc_textlength()
+        # The tokens are only updated once the whole input has been parsed, so
+        # their states and offsets are kept on the side until then
+        stack = [eos]
+        states = [0]
+        shifted = []
+        offset = 0
+        state = 0
+        last_shift_state = self.last_shift_state
+        shifts = reductions = 0
+        tokens.append(eos)
+        for la in tokens:
+            lookup = self.get_lookup_id(la)
+            if la is eos:
+                # finish single line comments at the end of the file (see
+                # parse_terminal)
+                eos_lookup = table.terminal_ids.get("<eos>", table.unknown_id)
+                while table.action(state, eos_lookup) & 3 == SHIFT:
+                    state = table.action(state, eos_lookup) >> 2
+            while True:
+                i = base[state] + lookup
+                action = packed[i] if check[i] == state else table.action(state, lookup)
+                kind = action & 3
+                if kind == SHIFT:
+                    state = action >> 2
+                    for c in la.children: # multi text nodes
+                        c.calc_textlength()
+                    la.calc_textlength()
+                    shifted.append((la, state, offset))
+                    offset += la.textlen
+                    stack.append(la)
+                    states.append(state)
+                    if la.lookup != "<ws>":
+                        last_shift_state = state
+                    shifts += 1
+                    break
+                elif kind == REDUCE:
+                    prod = action >> 2
+                    element = table.reductions[prod]
+                    amount = table.reduce_amount[prod]
+                    if amount:
+                        children = stack[-amount:]
+                        del stack[-amount:]
+                        del states[-amount:]
+                    else:
+                        children = []
+                    state = states[-1]
+                    i = base[state] + table.reduce_goto[prod]
+                    state = (packed[i] if check[i] == state else table.action(state, table.reduce_goto[prod])) >> 2
+                    node = Node(element.action.left.copy(), state, children)
+                    node.calc_textlength()
+                    node.position = offset - node.textlen
+                    node.exists = True
+                    stack.append(node)
+                    states.append(state)
+                    reductions += 1
+                    if getattr(element.action.annotation, "interpret", None):
+                        self.interpret_annotation(node, element.action)
+                elif kind == ACCEPT:
+                    break
+                else:
+                    # revert the links to the nodes created so far
+                    root.set_children(root.children)
+                    return False
+        for la, la_state, position in shifted:
+            la.state = la_state
+            la.exists = True
+            la.position = position
+            la.autobox = None
+            la.local_error = la.nested_errors = False
+        eos.state = 0
+        self.last_shift_state = last_shift_state
+        bos.changed = False
+        eos.changed = False
+        root.set_children([bos, stack[1], eos])
+        root.changed = True
+        root.isolated = None
+        self.stack = stack
+        self.current_state = state
+        self.reused_nodes = set()
+        self.error_nodes = []
+        self.error_pres = []
+        self.validating = False
+        self.last_status = True
+        self.stats.shifts = shifts
+        self.stats.reductions = reductions
+        self.stats.iterations = len(tokens)
+        self.stats.add_time("parse", time.time() - start)
+        return True
+
+    def is_empty_subtree(self, node):
+        """Check that `node` is a nonterminal without any terminals below."""
+        todo = [node]
+        while todo:
+            node = todo.pop()
+            if type(node.symbol) is not Nonterminal:
+                return False
+            todo.extend(node.children)
+        return True
+
+    def parse_terminal(self, la, lookup):
+        """Lookup the id of the current lookahead symbol in the syntax table
+        and apply the received action."""
+        table = self.syntaxtable
+        action = None
         if la.deleted:
             # Nodes are no longer removed from the tree. Instead "deleted" nodes
             # are skipped during parsing so they won't end up in the next parse
             # tree. This allows to revert deleted nodes on undo.
+            if self.touched is not None:
+                self.touch(la)
             la.exists = False
             la = self.pop_lookahead(la)
             return la
@@ -318,14 +479,16 @@ class IncParser(object):
         if isinstance(la, EOS):
             # This is needed so we can finish single line comments at the end of
             # the file
-            element = self.syntaxtable.lookup(self.current_state, Terminal("<eos>"))
-            if isinstance(element, Shift):
-                self.current_state = element.action
+            eos_lookup = table.terminal_ids.get("<eos>", table.unknown_id)
+            action = table.action(self.current_state, eos_lookup)
+            if action & 3 == SHIFT:
+                self.current_state = action >> 2
                 return la
-        if element is None:
-            element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
-        logging.debug("\x1b[34mparse_terminal\x1b[0m: %s in %s -> %s", lookup_symbol, self.current_state, element)
-        if isinstance(element, Accept):
+        if not action:
+            action = table.action(self.current_state, lookup)
+        kind = action & 3
+        logging.debug("\x1b[34mparse_terminal\x1b[0m: %s in %s -> %s(%s)", la, self.current_state, ACTION_NAMES[kind], action >> 2)
+        if kind == ACCEPT:
             #XXX change parse so that stack is [bos, startsymbol, eos]
             bos = self.previous_version.parent.children[0]
             eos = self.previous_version.parent.children[-1]
@@ -337,17 +500,17 @@ class IncParser(object):
             logging.debug("loopcount: %s", self.loopcount)
             logging.debug ("\x1b[32mAccept\x1b[0m")
             return "Accept"
-        elif isinstance(element, Shift):
+        elif kind == SHIFT:
             self.validating = False
-            self.shift(la, element)
+            self.shift(la, action >> 2)
             la.local_error = la.nested_errors = False
             return self.pop_lookahead(la)
 
-        elif isinstance(element, Reduce):
-            logging.debug("\x1b[33mReduce\x1b[0m: %s -> %s", la, element)
-            self.reduce(element)
-            return la #self.parse_terminal(la, lookup_symbol)
-        elif element is None:
+        elif kind == REDUCE:
+            logging.debug("\x1b[33mReduce\x1b[0m: %s -> %s", la, table.reductions[action >> 2])
+            self.reduce(action >> 2)
+            return la #self.parse_terminal(la, lookup)
+        else:
             if self.validating:
                 logging.debug("Was validating: Right breakdown and return to normal")
                 logging.debug("Before breakdown: %s", self.stack[-1])
@@ -355,15 +518,22 @@ class IncParser(object):
                 logging.debug("After breakdown: %s", self.stack[-1])
                 self.validating = False
             else:
+                # Error recovery changes nodes all over the tree, which can't
+                # be rolled back, so finish the parse from here on
+                self.touched = None
                 if self.autodetector and self.option_autolbox_find:
                     if type(la.symbol) is MagicTerminal and la.tbd:
                         self.autodetector.check_remove_lbox(la)
                     else:
                         self.autodetector.detect_lbox(la)
                 self.error_nodes.append(la)
+                self.stats.recoveries += 1
+                self.stats.isolated += 1
+                start = time.time()
                 if self.rm.recover(la):
                     # recovered, continue parsing
                     self.refine(self.rm.iso_node, self.rm.iso_offset, self.rm.error_offset)
+                    self.stats.add_time("recovery", time.time() - start)
                     self.current_state = self.rm.new_state
                     self.rm.iso_node.isolated = la
                     self.rm.iso_node.deleted = False
@@ -377,6 +547,7 @@ class IncParser(object):
                 error_offset = self.rm.offset(la, self.rm.previous_version)
                 iso_node = self.previous_version.parent
                 self.refine(iso_node, 0, error_offset)
+                self.stats.add_time("recovery", time.time() - start)
                 iso_node.isolated = la
                 return "Error"
 
@@ -391,6 +562,26 @@ class IncParser(object):
             lookup_symbol = Terminal(lookup_symbol.name)
         return lookup_symbol
 
+    def get_lookup_id(self, la):
+        """Get the interned id of a node's lookup symbol (see get_lookup)."""
+        if la.lookup != "":
+            table = self.syntaxtable
+            return table.terminal_ids.get(la.lookup, table.unknown_id)
+        return self.syntaxtable.symbol_id(la.symbol)
+
+    def first_lookup_id(self, la):
+        """Get the lookup id of the first terminal within the unchanged
+        subtree `la`. The result is cached on the subtree until it is saved in
+        a new version."""
+        cached = la.first_lookup
+        if cached is not None and cached[0] == la.version:
+            return cached[1]
+        lookup = self.get_lookup_id(la.find_first_terminal(self.prev_version))
+        if la.textlen > 0:
+            # otherwise the first terminal is outside of the subtree
+            la.first_lookup = (la.version, lookup)
+        return lookup
+
     def isolate(self, node):
         if node.has_changes():# or node.has_errors():
             node.load(self.prev_version)
@@ -538,10 +729,13 @@ class IncParser(object):
             # are marked as changed even if just their siblings or next_terms
             # are updated, this would fail for most out-of-context analyses
             logging.debug("   Failed: Surrounding context has changed")
+            self.stats.isolated += 1
             self.isolate(node)
             return
 
-        temp_parser = IncParser()
+        self.stats.ooc_analyses += 1
+        temp_parser = IncParser(trace=self.tracing)
+        temp_parser.stats = self.stats
         temp_parser.syntaxtable = self.syntaxtable
         temp_parser.prev_version = self.prev_version
         temp_parser.reference_version = self.reference_version
@@ -572,12 +766,12 @@ class IncParser(object):
         # isolation nodes. Without this change we would calculate the offset
         # within the original parse tree and not the offset within the temporary
         # parse tree
-        node.log[("left", self.prev_version)] = temp_bos
-        node.log[("right", self.prev_version)] = temp_eos
+        node.set_attr("left", self.prev_version, temp_bos)
+        node.set_attr("right", self.prev_version, temp_eos)
 
         logging.debug("    TempEOS: %s", temp_eos)
         temp_root = Node(Nonterminal("TempRoot"), 0, [temp_bos, node, temp_eos])
-        node.log[("parent", self.prev_version)] = temp_root
+        node.set_attr("parent", self.prev_version, temp_root)
         temp_root.save(self.prev_version)
         temp_bos.next_term = node
         temp_bos.state = oldleft.state
@@ -586,10 +780,12 @@ class IncParser(object):
         temp_parser.ooc = (temp_eos, node, node.state)
         temp_parser.root = temp_root
         dummy_stack_eos = EOS(Terminal(""), oldleft.state, [])
+        start = time.time()
         try:
             temp_parser.inc_parse(state=oldleft.state, stack=[dummy_stack_eos])
         except IndexError:
             temp_parser.last_status = False
+        self.stats.add_time("ooc", time.time() - start)
 
         temp_eos.parent = eos_parent
         temp_eos.left = eos_left
@@ -601,9 +797,10 @@ class IncParser(object):
         if temp_parser.last_status == False:
               # isolate
               logging.debug("OOC analysis of %s failed. Error on %s.", node, temp_parser.error_nodes)
-              node.log[("left", self.prev_version)] = saved_left
-              node.log[("right", self.prev_version)] = saved_right
-              node.log[("parent", self.prev_version)] = saved_parent
+              node.set_attr("left", self.prev_version, saved_left)
+              node.set_attr("right", self.prev_version, saved_right)
+              node.set_attr("parent", self.prev_version, saved_parent)
+              self.stats.isolated += 1
               self.isolate(node) # revert changes done during OOC
               if temp_parser.previous_version.parent.isolated:
                   # if during OOC parsing error recovery isolated the entire
@@ -618,16 +815,17 @@ class IncParser(object):
         if newnode.symbol.name != oldname:
             logging.debug("OOC analysis resulted in different symbol: %s", newnode.symbol.name)
             # node is not the same: revert all changes!
-            node.log[("left", self.prev_version)] = saved_left
-            node.log[("right", self.prev_version)] = saved_right
-            node.log[("parent", self.prev_version)] = saved_parent
+            node.set_attr("left", self.prev_version, saved_left)
+            node.set_attr("right", self.prev_version, saved_right)
+            node.set_attr("parent", self.prev_version, saved_parent)
+            self.stats.isolated += 1
             self.isolate(node)
             return
 
         if newnode is not node:
-            node.log[("left", self.prev_version)] = saved_left
-            node.log[("right", self.prev_version)] = saved_right
-            node.log[("parent", self.prev_version)] = saved_parent
+            node.set_attr("left", self.prev_version, saved_left)
+            node.set_attr("right", self.prev_version, saved_right)
+            node.set_attr("parent", self.prev_version, saved_parent)
             logging.debug("OOC analysis resulted in different node but same symbol: %s", newnode.symbol.name)
             assert len(temp_parser.stack) == 2 # should only contain [EOS, node]
             i = oldparent.children.index(node)
@@ -649,28 +847,31 @@ class IncParser(object):
         node.parent = oldparent
         node.left = oldleft
         node.right = oldright
-        node.log[("left", self.prev_version)] = saved_left
-        node.log[("right", self.prev_version)] = saved_right
-        node.log[("parent", self.prev_version)] = saved_parent
-
-    def reduce(self, element):
-        """Reduce elements on the stack to a non-terminal."""
-
-        children = []
-        i = 0
-        while i < element.amount():
-            c = self.stack.pop()
-            children.insert(0, c)
-            i += 1
+        node.set_attr("left", self.prev_version, saved_left)
+        node.set_attr("right", self.prev_version, saved_right)
+        node.set_attr("parent", self.prev_version, saved_parent)
+
+    def reduce(self, prod):
+        """Reduce elements on the stack to a non-terminal using the production
+        with the interned id `prod`."""
+        self.stats.reductions += 1
+        table = self.syntaxtable
+        element = table.reductions[prod]
+        amount = table.reduce_amount[prod]
+        if amount:
+            children = self.stack[-amount:]
+            del self.stack[-amount:]
+        else:
+            children = []
 
         logging.debug("   Element on stack: %s(%s)", self.stack[-1].symbol, self.stack[-1].state)
         self.current_state = self.stack[-1].state #XXX don't store on nodes, but on stack
         logging.debug("   Reduce: set state to %s (%s)", self.current_state, self.stack[-1].symbol)
 
-        goto = self.syntaxtable.lookup(self.current_state, element.action.left)
-        if goto is None:
+        goto = table.action(self.current_state, table.reduce_goto[prod])
+        if not goto:
             raise Exception("Reduction error on %s in state %s: goto is None" % (element, self.current_state))
-        assert goto is not None
+        goto = goto >> 2
 
         # save childrens parents state
         has_errors = False
@@ -686,16 +887,19 @@ class IncParser(object):
         reuse_parent = self.ambig_reuse_check(element.action.left, children)
         if not self.needs_reparse and reuse_parent:
             logging.debug("   Reusing parent: %s (%s)", reuse_parent, id(reuse_parent))
+            self.stats.reused_parents += 1
             new_node = reuse_parent
+            if self.touched is not None:
+                self.touch(new_node)
             new_node.changed = False
             new_node.deleted = False
             new_node.isolated = None
             new_node.local_error = False
             new_node.set_children(children)
-            new_node.state = goto.action # XXX need to save state using hisotry service
+            new_node.state = goto # XXX need to save state using hisotry service
             new_node.mark_changed()
         else:
-            new_node = Node(element.action.left.copy(), goto.action, children)
+            new_node = Node(element.action.left.copy(), goto, children)
             logging.debug("   No reuse parent. Make new %s (%s)", new_node, id(new_node))
         new_node.nested_errors = has_errors
         new_node.calc_textlength()
@@ -703,7 +907,7 @@ class IncParser(object):
         logging.debug("   Add %s to stack and goto state %s", new_node.symbol, new_node.state)
         self.stack.append(new_node)
         new_node.exists = True
-        self.current_state = new_node.state # = goto.action
+        self.current_state = new_node.state # = goto
         logging.debug("Reduce: set state to %s (%s)", self.current_state, new_node.symbol)
         if getattr(element.action.annotation, "interpret", None):
             # eco grammar annotations
@@ -724,8 +928,10 @@ class IncParser(object):
         return None
 
     def top_down_reuse(self):
+        start = time.time()
         main = self.previous_version.parent
         self.top_down_traversal(main)
+        self.stats.add_time("reuse", time.time() - start)
 
     def top_down_traversal(self, node):
         if node.changed and not node.new:
@@ -756,6 +962,7 @@ class IncParser(object):
             # here would thus give no memory benefit as the old terminal can't
             # be garbage collected
             return
+        self.stats.reused_isomorphic += 1
         parent.children[i] = previous
         previous.parent = parent # in case previous was moved before being deleted
         previous.children = list(current.children)
@@ -819,6 +1026,9 @@ class IncParser(object):
             return False
 
     def left_breakdown(self, la):
+        self.stats.left_breakdowns += 1
+        if self.touched is not None:
+            self.touch(la)
         la.exists = False
         if len(la.children) > 0:
             return la.children[0]
@@ -826,6 +1036,7 @@ class IncParser(object):
             return self.pop_lookahead(la)
 
     def right_breakdown(self):
+        self.stats.right_breakdowns += 1
         node = self.stack.pop() # optimistically shifted Nonterminal
         node.exists = False
         # after the breakdown, we need to properly shift the left over terminal
@@ -874,12 +1085,15 @@ class IncParser(object):
                 self.current_state = self.stack[-1].state
         self.shift(node, rb=True) # pushes previously popped terminal back on stack
 
-    def shift(self, la, element=None, rb=False):
-        if not element:
-            lookup_symbol = self.get_lookup(la)
-            element = self.syntaxtable.lookup(self.current_state, lookup_symbol)
-        logging.debug("\x1b[32m" + "%sShift(%s)" + "\x1b[0m" + ": %s -> %s", "rb" if rb else "", self.current_state, la, element)
-        la.state = element.action
+    def shift(self, la, state=None, rb=False):
+        if state is None:
+            table = self.syntaxtable
+            state = table.action(self.current_state, self.get_lookup_id(la)) >> 2
+        self.stats.shifts += 1
+        logging.debug("\x1b[32m" + "%sShift(%s)" + "\x1b[0m" + ": %s -> %s", "rb" if rb else "", self.current_state, la, state)
+        if self.touched is not None:
+            self.touch(la)
+        la.state = state
         la.exists = True
         la.position = self.stack[-1].position + self.stack[-1].textlen
         la.autobox = None
@@ -889,8 +1103,33 @@ class IncParser(object):
         if not la.lookup == "<ws>":
             # last_shift_state is used to predict next symbol
             # whitespace destroys correct behaviour
-            self.last_shift_state = element.action
-
+            self.last_shift_state = state
+
+
+    def touch(self, node):
+        """Remember the unversioned attributes of a node changed by a
+        cancellable parse."""
+        if node not in self.touched:
+            self.touched[node] = (node.state, node.exists, node.autobox)
+
+    def rollback(self):
+        """Revert the changes a cancelled parse has made to the tree, i.e. load
+        the version the parse started from for all touched nodes and their
+        parents (which might have been marked as changed)."""
+        touched = self.touched
+        self.touched = None
+        self.cancelled = False
+        loaded = set()
+        for node in touched:
+            while node is not None and node not in loaded:
+                loaded.add(node)
+                node.load(self.prev_version)
+                node = node.parent
+        for node, (state, exists, autobox) in touched.items():
+            node.state = state
+            node.exists = exists
+            node.autobox = autobox
+        self.load_status(self.prev_version)
 
     def pop_lookahead(self, la):
         while(self.right_sibling(la) is None):
@@ -924,7 +1163,7 @@ class IncParser(object):
         return AST(root)
 
     def get_next_possible_symbols(self, state_id):
-        return iter(self.syntaxtable.table[state_id].keys())
+        return iter(self.syntaxtable.expected(state_id))
 
     def get_next_symbols_list(self, state = -1):
         if state == -1:
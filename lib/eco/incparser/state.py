@@ -19,19 +19,17 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
-from time import time
 from grammar_parser.gparser import Nonterminal
 
 class StateSet(object):
 
-    _hashtime = 0
-
     def __init__(self, elements=None):
         if elements:
             self.elements = elements
         else:
             self.elements = set()
         self.lookaheads = {}
+        self._hash = None
 
     def __len__(self):
         return len(self.elements)
@@ -40,20 +38,20 @@ class StateSet(object):
         if element not in self.elements:
             self.elements.add(element)
             self.lookaheads[element] = lookahead
+            self._hash = None
 
     def get_lookahead(self, element):
         return self.lookaheads[element]
 
     def merge(self):
         # merge states that only differ in their lookahead
-        # XXX this is slow
-        delete = set()
+        merged = {}
         for a in self.elements:
-            for b in self.elements:
-                if a is not b and a.d == b.d and a.p == b.p:
-                    a.lookahead |= b.lookahead
-                    delete.add(b)
-        self.elements.difference_update(delete)
+            b = merged.setdefault((a.p, a.d), a)
+            if b is not a:
+                b.lookahead |= a.lookahead
+        self.elements = set(merged.values())
+        self._hash = None
 
     def __contains__(self, element):
         return element in self.elements
@@ -124,13 +122,12 @@ class StateSet(object):
             print(str(e), self.lookaheads[e])
 
     def __hash__(self):
-        start = time()
-        _hash = 0
-        for element in self.elements:
-            _hash ^= hash(element)
-        end = time()
-        StateSet._hashtime += end-start
-        return _hash
+        if self._hash is None:
+            _hash = 0
+            for element in self.elements:
+                _hash ^= hash(element)
+            self._hash = _hash
+        return self._hash
 
 class State(object):
 
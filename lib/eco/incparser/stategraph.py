@@ -21,14 +21,59 @@
 
 
 
-from .state import StateSet, State, LR0Element
+from .state import StateSet, LR0Element
 from .production import Production
 from .helpers import Helper
 from .syntaxtable import FinishSymbol
-from grammar_parser.gparser import Terminal
-from .constants import LR0, LR1, LALR
+from grammar_parser.gparser import Terminal, Nonterminal
+from .constants import LR0, LALR
 from time import time
 import logging
+import sys
+
+def digraph(relation, initial):
+    """Compute the smallest sets F(x) with F(x) = initial[x] | F(y) for all y
+    with x R y, where the relation R is given as a list of successors of each
+    x. This is the `Digraph` algorithm of DeRemer and Pennello, which handles
+    cycles by giving all elements of a strongly connected component the same
+    set."""
+    n = len(initial)
+    result = [set(s) for s in initial]
+    depth = [0] * n
+    stack = []
+    for root in range(n):
+        if depth[root]:
+            continue
+        stack.append(root)
+        depth[root] = len(stack)
+        work = [(root, 0, len(stack))]
+        while work:
+            x, i, d = work[-1]
+            successors = relation[x]
+            if i < len(successors):
+                work[-1] = (x, i + 1, d)
+                y = successors[i]
+                if depth[y] == 0:
+                    stack.append(y)
+                    depth[y] = len(stack)
+                    work.append((y, 0, len(stack)))
+                    continue
+                depth[x] = min(depth[x], depth[y])
+                result[x] |= result[y]
+                continue
+            work.pop()
+            if depth[x] == d:
+                while True:
+                    top = stack.pop()
+                    depth[top] = sys.maxsize
+                    result[top] = result[x]
+                    if top == x:
+                        break
+            if work:
+                parent = work[-1][0]
+                depth[parent] = min(depth[parent], depth[x])
+                result[parent] |= result[x]
+    return result
 
 class StateGraph(object):
 
@@ -40,198 +85,102 @@ class StateGraph(object):
         self.ids = {}
         self.todo = []
         self.done = set()
-        self.maybe_compatible = {}
 
-        self.goto_time = 0
-        self.add_time = 0
-        self.closure_time = 0
-        self.closure_count = 0
-        self.addcount = 0
-        self.weakly = 0
-        self.weakly_count = 0
-        self.mergetime = 0
+        # kernels and kernel lookaheads of the states while building the graph
+        self.kernels = []
+        self.lookaheads = []
+        self.kernel_ids = {}
 
         helper = Helper(grammar)
         self.helper = helper
-        if lr_type == LR0:
-            self.closure = helper.closure_0
-            self.goto = helper.goto_0
-            self.start_set = StateSet([LR0Element(Production(None, [self.start_symbol]), 0)])
-        elif lr_type == LR1 or lr_type == LALR:
-            self.closure = helper.closure_1
-            self.goto = helper.goto_1
-            self.start_set = StateSet()
-            self.start_set.add(LR0Element(Production(None, [self.start_symbol]), 0), set([FinishSymbol()]))
+        self.lr_type = lr_type
+        self.start_set = StateSet()
+        self.start_set.add(LR0Element(Production(None, [self.start_symbol]), 0), set([FinishSymbol()]))
 
     def build(self):
-        State._hashtime = 0
+        """Build the LR(1) automaton of the grammar, merging states whose
+        lookaheads are weakly compatible (Pager, "A Practical General Method
+        for Constructing LR(k) Parsers", 1977). States are kept as kernels,
+        i.e. sorted tuples of item ids (see Helper.intern), plus a list of
+        lookaheads for each of their items. Their closures are only expanded
+        once the graph is finished."""
+        if self.lr_type == LR0:
+            self.build_lr0()
+            return
+        if self.lr_type == LALR:
+            self.build_lalr()
+            return
         start = time()
-        start_set = self.start_set
-        closure = start_set
-        self.state_sets.append(closure)
-        self.ids[closure] = 0
-        _id = 0
-        self.todo.append(_id)
+        helper = self.helper
+        element = next(iter(self.start_set.elements))
+        self.add_state((helper.intern(element),), [set(self.start_set.get_lookahead(element))])
         while self.todo:
-            self.addcount += 1
             _id = self.todo.pop()
             self.done.add(_id)
-            closure_start = time()
-            state_set = self.closure(self.state_sets[_id])
-            self.closure_count += 1
-            closure_end = time()
-            self.closure_time += closure_end - closure_start
-            new_gotos = {}
-            goto_start = time()
-            # create new sets first, then calculate closure
-            for lrelement in state_set.elements:
-                symbol = lrelement.next_symbol()
-                if not symbol: # state is final
-                    continue
-                #XXX optimisation: create all configurations before building
-                new_element = lrelement.clone()
-                new_element.d += 1
-                new_element_la = state_set.get_lookahead(lrelement)
-                stateset = new_gotos.setdefault(symbol, StateSet())
-                stateset.add(new_element, new_element_la)
-
-            # now calculate closure and add result to state_sets
-            goto_end = time()
-            self.goto_time += goto_end - goto_start
-
-            for ss in new_gotos:
-                new_state_set = new_gotos[ss]
-                add_start = time()
-                self.add(_id, ss, new_state_set)
-                add_end = time()
-                self.add_time += add_end - add_start
-
-        end = time()
-        logging.info("add time %s", self.add_time)
-        logging.info("closure time %s", self.closure_time)
-        logging.info("closure time helper %s", self.helper.closure_time)
-        logging.info("goto time %s", self.goto_time)
-        logging.info("hashtime %s", StateSet._hashtime)
-        logging.info("addcount %s", self.addcount)
-        logging.info("states %s", len(self.state_sets))
-        logging.info("weakly %s", self.weakly)
-        logging.info("weakly count %s", self.weakly_count)
-        logging.info("mergetime %s", self.mergetime)
+            plan = helper.closure_plan(self.kernels[_id])
+            lookaheads = helper.closure_lookaheads(plan, self.lookaheads[_id])
+            for symbol, kernel, positions in plan[3]:
+                self.add(_id, symbol, kernel, [lookaheads[i] for i in positions])
+        logging.info("Built %s states in %s", len(self.kernels), time() - start)
 
         # apply closure
-        logging.info("Apply closure to states")
-        clstart = time()
-        new_state_sets = []
-        new_ids = {}
-        for state in self.state_sets:
-            _id = self.ids[state]
-            new_state = self.closure(state)
-            new_state_sets.append(new_state)
-            new_ids[new_state] = new_state
-        self.state_sets = new_state_sets
-        logging.info("after closure %s", len(new_state_sets))
-        logging.info("edges %s", len(set(self.edges.values())))
-        self.ids = new_ids
-        logging.info(time() - clstart)
-
-        logging.info("Finished building Stategraph in %s", end-start)
-        self.closure = None
-        self.goto = None
+        for kernel, lookaheads in zip(self.kernels, self.lookaheads):
+            plan = helper.closure_plan(kernel)
+            state_set = StateSet()
+            for _id, la in zip(plan[0], helper.closure_lookaheads(plan, lookaheads)):
+                state_set.add(helper.item_list[_id], la)
+            self.state_sets.append(state_set)
+        self.ids = dict((ss, i) for i, ss in enumerate(self.state_sets))
+        self.kernels = self.lookaheads = self.kernel_ids = None
+        logging.info("Finished building Stategraph in %s", time() - start)
 
-    def weakly_compatible(self, s1, s2):
-        self.weakly_count += 1
-        core = s1.elements
-        if core != s2.elements:
-            return False
-        if len(core) == 1:
-            return True
-        self.weakly -= time()
-        core = list(core)
-        for i in range(0, len(core)-1):
-            I = core[i]
-            for j in range(i+1, len(core)):
-                J = core[j]
-                if ((s1.lookaheads[I] & s2.lookaheads[J] or s1.lookaheads[J] & s2.lookaheads[I])
-                    and not s1.lookaheads[I] & s1.lookaheads[J]
-                    and not s2.lookaheads[I] & s2.lookaheads[J]):
-                    self.weakly += time()
+    def weakly_compatible(self, la1, la2):
+        """Two states with the same kernel are weakly compatible if merging
+        their lookaheads doesn't introduce conflicts that neither of them had."""
+        n = len(la1)
+        for i in range(n - 1):
+            I1 = la1[i]
+            I2 = la2[i]
+            for j in range(i + 1, n):
+                J1 = la1[j]
+                J2 = la2[j]
+                if ((not I1.isdisjoint(J2) or not J1.isdisjoint(I2))
+                    and I1.isdisjoint(J1) and I2.isdisjoint(J2)):
                     return False
-        self.weakly += time()
         return True
 
-    def find_stateset_without_lookahead(self, state_set):
-        for ss in self.state_sets:
-            if state_set.equals(ss, True):
-                return ss
-        return None
-
     def merge_lookahead(self, old, new):
-        self.mergetime -= time()
         changed = False
-        for element in new.elements:
-            la1 = new.get_lookahead(element)
-            la2 = old.get_lookahead(element)
-            if la1 - la2:
+        for la1, la2 in zip(old, new):
+            if not la2 <= la1:
+                la1 |= la2
                 changed = True
-                new_la = la2 | la1
-                old.lookaheads[element] = new_la
-
-        self.mergetime += time()
         return changed
 
-    def add(self, from_id, symbol, state_set):
+    def add_state(self, kernel, lookaheads):
+        _id = len(self.kernels)
+        self.kernels.append(kernel)
+        self.lookaheads.append(lookaheads)
+        self.kernel_ids.setdefault(kernel, []).append(_id)
+        self.todo.append(_id)
+        return _id
+
+    def add(self, from_id, symbol, kernel, lookaheads):
         merged = False
-        #for candidate in self.state_sets: # only check states that can be reached by symbol
-        for _id in self.maybe_compatible.setdefault(symbol,set()):
-            candidate = self.state_sets[_id]
-            if self.weakly_compatible(state_set, candidate):
+        for _id in self.kernel_ids.get(kernel, ()):
+            if self.weakly_compatible(lookaheads, self.lookaheads[_id]):
                 # merge them
                 merged = True
-                changed = self.merge_lookahead(candidate, state_set)
+                changed = self.merge_lookahead(self.lookaheads[_id], lookaheads)
                 self.edges[(from_id, symbol)] = _id
                 if changed and _id in self.done:
                     # move state to todo list
-                    self.todo.append(_id) #XXX only need to to that if this state is already done (moving not necessary if it hasn't been looked at anyway (e.g. state at the end of list)
+                    self.todo.append(_id)
                     self.done.remove(_id)
 
         if not merged:
             # add normally and put on todo list
-            self.state_sets.append(state_set)
-            _id = len(self.state_sets)-1
-            self.edges[(from_id, symbol)] = _id
-            self.ids[state_set] = _id
-            self.todo.append(_id)
-
-            # add to maybe compatible
-            mc = self.maybe_compatible.setdefault(symbol, set())
-            mc.add(_id)
-
-    def oldadd(self, from_id, symbol, state_set):
-        # LALR way
-       #ss = self.find_stateset_without_lookahead(state_set)
-       #if ss:
-       #    #print("found existing stateset -> merging")
-       #    #print(ss)
-       #    #print(state_set)
-       #    self.merge_lookahead(ss, state_set)
-       #    _id = self.state_sets.index(ss)
-       #else:
-       #    self.state_sets.append(state_set)
-       #    _id = len(self.state_sets)-1
-       #self.edges[(from_id, symbol)] = _id
-
-        # normal LR(1) way
-        add_start = time()
-        _id = self.ids.get(state_set)
-        if _id is None: # new state
-            self.addcount += 1
-            self.state_sets.append(state_set)
-            _id = len(self.state_sets)-1
-            self.ids[state_set] = _id
-            self.todo.append(_id)
-        self.edges[(from_id, symbol)] = _id
-        add_end = time()
-        self.add_time += add_end - add_start
+            self.edges[(from_id, symbol)] = self.add_state(kernel, lookaheads)
 
     def follow(self, from_id, symbol):
         try:
@@ -249,33 +198,131 @@ class StateGraph(object):
     def get_state_set(self, i):
         return self.state_sets[i]
 
-    def convert_lalr(self):
-        removelist = set([])
-        l = len(self.state_sets)
-        for i in range(l):
-            if i in removelist:
-                continue
-            for j in range(l):
-                if j in removelist:
+    def lr0_automaton(self):
+        """Return the items of each state of the LR(0) automaton and the
+        successor state of each state for every symbol."""
+        helper = self.helper
+        start_item = LR0Element(Production(None, [self.start_symbol]), 0)
+        states = []     # items of each state
+        gotos = []      # symbol -> state for each state
+        kernels = {}
+        def add_state(kernel):
+            _id = kernels.get(kernel)
+            if _id is None:
+                _id = kernels[kernel] = len(states)
+                states.append(kernel)
+                gotos.append(None)
+            return _id
+        add_state(frozenset([start_item]))
+        i = 0
+        while i < len(states):
+            items = list(states[i])
+            closure = set(items)
+            for item in items:
+                symbol = item.next_symbol()
+                if isinstance(symbol, Nonterminal):
+                    for new in helper.start_items(symbol):
+                        if new not in closure:
+                            closure.add(new)
+                            items.append(new)
+            states[i] = items
+            successors = {}
+            for item in items:
+                symbol = item.next_symbol()
+                if symbol is not None:
+                    successors.setdefault(symbol, []).append(LR0Element(item.p, item.d + 1))
+            gotos[i] = dict((symbol, add_state(frozenset(kernel))) for symbol, kernel in successors.items())
+            i += 1
+        return states, gotos
+
+    def build_lr0(self):
+        """Build the LR(0) automaton of the grammar. Its items have no
+        lookaheads, so SyntaxTable reduces them on every symbol."""
+        start = time()
+        states, gotos = self.lr0_automaton()
+        self.state_sets = []
+        self.edges = {}
+        for q, items in enumerate(states):
+            state_set = StateSet()
+            for item in items:
+                state_set.add(item)
+            self.state_sets.append(state_set)
+            for symbol, r in gotos[q].items():
+                self.edges[(q, symbol)] = r
+        self.ids = dict((ss, i) for i, ss in enumerate(self.state_sets))
+        logging.info("Finished building LR(0) Stategraph in %s", time() - start)
+
+    def build_lalr(self):
+        """Build the LR(0) automaton of the grammar and compute the LALR(1)
+        lookaheads of its items from the relations described in DeRemer and
+        Pennello, "Efficient Computation of LALR(1) Look-Ahead Sets" (1982).
+        Unlike build, this never needs to revisit states, but may produce
+        reduce/reduce conflicts that LR(1) wouldn't have."""
+        start = time()
+        helper = self.helper
+        states, gotos = self.lr0_automaton()
+        lr0 = time()
+
+        # nonterminal transitions (p, A)
+        transitions = []
+        index = {}
+        for p, goto in enumerate(gotos):
+            for symbol in goto:
+                if isinstance(symbol, Nonterminal):
+                    index[(p, symbol)] = len(transitions)
+                    transitions.append((p, symbol))
+
+        # DR(p, A): terminals that can be shifted after the transition
+        # reads: transitions (r, C) over nullable C following the transition
+        direct = []
+        reads = []
+        for p, symbol in transitions:
+            r = gotos[p][symbol]
+            terminals = set(s for s in gotos[r] if not isinstance(s, Nonterminal))
+            if p == 0 and symbol == self.start_symbol:
+                terminals.add(FinishSymbol())
+            direct.append(terminals)
+            reads.append([index[(r, s)] for s in gotos[r] if isinstance(s, Nonterminal) and helper.nullable(s)])
+        read = digraph(reads, direct)
+
+        # (q, A) includes (p, B) if B ::= x A y, y is nullable and p --x--> q.
+        # Walking the production from p also finds all states containing its
+        # items (lookback), whose lookahead is then Follow(p, B).
+        includes = [[] for _ in transitions]
+        lookback = [{} for _ in states]
+        for x, (p, symbol) in enumerate(transitions):
+            for item in helper.start_items(symbol):
+                right = item.p.right
+                if item.d == 1 and item.isfinal(): # epsilon
+                    lookback[p].setdefault(item, []).append(x)
                     continue
-                s1 = self.state_sets[i]
-                s2 = self.state_sets[j]
-                if s1 is not s2 and s1.equals(s2, False):
-                    for e in s2:
-                        s1.add(e) # this should automatically merge the lookahead of the states
-                    s1.merge()
-                    for key in self.edges:
-                        fromid, symbol = key
-                        to = self.edges[key]
-                        if fromid == j:
-                            fromid == i
-                        if to == j:
-                            to == i
-                        self.edges.pop(key)
-                        self.edges[(fromid, symbol)] = to
-                    removelist.add(j)
-        l = list(removelist)
-        l.sort()
-        l.reverse()
-        for j in l:
-            self.state_sets.pop(j)
+                q = p
+                for d in range(len(right)):
+                    lookback[q].setdefault(LR0Element(item.p, d), []).append(x)
+                    s = right[d]
+                    if isinstance(s, Nonterminal) and all(helper.nullable(t) for t in right[d+1:]):
+                        includes[index[(q, s)]].append(x)
+                    q = gotos[q][s]
+                lookback[q].setdefault(LR0Element(item.p, len(right)), []).append(x)
+        follow = digraph(includes, read)
+
+        finish = set([FinishSymbol()])
+        self.state_sets = []
+        self.edges = {}
+        for q, items in enumerate(states):
+            state_set = StateSet(set(items))
+            for item in items:
+                if item.p.left is None:
+                    state_set.lookaheads[item] = finish
+                    continue
+                la = set()
+                for x in lookback[q][item]:
+                    la |= follow[x]
+                state_set.lookaheads[item] = la
+            self.state_sets.append(state_set)
+            for symbol, r in gotos[q].items():
+                self.edges[(q, symbol)] = r
+        self.ids = dict((ss, i) for i, ss in enumerate(self.state_sets))
+
+        logging.info("LR(0) automaton: %s states in %s", len(states), lr0 - start)
+        logging.info("Finished building LALR(1) Stategraph in %s", time() - start)
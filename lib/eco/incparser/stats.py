@@ -0,0 +1,55 @@
+"""Statistics about a single run of the incremental parser."""
+
+class ParseStats(object):
+    """Counters and wall times collected while running `IncParser.inc_parse`.
+    Out-of-context analyses started during the parse add to the statistics of
+    the outer parse.
+
+    The time spent in each phase is stored in `times` (in seconds). Phases
+    may be nested: `parse` is the whole parse, which includes `recovery`
+    (error recovery and refinement), which in turn includes `ooc`
+    (out-of-context analyses). `reuse` is the top-down reuse pass that runs
+    after the parse."""
+
+    counters = ["iterations", "shifts", "reductions", "optimistic_shifts",
+                "left_breakdowns", "right_breakdowns", "reused_parents",
+                "reused_isomorphic", "recoveries", "isolated",
+                "ooc_analyses"]
+
+    def __init__(self):
+        self.iterations = 0         # lookaheads processed by the parse loop
+        self.shifts = 0             # shifted terminals (incl. right breakdown)
+        self.reductions = 0
+        self.optimistic_shifts = 0  # nonterminals shifted as a whole
+        self.left_breakdowns = 0
+        self.right_breakdowns = 0
+        self.reused_parents = 0     # parents reused by `ambig_reuse_check`
+        self.reused_isomorphic = 0  # nodes reused by `top_down_reuse`
+        self.recoveries = 0         # error recovery attempts
+        self.isolated = 0           # subtrees isolated due to errors
+        self.ooc_analyses = 0
+        self.times = {}
+
+    def add_time(self, phase, seconds):
+        self.times[phase] = self.times.get(phase, 0) + seconds
+
+    def merge(self, other):
+        """Add the counters and times of `other` to these statistics."""
+        for name in self.counters:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        for phase, t in other.times.items():
+            self.add_time(phase, t)
+
+    def reused(self):
+        """Number of nodes reused from the previous parse tree."""
+        return self.optimistic_shifts + self.reused_parents + self.reused_isomorphic
+
+    def as_dict(self):
+        d = dict((name, getattr(self, name)) for name in self.counters)
+        d["times"] = dict(self.times)
+        return d
+
+    def __repr__(self):
+        counts = " ".join("%s=%s" % (name, getattr(self, name)) for name in self.counters)
+        times = " ".join("%s=%.2fms" % (phase, t * 1000) for phase, t in sorted(self.times.items()))
+        return "<ParseStats %s %s>" % (counts, times)
@@ -19,10 +19,17 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+from array import array
 from .production import Production
-from grammar_parser.gparser import Terminal, Nonterminal, Epsilon
+from grammar_parser.gparser import Terminal, Nonterminal, Epsilon, IndentationTerminal
 from .constants import LR0, LR1, LALR
 
+# Actions in the compiled syntax table are encoded as integers. The lowest two
+# bits contain the kind of the action, the remaining bits the target state
+# (shift/goto) or the index of the reduced production (reduce).
+ERROR, SHIFT, REDUCE, ACCEPT = 0, 1, 2, 3
+ACTION_NAMES = ["Error", "Shift", "Reduce", "Accept"]
+
 class SyntaxTableElement(object):
 
     def __init__(self, action):
@@ -68,6 +75,9 @@ class Accept(SyntaxTableElement):
 
 class SyntaxTable(object):
 
+    # the arrays the table is compiled into
+    arrays = ["base", "check", "packed", "default", "default_goto", "default_on", "may_reduce"]
+
     def __init__(self, prod_ids, lr_type=LR0):
         self.lr_type = lr_type
         self.prod_ids = prod_ids
@@ -111,6 +121,236 @@ class SyntaxTable(object):
                         self.table[i][s] = action
                     else:
                         del self.table[i][s]
+        self.compile()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self.arrays:
+            value = state.get(name)
+            if isinstance(value, memoryview):
+                # loaded from the table cache (see tablecache)
+                state[name] = array(value.format, value) if value.format != "B" else bytearray(value)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if "check" not in state:
+            # table was pickled before it was compiled into its current form
+            self.__dict__.pop("actions", None)
+            self.compile()
+
+    def compile(self):
+        """Intern all grammar symbols to consecutive integers and compress the
+        table into a few flat arrays of encoded actions (gotos are encoded as
+        shifts). The table of dictionaries is dropped afterwards.
+
+        Every state reduces by its most frequent reduction by default and
+        every nonterminal has a default goto, so for those entries only a bit
+        in `default_on` is needed. All remaining actions are packed into one
+        vector by giving each state an offset (`base`) into it, such that the
+        actions of different states don't collide, while `check` records which
+        state each entry belongs to (row displacement). See `action` for
+        looking up actions in O(1)."""
+        symbols = set()
+        for row in self.table:
+            symbols.update(row)
+        self.intern_symbols(sorted(symbols, key=lambda s: (type(s).__name__, s.name)))
+        self.states = len(self.table)
+
+        self.set_reductions([])
+        productions = {}
+        rows = []
+        for row in self.table:
+            encoded = {}
+            for symbol, element in sorted(row.items(), key=lambda x: self.symbol_id(x[0])):
+                if isinstance(element, Reduce):
+                    index = productions.get(element.action)
+                    if index is None:
+                        index = productions[element.action] = len(self.reductions)
+                        self.add_reduction(element)
+                    action = index << 2 | REDUCE
+                elif isinstance(element, Accept):
+                    action = ACCEPT
+                else:
+                    action = element.action << 2 | SHIFT
+                encoded[self.symbol_id(symbol)] = action
+            rows.append(encoded)
+        del self.table
+
+        # For every state and nonterminal: whether a subtree of that
+        # nonterminal may start with a terminal that causes a reduction in that
+        # state (or may be empty). If not, the incremental parser can break
+        # down such a subtree without looking for its first terminal.
+        first, nullable = self.first_sets()
+        self.may_reduce = bytearray((self.states * self.width + 7) >> 3)
+        for state, row in enumerate(rows):
+            offset = state * self.width
+            reducing = set(sid for sid, action in row.items() if action & 3 == REDUCE)
+            for nonterminal, terminals in first.items():
+                if nonterminal in nullable or not terminals.isdisjoint(reducing):
+                    i = offset + nonterminal
+                    self.may_reduce[i >> 3] |= 1 << (i & 7)
+
+        # default reductions of each state and default gotos of each
+        # nonterminal (the most frequent ones)
+        self.default = array("i", bytes(4 * self.states))
+        self.default_goto = array("i", bytes(4 * self.width))
+        self.default_on = bytearray((self.states * self.width + 7) >> 3)
+        nonterminals = set(self.symbol_ids.get(Nonterminal, {}).values())
+        gotos = {}
+        for row in rows:
+            for sid, action in row.items():
+                if sid in nonterminals:
+                    counts = gotos.setdefault(sid, {})
+                    counts[action] = counts.get(action, 0) + 1
+        for sid, counts in gotos.items():
+            self.default_goto[sid] = max(counts, key=counts.get)
+        for state, row in enumerate(rows):
+            counts = {}
+            for action in row.values():
+                if action & 3 == REDUCE:
+                    counts[action] = counts.get(action, 0) + 1
+            if counts:
+                self.default[state] = max(counts, key=counts.get)
+            offset = state * self.width
+            for sid in list(row):
+                if row[sid] == (self.default_goto[sid] or self.default[state]):
+                    i = offset + sid
+                    self.default_on[i >> 3] |= 1 << (i & 7)
+                    del row[sid]
+
+        # row displacement, placing the fullest rows first
+        self.base = array("i", bytes(4 * self.states))
+        used = bytearray(self.width)
+        free = 0    # all entries before this one are used
+        last = {}   # last base of rows with the same symbols
+        for state in sorted(range(self.states), key=lambda s: -len(rows[s])):
+            sids = tuple(sorted(rows[state]))
+            if not sids:
+                continue
+            free = used.find(0, free)
+            pos = max(free, sids[0], last.get(sids, -1) + 1 + sids[0])
+            while True:
+                pos = used.find(0, pos)
+                if pos == -1:
+                    pos = len(used)
+                base = pos - sids[0]
+                if base + self.width > len(used):
+                    used.extend(bytes(base + self.width - len(used)))
+                for sid in sids:
+                    if used[base + sid]:
+                        break
+                else:
+                    break
+                pos += 1
+            for sid in sids:
+                used[base + sid] = 1
+            self.base[state] = last[sids] = base
+        self.check = array("i", [-1]) * len(used)
+        self.packed = array("i", bytes(4 * len(used)))
+        for state, row in enumerate(rows):
+            base = self.base[state]
+            for sid, action in row.items():
+                self.check[base + sid] = state
+                self.packed[base + sid] = action
+
+    def intern_symbols(self, symbols):
+        self.symbols = symbols
+        self.symbol_ids = {}
+        for i, symbol in enumerate(symbols):
+            self.symbol_ids.setdefault(type(symbol), {})[symbol.name] = i
+        self.terminal_ids = self.symbol_ids.setdefault(Terminal, {})
+        self.symbol_ids[IndentationTerminal] = self.terminal_ids
+        # The last column is empty and used for symbols unknown to the grammar
+        self.unknown_id = len(symbols)
+        self.width = len(symbols) + 1
+        self.eos_id = self.unknown_id
+        if FinishSymbol in self.symbol_ids:
+            self.eos_id = list(self.symbol_ids[FinishSymbol].values())[0]
+
+    def set_reductions(self, reductions):
+        self.reductions = []    # Reduce element of each production
+        self.reduce_amount = [] # number of symbols popped from the stack
+        self.reduce_goto = []   # symbol id of the production's left side
+        for element in reductions:
+            self.add_reduction(element)
+
+    def add_reduction(self, element):
+        self.reductions.append(element)
+        self.reduce_amount.append(element.amount())
+        self.reduce_goto.append(self.symbol_id(element.action.left))
+
+    def action(self, state, sid):
+        """Return the encoded action of a state on a symbol id (ERROR if there
+        is none)."""
+        i = self.base[state] + sid
+        if self.check[i] == state:
+            return self.packed[i]
+        i = state * self.width + sid
+        if self.default_on[i >> 3] & 1 << (i & 7):
+            return self.default_goto[sid] or self.default[state]
+        return ERROR
+
+    def reduces_in(self, state, sid):
+        """Return whether a subtree of the nonterminal with the given id may
+        cause a reduction when parsed in a state (see compile)."""
+        i = state * self.width + sid
+        return self.may_reduce[i >> 3] & 1 << (i & 7) != 0
+
+    def expected(self, state):
+        """Return the symbols that have an action in a state."""
+        return [symbol for sid, symbol in enumerate(self.symbols) if self.action(state, sid)]
+
+    def first_sets(self):
+        """Compute the FIRST sets (as symbol ids) of all nonterminals that can
+        be reduced, considering only reducible productions. Returns the sets
+        and the ids of nullable nonterminals."""
+        productions = [(self.reduce_goto[i], r.action.right) for i, r in enumerate(self.reductions)]
+        first = dict((left, set()) for left, _ in productions)
+        nullable = set()
+        changed = True
+        while changed:
+            changed = False
+            for left, right in productions:
+                size = len(first[left])
+                for symbol in right:
+                    if isinstance(symbol, Epsilon):
+                        continue
+                    sid = self.symbol_id(symbol)
+                    if isinstance(symbol, Nonterminal):
+                        first[left] |= first.get(sid, set())
+                        if sid in nullable:
+                            continue
+                    else:
+                        first[left].add(sid)
+                    break
+                else:
+                    if left not in nullable:
+                        nullable.add(left)
+                        changed = True
+                if len(first[left]) != size:
+                    changed = True
+        return first, nullable
+
+    def symbol_id(self, symbol):
+        """Return the interned id of a grammar symbol."""
+        if isinstance(symbol, FinishSymbol):
+            return self.eos_id
+        try:
+            return self.symbol_ids[type(symbol)][symbol.name]
+        except KeyError:
+            return self.unknown_id
+
+    def element(self, action):
+        """Convert an encoded action back into a syntax table element."""
+        kind = action & 3
+        if kind == SHIFT:
+            return Shift(action >> 2)
+        if kind == REDUCE:
+            return self.reductions[action >> 2]
+        if kind == ACCEPT:
+            return Accept()
+        return None
 
     def resolve_conflict(self, state, symbol, oldaction, newaction, precedences):
         # input: old_action, lookup_symbol, new_action
@@ -196,7 +436,7 @@ class SyntaxTable(object):
         return None
 
     def lookup(self, state_id, symbol):
-        try:
-            return self.table[state_id][symbol]
-        except KeyError:
-            return None
+        element = self.element(self.action(state_id, self.symbol_id(symbol)))
+        if isinstance(element, Shift) and isinstance(symbol, Nonterminal):
+            return Goto(element.action)
+        return element
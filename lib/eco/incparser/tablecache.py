@@ -0,0 +1,217 @@
+# Copyright (c) 2012--2013 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Cache of compiled syntax tables in the user's cache directory.
+
+Tables are stored under a hash of the grammar's content and FORMAT_VERSION in
+a binary format: a JSON header with the symbols and reductions of the table,
+followed by the raw arrays of the compiled table (see SyntaxTable.compile),
+which the loaded table uses directly. Large tables are mapped into memory
+instead of being read.
+Reductions are stored as the productions they reduce and are looked up in the
+grammar when loading, so the grammar's annotations don't need to be stored."""
+
+import os, sys
+import json
+import struct
+import hashlib
+import tempfile
+import mmap
+import logging
+
+from .syntaxtable import SyntaxTable, FinishSymbol, Reduce
+from .production import Production
+from grammar_parser.gparser import Terminal, MagicTerminal, IndentationTerminal, Nonterminal, Epsilon
+
+# Needs to be increased whenever the format or the generated tables change
+FORMAT_VERSION = 1
+MAGIC = b"ECOTABLE"
+HEADER = struct.Struct("<8sII")
+SUFFIX = ".tbl"
+
+# Least recently used tables are removed if the cache grows beyond this size
+MAX_SIZE = 64 * 1024 * 1024
+
+# Tables up to this size are read into memory. Larger ones are memory mapped,
+# which keeps their files open as long as the tables are used (on Windows they
+# can't be replaced or pruned until then).
+MMAP_SIZE = 4 * 1024 * 1024
+
+symbol_types = dict((cls.__name__, cls) for cls in [Terminal, MagicTerminal, IndentationTerminal, Nonterminal, Epsilon, FinishSymbol])
+
+def cache_dir():
+    path = os.environ.get("ECO_CACHE_DIR")
+    if path:
+        return path
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "eco", "tables")
+
+def table_id(*parts):
+    """Return the name of the cache entry for a grammar identified by `parts`
+    (e.g. the grammar's text and options)."""
+    m = hashlib.sha256()
+    m.update(("%s|%s|" % (FORMAT_VERSION, sys.byteorder)).encode("utf-8"))
+    for part in parts:
+        m.update(str(part).encode("utf-8"))
+        m.update(b"\0")
+    return m.hexdigest()
+
+def encode_symbol(symbol):
+    if symbol is None:
+        # e.g. functions in the right side of rules that the bootstrap
+        # parser doesn't turn into symbols
+        return None
+    return [type(symbol).__name__, symbol.name]
+
+def decode_symbol(data):
+    return symbol_types[data[0]](data[1])
+
+def productions(rules):
+    """Return all productions of a grammar by their left side and right side
+    names (like Helper.start_items creates them)."""
+    result = {}
+    for symbol, rule in rules.items():
+        for i, a in enumerate(rule.alternatives):
+            if a == []:
+                a = [Epsilon()]
+            p = Production(symbol, a, rule.annotations[i], rule.precs[i])
+            if i in rule.inserts:
+                insert = rule.inserts[i]
+                p.inserts[insert[0]] = insert[1]
+            result[production_key(p)] = p
+    return result
+
+def production_key(p):
+    return json.dumps([encode_symbol(p.left)] + [encode_symbol(s) for s in p.right])
+
+def dumps(table):
+    """Serialise a compiled syntax table."""
+    arrays = []
+    data = []
+    offset = 0
+    for name in SyntaxTable.arrays:
+        value = memoryview(getattr(table, name))
+        raw = value.tobytes()
+        arrays.append([name, value.format, offset, len(raw)])
+        padding = -len(raw) % 8
+        data.append(raw + bytes(padding))
+        offset += len(raw) + padding
+    meta = {
+        "lr_type": table.lr_type,
+        "states": table.states,
+        "symbols": [encode_symbol(s) for s in table.symbols],
+        "reductions": [json.loads(production_key(r.action)) for r in table.reductions],
+        "arrays": arrays,
+    }
+    meta = json.dumps(meta).encode("utf-8")
+    meta += b" " * (-(HEADER.size + len(meta)) % 8) # JSON allows trailing whitespace
+    return HEADER.pack(MAGIC, FORMAT_VERSION, len(meta)) + meta + b"".join(data)
+
+def loads(buf, rules):
+    """Create a syntax table from serialised data (which may be a memory map
+    the table will keep referencing) and the rules of its grammar."""
+    magic, version, size = HEADER.unpack_from(buf)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("not a syntax table of version %s" % (FORMAT_VERSION,))
+    meta = json.loads(bytes(buf[HEADER.size:HEADER.size + size]).decode("utf-8"))
+    prods = productions(rules)
+    table = SyntaxTable(None, meta["lr_type"])
+    table.states = meta["states"]
+    table.intern_symbols([decode_symbol(s) for s in meta["symbols"]])
+    table.set_reductions([Reduce(prods[json.dumps(r)]) for r in meta["reductions"]])
+    view = memoryview(buf)
+    start = HEADER.size + size
+    for name, typecode, offset, length in meta["arrays"]:
+        value = view[start + offset:start + offset + length].cast(typecode)
+        setattr(table, name, value)
+    if len(table.base) != table.states or len(table.default_goto) != table.width:
+        raise ValueError("corrupt syntax table")
+    return table
+
+def load(name, rules):
+    """Load the table cached under `name` (see table_id) or return None."""
+    filename = os.path.join(cache_dir(), name + SUFFIX)
+    try:
+        with open(filename, "rb") as f:
+            if os.fstat(f.fileno()).st_size > MMAP_SIZE:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+        table = loads(buf, rules)
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        if not isinstance(e, FileNotFoundError):
+            logging.warning("Ignoring cached syntax table %s: %s", filename, e)
+        return None
+    try:
+        os.utime(filename) # mark as recently used
+    except OSError:
+        pass
+    return table
+
+def store(name, table):
+    """Atomically write a table to the cache (if possible) and remove the least
+    recently used tables if the cache got too big."""
+    directory = cache_dir()
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmpname = tempfile.mkstemp(SUFFIX + ".tmp", "", directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(dumps(table))
+            os.replace(tmpname, os.path.join(directory, name + SUFFIX))
+        except BaseException:
+            os.unlink(tmpname)
+            raise
+    except OSError as e:
+        logging.warning("Could not cache syntax table: %s", e)
+        return
+    prune(directory, MAX_SIZE, keep=name + SUFFIX)
+
+def prune(directory, limit, keep=None):
+    entries = []
+    for filename in os.listdir(directory):
+        if not filename.endswith(SUFFIX) or filename == keep:
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    if keep:
+        try:
+            total += os.stat(os.path.join(directory, keep)).st_size
+        except OSError:
+            pass
+    entries.sort()
+    while total > limit and entries:
+        _, size, path = entries.pop(0)
+        try:
+            os.unlink(path)
+        except OSError:
+            continue
+        total -= size
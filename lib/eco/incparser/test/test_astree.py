@@ -0,0 +1,219 @@
+from incparser.astree import Node, TextNode, BOS, EOS, OffsetIndex, FinishSymbol, regex_chars
+from grammar_parser.gparser import Terminal, Nonterminal
+import pytest
+
+class Test_History:
+
+    def test_load_closest_version(self):
+        node = TextNode(Terminal("a"))
+        node.save(1)
+        node.symbol.name = "b"
+        node.textlen = 1
+        node.save(4)
+        node.symbol.name = "c"
+        node.textlen = 2
+        node.save(9)
+
+        assert node.versions == [1, 4, 9]
+        node.load(6)
+        assert node.version == 4
+        assert node.symbol.name == "b"
+        assert node.textlen == 1
+        node.load(100)
+        assert node.version == 9
+        assert node.symbol.name == "c"
+        node.load(1)
+        assert node.version == 1
+        assert node.symbol.name == "a"
+
+    def test_get_attr(self):
+        node = TextNode(Terminal("a"))
+        node.textlen = 1
+        node.save(2)
+        node.textlen = 5
+        node.save(7)
+
+        assert node.get_attr("textlen", 2) == 1
+        assert node.get_attr("textlen", 6) == 1
+        assert node.get_attr("textlen", 7) == 5
+        assert node.get_attr("textlen", 50) == 5
+        assert node.get_text(3) == "a"
+        with pytest.raises(AttributeError):
+            node.get_attr("textlen", 1)
+
+    def test_save_out_of_order(self):
+        node = TextNode(Nonterminal("A"))
+        node.save(5)
+        node.save(2)
+        node.save(5)
+        assert node.versions == [2, 5]
+
+    def test_delete_version(self):
+        node = TextNode(Terminal("a"))
+        node.save(1)
+        node.symbol.name = "b"
+        node.save(3)
+        node.delete_version(3)
+        assert node.versions == [1]
+        assert node.max_version == 1
+        assert node.get_text(3) == "a"
+
+        node.save(2)
+        node.symbol.name = "c"
+        node.save(3)
+        node.delete_versions_from(1)
+        assert node.versions == [1]
+        assert node.get_text(3) == "a"
+        assert node.get_attr("symbol.name", 3) == "a"
+
+    def test_delete_version_plain_node(self):
+        node = Node(Nonterminal("A"), 0, [])
+        node.versions = [1, 2]
+        node.max_version = 2
+        node.delete_version(2)
+        assert node.versions == [1]
+        node.delete_versions_from(0)
+        assert node.versions == []
+
+    def test_delete_version_first_lookup(self):
+        node = TextNode(Terminal("a"))
+        node.save(1)
+        node.save(2)
+        node.first_lookup = (2, 7)
+        node.delete_version(2)
+        assert node.first_lookup is None
+        node.first_lookup = (1, 7)
+        node.delete_versions_from(0)
+        assert node.first_lookup is None
+
+    def test_only_store_changes(self):
+        node = TextNode(Terminal("a"))
+        node.save(1)
+        size = len(repr(node.log))
+        for v in range(2, 50):
+            node.save(v)
+        assert node.versions == list(range(1, 50))
+        assert len(repr(node.log)) == size
+        node.changed = True
+        node.save(50)
+        assert node.get_history("changed") == ([1, 50], [False, True])
+        assert node.get_history("textlen") == ([1], [-1])
+        assert node.get_attr("changed", 49) is False
+        assert node.get_attr("changed", 51) is True
+
+    def test_set_attr_keeps_later_versions(self):
+        node = TextNode(Terminal("a"))
+        left = TextNode(Terminal("b"))
+        node.save(1)
+        node.save(5)
+        node.set_attr("left", 3, left)
+        assert node.get_attr("left", 1) is None
+        assert node.get_attr("left", 3) is left
+        assert node.get_attr("left", 4) is left
+        assert node.get_attr("left", 5) is None
+        node.set_attr("left", 3, None)
+        assert node.get_attr("left", 4) is None
+
+    def test_delete_version_keeps_later_versions(self):
+        node = TextNode(Terminal("a"))
+        node.save(1)
+        node.symbol.name = "b"
+        node.save(2)
+        node.save(3)
+        node.delete_version(2)
+        assert node.versions == [1, 3]
+        assert node.get_text(2) == "a"
+        assert node.get_text(3) == "b"
+
+    def test_compact(self):
+        node = TextNode(Terminal("a"))
+        node.save(1)
+        node.symbol.name = "b"
+        node.save(2)
+        node.symbol.name = "c"
+        node.save(4)
+        node.changed = True
+        node.save(6)
+        node.compact(5)
+        assert node.versions == [4, 6]
+        assert node.get_history("symbol.name") == ([4], ["c"])
+        assert node.get_history("textlen") == ([4], [-1])
+        assert node.get_history("changed") == ([4, 6], [False, True])
+        assert node.get_history("new") == ([], [])
+        with pytest.raises(AttributeError):
+            node.get_attr("symbol.name", 3)
+        node.load(5)
+        assert node.symbol.name == "c"
+        assert node.changed is False
+        node.load(6)
+        assert node.changed is True
+
+class Test_OffsetIndex:
+
+    def setup_method(self):
+        # Root(BOS, A("ab", "c"), "de", EOS)
+        self.bos = BOS(Terminal(""))
+        self.eos = EOS(FinishSymbol())
+        self.ab = TextNode(Terminal("ab"))
+        self.c = TextNode(Terminal("c"))
+        self.de = TextNode(Terminal("de"))
+        self.a = TextNode(Nonterminal("A"))
+        self.a.set_children([self.ab, self.c])
+        self.root = TextNode(Nonterminal("Root"))
+        self.root.set_children([self.bos, self.a, self.de, self.eos])
+        self.calc_textlengths()
+        for node in self.nodes():
+            node.save(1)
+
+    def nodes(self):
+        return [self.bos, self.ab, self.c, self.a, self.de, self.eos, self.root]
+
+    def calc_textlengths(self):
+        for node in self.nodes():
+            node.calc_textlength()
+
+    def test_offset(self):
+        index = OffsetIndex()
+        assert index.offset(self.bos) == 0
+        assert index.offset(self.c) == 2
+        assert index.offset(self.a) == 0
+        assert index.offset(self.de) == 3
+        assert index.offset(self.eos) == 5
+
+    def test_offset_shares_child_offsets(self):
+        index = OffsetIndex()
+        assert index.offset(self.eos) == 5
+        # the siblings' offsets were summed up once for the whole level
+        assert index.children[self.root][1] == [0, 0, 3, 5]
+        assert index.offset(self.c) == 2
+        assert index.children[self.a][1] == [0, 2]
+
+    def test_node_at(self):
+        index = OffsetIndex()
+        assert index.node_at(self.root, 0) is self.bos
+        assert index.node_at(self.root, 1) is self.ab
+        assert index.node_at(self.root, 2) is self.ab
+        assert index.node_at(self.root, 3) is self.c
+        assert index.node_at(self.root, 5) is self.de
+        assert index.node_at(self.root, 6) is None
+
+    def test_versions(self):
+        self.ab.symbol.name = "abcd"
+        self.calc_textlengths()
+        for node in self.nodes():
+            node.save(2)
+        old = OffsetIndex(1)
+        new = OffsetIndex(2)
+        assert old.offset(self.de) == 3
+        assert new.offset(self.de) == 5
+        assert old.node_at(self.root, 3) is self.c
+        assert new.node_at(self.root, 3) is self.ab
+
+def test_regex_chars():
+    chars = regex_chars("[a-z_][a-z0-9_]*")
+    assert "x" in chars
+    assert "7" in chars
+    assert "_" in chars
+    assert "X" not in chars
+    assert regex_chars("[a-z_][a-z0-9_]*") is chars
+    assert regex_chars("\\+=") == frozenset("\\+=")
@@ -172,6 +172,30 @@ def test_closure_1():
     assert LR1Element(Production(D, [d]), 0, set([a])) in closure
     assert LR1Element(Production(D, [epsilon]), 1, set([a])) in closure
 
+def test_closure_plan():
+    s1 = StateSet()
+    s1.add(LR1Element(Production(F, [C, D, f]), 0), set([finish]))
+    closure = helper1.closure_1(s1)
+    assert closure.lookaheads[State(Production(F, [C, D, f]), 0)] == set([finish])
+    assert closure.lookaheads[State(Production(C, [D, A]), 0)] == set([d, f])
+    assert closure.lookaheads[State(Production(D, [d]), 0)] == set([a])
+    assert closure.lookaheads[State(Production(D, [epsilon]), 1)] == set([a])
+
+    # closures of the same kernel with other lookaheads reuse the cached plan
+    s2 = StateSet()
+    s2.add(LR1Element(Production(Z, [S]), 0), set([finish]))
+    helper1.closure_1(s2)
+    plans = len(helper1.closures)
+    s3 = StateSet()
+    s3.add(LR1Element(Production(Z, [S]), 0), set([c]))
+    closure = helper1.closure_1(s3)
+    assert len(helper1.closures) == plans
+    assert closure.lookaheads[State(Production(Z, [S]), 0)] == set([c])
+    assert closure.lookaheads[State(Production(S, [S, b]), 0)] == set([b, c])
+    assert closure.lookaheads[State(Production(S, [a]), 0)] == set([b, c])
+
+    assert helper1.intern(LR1Element(Production(S, [a]), 0)) == helper1.intern(State(Production(S, [a]), 0))
+
 def test_goto_1():
     lre = LR1Element(Production(Z, [S]), 0, set([finish]))
     clone = lre.clone()
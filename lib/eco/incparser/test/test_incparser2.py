@@ -25,6 +25,7 @@ from grammars.grammars import lang_dict
 from grammar_parser.plexer import PriorityLexer
 from grammar_parser.gparser import Terminal, Nonterminal
 from incparser.astree import TextNode, BOS, EOS, FinishSymbol
+import logging
 
 N = Nonterminal
 T = Terminal
@@ -115,3 +116,29 @@ class Test_JavaParser(Test_IncrementalParser):
         bos.insert_after(new)
         self.lexer.relex(new)
         assert self.parser.inc_parse([]) == True
+
+class Test_Tracing(Test_IncrementalParser):
+
+    def parse(self, parser, lexer, text):
+        parser.init_ast()
+        bos = parser.previous_version.parent.children[0]
+        new = TextNode(Terminal(text))
+        bos.insert_after(new)
+        lexer.relex(new)
+        return parser.inc_parse([])
+
+    def test_untraced(self, caplog):
+        parser, lexer = calc.load()
+        parser.set_tracing(False)
+        assert "parse_terminal" in parser.__dict__
+        with caplog.at_level(logging.DEBUG):
+            assert self.parse(parser, lexer, "1+2") == True
+        assert not caplog.records
+
+    def test_traced(self, caplog):
+        parser, lexer = calc.load()
+        parser.set_tracing(True)
+        assert "parse_terminal" not in parser.__dict__
+        with caplog.at_level(logging.DEBUG):
+            assert self.parse(parser, lexer, "1+2") == True
+        assert any("parse_terminal" in r.getMessage() for r in caplog.records)
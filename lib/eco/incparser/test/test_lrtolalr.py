@@ -20,9 +20,10 @@
 # IN THE SOFTWARE.
 
 from grammar_parser.gparser import Parser, Terminal, Nonterminal
-from incparser.state import StateSet, State, LR1Element
+from incparser.state import StateSet, State, LR0Element
 from incparser.production import Production
-from incparser.stategraph import StateGraph
+from incparser.stategraph import StateGraph, digraph
+from incparser.constants import LR0, LR1, LALR
 from incparser.syntaxtable import FinishSymbol
 
 import pytest
@@ -44,111 +45,102 @@ S = Nonterminal("S")
 A = Nonterminal("A")
 f = FinishSymbol()
 
+def lookaheads(graph, state_set):
+    for ss in graph.state_sets:
+        if ss == state_set:
+            return dict((e, ss.lookaheads[e]) for e in ss.elements)
+
 def test_graph():
-    pytest.skip("conversion is not working yet")
-    graph = StateGraph(p.start_symbol, p.rules, 1)
+    graph = StateGraph(p.start_symbol, p.rules, LALR)
     graph.build()
 
-    s0 = StateSet([
-        LR1Element(Production(None, [S]), 0, set([f])),
-        LR1Element(Production(S, [b, A, c]), 0, set([f])),
-    ])
-
-    s1 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 1, set([f])),
-        LR1Element(Production(A, [S]), 0, set([c])),
-        LR1Element(Production(A, [a]), 0, set([c])),
-        LR1Element(Production(S, [b, A, c]), 0, set([c])),
-    ])
-
-    s2 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 1, set([c])),
-        LR1Element(Production(A, [S]), 0, set([c])),
-        LR1Element(Production(A, [a]), 0, set([c])),
-        LR1Element(Production(S, [b, A, c]), 0, set([c])),
-    ])
-
-    s3 = StateSet([
-        LR1Element(Production(A, [a]), 1, set([c])),
-    ])
-
-    s4 = StateSet([
-        LR1Element(Production(None, [S]), 1, set([f])),
-    ])
-
-    s5 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 2, set([f])),
-    ])
-
-    s6 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 2, set([c])),
-    ])
-
-    s7 = StateSet([
-        LR1Element(Production(A, [S]), 1, set([c])),
-    ])
-
-    s8 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 3, set([f])),
-    ])
-
-    s9 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 3, set([c])),
-    ])
-
-    assert len(graph.state_sets) == 10
-    assert s0 in graph.state_sets
-    assert s1 in graph.state_sets
-    assert s2 in graph.state_sets
-    assert s3 in graph.state_sets
-    assert s4 in graph.state_sets
-    assert s6 in graph.state_sets
-    assert s7 in graph.state_sets
-    assert s8 in graph.state_sets
-    assert s9 in graph.state_sets
-
-    graph.convert_lalr()
-
-    s0 = StateSet([
-        LR1Element(Production(None, [S]), 0, set([f])),
-        LR1Element(Production(S, [b, A, c]), 0, set([f])),
-    ])
-
-    s1 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 1, set([f, c])),
-        LR1Element(Production(A, [S]), 0, set([c])),
-        LR1Element(Production(A, [a]), 0, set([c])),
-        LR1Element(Production(S, [b, A, c]), 0, set([c])),
-    ])
-
-    s2 = StateSet([
-        LR1Element(Production(A, [a]), 1, set([c])),
-    ])
-
-    s3 = StateSet([
-        LR1Element(Production(None, [S]), 1, set([f])),
-    ])
-
-    s4 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 2, set([f, c])),
-    ])
-
-    s5 = StateSet([
-        LR1Element(Production(A, [S]), 1, set([c])),
-    ])
-
-    s6 = StateSet([
-        LR1Element(Production(S, [b, A, c]), 3, set([f, c])),
-    ])
+    s0 = StateSet()
+    s0.add(LR0Element(Production(None, [S]), 0), set([f]))
+    s0.add(LR0Element(Production(S, [b, A, c]), 0), set([f]))
+
+    s1 = StateSet()
+    s1.add(LR0Element(Production(S, [b, A, c]), 1), set([f, c]))
+    s1.add(LR0Element(Production(A, [S]), 0), set([c]))
+    s1.add(LR0Element(Production(A, [a]), 0), set([c]))
+    s1.add(LR0Element(Production(S, [b, A, c]), 0), set([c]))
+
+    s2 = StateSet()
+    s2.add(LR0Element(Production(A, [a]), 1), set([c]))
+
+    s3 = StateSet()
+    s3.add(LR0Element(Production(None, [S]), 1), set([f]))
+
+    s4 = StateSet()
+    s4.add(LR0Element(Production(S, [b, A, c]), 2), set([f, c]))
+
+    s5 = StateSet()
+    s5.add(LR0Element(Production(A, [S]), 1), set([c]))
+
+    s6 = StateSet()
+    s6.add(LR0Element(Production(S, [b, A, c]), 3), set([f, c]))
 
     assert len(graph.state_sets) == 7
-    assert s0 in graph.state_sets
-    assert s1 in graph.state_sets
-    assert s2 in graph.state_sets
-    assert s3 in graph.state_sets
-    assert s4 in graph.state_sets
-    assert s6 in graph.state_sets
+    for ss in [s0, s1, s2, s3, s4, s5, s6]:
+        assert lookaheads(graph, ss) == ss.lookaheads
 
 def test_edges():
-    pass
+    graph = StateGraph(p.start_symbol, p.rules, LALR)
+    graph.build()
+    s1 = graph.follow(0, b)
+    # LR(1) would need a second state for S ::= "b" . A "c" with lookahead c
+    assert graph.follow(s1, b) == s1
+    s4 = graph.follow(s1, A)
+    assert graph.follow(s4, c) is not None
+    assert graph.follow(s4, a) is None
+    assert graph.get_symbols() == set([a, b, c, S, A])
+
+nullable = """
+    S ::= A B "c"
+    A ::= "a" A
+        |
+    B ::= B "b"
+        |
+        | A
+"""
 
+def test_compare_lr1():
+    # Merging the states of the LR(1) automaton with the same core yields the
+    # LALR(1) automaton
+    for grammar in [nullable, """
+        E ::= E "+" T | T
+        T ::= T "*" F | F
+        F ::= "(" E ")" | "id"
+    """]:
+        p = Parser(grammar)
+        p.parse()
+        lr1 = StateGraph(p.start_symbol, p.rules, LR1)
+        lr1.build()
+        lalr = StateGraph(p.start_symbol, p.rules, LALR)
+        lalr.build()
+        merged = {}
+        for ss in lr1.state_sets:
+            state = merged.setdefault(frozenset(ss.elements), {})
+            for e in ss.elements:
+                state.setdefault(e, set()).update(ss.lookaheads[e])
+        assert len(lalr.state_sets) == len(merged)
+        for ss in lalr.state_sets:
+            assert merged[frozenset(ss.elements)] == ss.lookaheads
+
+def test_digraph():
+    # 0 -> 1 -> 2 -> 1, 3 -> 0
+    relation = [[1], [2], [1], [0]]
+    result = digraph(relation, [set("a"), set("b"), set("c"), set("d")])
+    assert result[0] == set("abc")
+    assert result[1] == result[2] == set("bc")
+    assert result[3] == set("abcd")
+
+def test_lr0():
+    # LR(0) has the states of LALR(1), but without lookaheads
+    graph = StateGraph(p.start_symbol, p.rules, LR0)
+    graph.build()
+    lalr = StateGraph(p.start_symbol, p.rules, LALR)
+    lalr.build()
+    assert [ss.elements for ss in graph.state_sets] == [ss.elements for ss in lalr.state_sets]
+    assert graph.edges == lalr.edges
+    for ss in graph.state_sets:
+        assert all(la is None for la in ss.lookaheads.values())
@@ -70,3 +70,67 @@ def test_build():
     st.build(graph)
     for i in range(len(syntaxtable)):
         assert st.table[i] == syntaxtable[i]
+
+def test_compiled_table():
+    st = SyntaxTable(None, 1)
+    st.table = [dict(row) for row in syntaxtable]
+    st.compile()
+    assert not hasattr(st, "table")
+    assert st.states == len(syntaxtable)
+    for state, row in enumerate(syntaxtable):
+        for symbol in [b, c, d, S, A, FinishSymbol(), Terminal("x")]:
+            element = st.lookup(state, symbol)
+            assert type(element) is type(row.get(symbol))
+            if element:
+                assert element == row[symbol]
+            assert st.element(st.action(state, st.symbol_id(symbol))) == element
+        assert set(st.expected(state)) == set(row)
+    assert st.symbol_id(Terminal("x")) == st.unknown_id
+    assert st.symbol_id(Nonterminal("b")) != st.symbol_id(b)
+    assert st.symbol_id(FinishSymbol("other")) == st.symbol_id(FinishSymbol())
+
+class UncompressedTable(SyntaxTable):
+    def compile(self):
+        self.rows = [dict(row) for row in self.table]
+        SyntaxTable.compile(self)
+
+def test_compressed_table():
+    p = Parser("""
+    E ::= E "+" T
+        | T
+    T ::= T "*" P
+        | P
+    P ::= "a"
+        | "(" E ")"
+        | "-" P
+    """)
+    p.parse()
+    graph = StateGraph(p.start_symbol, p.rules, 1)
+    graph.build()
+    st = UncompressedTable(None, 1)
+    st.build(graph)
+    symbols = st.symbols + [Terminal("x")]
+    for state, row in enumerate(st.rows):
+        for symbol in symbols:
+            element = st.lookup(state, symbol)
+            assert type(element) is type(row.get(symbol))
+            if element:
+                assert element == row[symbol]
+    # most entries are default reductions, so the packed actions take up less
+    # space than a table of all states and symbols
+    assert any(st.default)
+    assert len(st.packed) < st.states * st.width
+
+def test_may_reduce():
+    graph = StateGraph(p.start_symbol, p.rules, 1)
+    graph.build()
+    st = SyntaxTable(None, 1)
+    st.build(graph)
+    first, nullable = st.first_sets()
+    assert first[st.symbol_id(S)] == set([st.symbol_id(b)])
+    assert first[st.symbol_id(A)] == set([st.symbol_id(c)])
+    assert nullable == set([st.symbol_id(A)])
+    for state in range(st.states):
+        # no state reduces on "b", but A may be empty
+        assert not st.reduces_in(state, st.symbol_id(S))
+        assert st.reduces_in(state, st.symbol_id(A))
@@ -0,0 +1,113 @@
+# Copyright (c) 2012--2013 King's College London
+# Created by the Software Development Team <http://soft-dev.org/>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import os
+import mmap
+import pickle
+
+from incparser import tablecache
+from incparser.syntaxtable import SyntaxTable
+from incparser.stategraph import StateGraph
+from grammar_parser.gparser import Parser, Terminal
+
+grammar = """
+    E ::= E "+" T
+        | T
+    T ::= T "*" P
+        | P
+    P ::= "a"
+        | "(" E ")"
+        |
+"""
+
+def build(grammar=grammar):
+    p = Parser(grammar)
+    p.parse()
+    graph = StateGraph(p.start_symbol, p.rules, 1)
+    graph.build()
+    st = SyntaxTable(None, 1)
+    st.build(graph)
+    return st, p.rules
+
+def assert_same(st, loaded):
+    assert loaded.states == st.states
+    assert loaded.symbols == st.symbols
+    for state in range(st.states):
+        for symbol in st.symbols + [Terminal("x")]:
+            assert loaded.lookup(state, symbol) == st.lookup(state, symbol)
+            assert loaded.reduces_in(state, st.symbol_id(symbol)) == st.reduces_in(state, st.symbol_id(symbol))
+
+def test_table_id():
+    assert tablecache.table_id(grammar, False) == tablecache.table_id(grammar, False)
+    assert tablecache.table_id(grammar, False) != tablecache.table_id(grammar, True)
+
+def test_roundtrip():
+    st, rules = build()
+    loaded = tablecache.loads(tablecache.dumps(st), rules)
+    assert_same(st, loaded)
+    # the loaded table can still be pickled (e.g. for the batch parser)
+    assert_same(st, pickle.loads(pickle.dumps(loaded)))
+
+def test_header_padding():
+    # the header is padded to a multiple of 8 bytes for any length
+    for i in range(8):
+        st, rules = build(grammar + '        | "%s"\n' % ("b" * (i + 1)))
+        assert_same(st, tablecache.loads(tablecache.dumps(st), rules))
+
+def test_store_load(tmp_path, monkeypatch):
+    monkeypatch.setenv("ECO_CACHE_DIR", str(tmp_path))
+    st, rules = build()
+    name = tablecache.table_id(grammar)
+    assert tablecache.load(name, rules) is None
+    tablecache.store(name, st)
+    assert os.listdir(str(tmp_path)) == [name + tablecache.SUFFIX]
+    assert_same(st, tablecache.load(name, rules))
+
+def test_load_mmap(tmp_path, monkeypatch):
+    monkeypatch.setenv("ECO_CACHE_DIR", str(tmp_path))
+    st, rules = build()
+    name = tablecache.table_id(grammar)
+    tablecache.store(name, st)
+    # small tables are read, so their files can be replaced while in use
+    loaded = tablecache.load(name, rules)
+    assert isinstance(loaded.base.obj, bytes)
+    monkeypatch.setattr(tablecache, "MMAP_SIZE", 0)
+    mapped = tablecache.load(name, rules)
+    assert isinstance(mapped.base.obj, mmap.mmap)
+    assert_same(st, loaded)
+    assert_same(st, mapped)
+
+def test_corrupt(tmp_path, monkeypatch):
+    monkeypatch.setenv("ECO_CACHE_DIR", str(tmp_path))
+    st, rules = build()
+    name = tablecache.table_id(grammar)
+    with open(os.path.join(str(tmp_path), name + tablecache.SUFFIX), "wb") as f:
+        f.write(tablecache.dumps(st)[:100])
+    assert tablecache.load(name, rules) is None
+
+def test_prune(tmp_path):
+    for i in range(5):
+        path = os.path.join(str(tmp_path), "%s%s" % (i, tablecache.SUFFIX))
+        with open(path, "wb") as f:
+            f.write(bytes(100))
+        os.utime(path, (i, i))
+    tablecache.prune(str(tmp_path), 250, keep="0" + tablecache.SUFFIX)
+    assert sorted(os.listdir(str(tmp_path))) == ["0.tbl", "4.tbl"]
@@ -0,0 +1,54 @@
+from incparser import tracing
+from incparser.incparser import IncParser
+import logging
+
+class Base(object):
+    def step(self):
+        return "base"
+
+class Traced(Base):
+
+    def __init__(self):
+        logging.debug("init")
+
+    def documented(self):
+        """Doesn't call logging.debug."""
+        return 1
+
+    def logged(self, a, *, b=2):
+        logging.debug("logged %s %s", a, b)
+        return a + b
+
+    def step(self):
+        logging.debug("step")
+        return super().step()
+
+# without source, as if only the compiled module was installed
+exec(compile("def nosource(self):\n    logging.debug('x')\n    return 3\n", "<nosource>", "exec"), globals())
+Traced.nosource = nosource
+
+def test_untraced():
+    methods = tracing.untraced(Traced)
+    assert sorted(methods) == ["logged"]
+    assert methods["logged"].__kwdefaults__ == {"b": 2}
+
+def test_set_tracing(caplog):
+    obj = Traced()
+    tracing.set_tracing(obj, False)
+    with caplog.at_level(logging.DEBUG):
+        assert obj.logged(1) == 3
+        assert obj.logged(1, b=3) == 4
+        assert obj.documented() == 1
+        assert obj.nosource() == 3
+    assert [r.getMessage() for r in caplog.records] == ["x"]
+    caplog.clear()
+    tracing.set_tracing(obj, True)
+    with caplog.at_level(logging.DEBUG):
+        assert obj.logged(1) == 3
+    assert [r.getMessage() for r in caplog.records] == ["logged 1 2"]
+
+def test_parser_methods():
+    methods = tracing.untraced(IncParser)
+    assert "parse_terminal" in methods
+    assert "__init__" not in methods
+    assert "set_tracing" not in methods
@@ -0,0 +1,108 @@
+"""Debug tracing for the parser's hot paths.
+
+The parser's methods log every step via `logging.debug`. Even when debug
+logging is disabled, these calls and the evaluation of their arguments are
+paid for on every token. This module compiles copies of such methods with the
+`logging.debug` calls removed. Objects that don't trace bind these copies as
+instance attributes, overriding the logging versions defined by their class.
+Methods whose source isn't available or that refer to variables of an
+enclosing scope (e.g. via `super()`) are left as they are.
+"""
+
+import ast
+import inspect
+import logging
+import textwrap
+import types
+
+_cache = {}
+
+def tracing_enabled():
+    """Default used when constructing parsers: trace if debug logging is
+    enabled."""
+    return logging.getLogger().isEnabledFor(logging.DEBUG)
+
+def is_debug_call(node):
+    return isinstance(node, ast.Call) and \
+        isinstance(node.func, ast.Attribute) and node.func.attr == "debug" and \
+        isinstance(node.func.value, ast.Name) and node.func.value.id == "logging"
+
+class StripDebugLogging(ast.NodeTransformer):
+    """Removes all `logging.debug(...)` statements."""
+
+    def visit_Expr(self, node):
+        if is_debug_call(node.value):
+            return None
+        return node
+
+    def generic_visit(self, node):
+        ast.NodeTransformer.generic_visit(self, node)
+        body = getattr(node, "body", None)
+        if type(body) is list and not body:
+            node.body = [ast.Pass()]
+        return node
+
+def parse(func):
+    """Return the syntax tree of `func`, or None if its source isn't
+    available (e.g. if only .pyc files are installed)."""
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        return None
+    return ast.parse(textwrap.dedent(source))
+
+def logs_debug(tree):
+    return any(is_debug_call(node) for node in ast.walk(tree))
+
+def strip(func, tree):
+    """Compile a copy of `func`, given its syntax tree, without its
+    `logging.debug` calls."""
+    tree = StripDebugLogging().visit(tree)
+    ast.fix_missing_locations(tree)
+    ast.increment_lineno(tree, func.__code__.co_firstlineno - 1)
+    code = compile(tree, func.__code__.co_filename, "exec")
+    namespace = {}
+    exec(code, func.__globals__, namespace)
+    stripped = namespace[func.__name__]
+    stripped.__defaults__ = func.__defaults__
+    stripped.__kwdefaults__ = func.__kwdefaults__
+    return stripped
+
+def untraced(cls):
+    """Return a dict of all methods of `cls` that log debug messages, compiled
+    without the logging calls."""
+    try:
+        return _cache[cls]
+    except KeyError:
+        pass
+    methods = {}
+    seen = set()
+    for klass in cls.__mro__:
+        for name, func in klass.__dict__.items():
+            if name in seen:
+                continue
+            seen.add(name)
+            if not inspect.isfunction(func):
+                continue
+            # Special methods are looked up on the class, so instance
+            # attributes wouldn't override them
+            if name.startswith("__") and name.endswith("__"):
+                continue
+            # Closures (including the __class__ cell of super()) can't be
+            # recompiled outside of their scope
+            if func.__code__.co_freevars:
+                continue
+            tree = parse(func)
+            if tree is None or not logs_debug(tree):
+                continue
+            methods[name] = strip(func, tree)
+    _cache[cls] = methods
+    return methods
+
+def set_tracing(obj, enabled):
+    """Switch debug logging of `obj` on or off."""
+    for name, func in untraced(type(obj)).items():
+        if enabled:
+            obj.__dict__.pop(name, None)
+        else:
+            obj.__dict__[name] = types.MethodType(func, obj)
@@ -65,6 +65,7 @@ class NodeEditor(QFrame):
 
     sig_painted = pyqtSignal()
     sig_keypress = pyqtSignal(QKeyEvent)
+    sig_parsed = pyqtSignal()
 
     def __init__(self, parent=None):
         QWidget.__init__(self, parent)
@@ -83,6 +84,19 @@ class NodeEditor(QFrame):
         self.backuptimer.start(30000)
         self.undotimer = QTimer(self)
         self.undotimer.timeout.connect(self.trigger_undotimer)
+        # Reparses consecutive character edits at most once per reparse delay
+        # (see TreeManager.option_coalesce_edits)
+        self.reparsetimer = QTimer(self)
+        self.reparsetimer.setSingleShot(True)
+        self.reparsetimer.timeout.connect(self.trigger_reparsetimer)
+
+        # Parses running in the background (see
+        # TreeManager.option_background_parse) report back via sig_parsed.
+        # They are started after each repaint. As the tree can't be read
+        # while it is being parsed, repaints until the parse has been
+        # published show the last frame that has been painted.
+        self.sig_parsed.connect(self.parse_finished)
+        self.frame = None
 
         self.blinktimer = QTimer(self)
         self.blinktimer.start(500)
@@ -169,13 +183,36 @@ class NodeEditor(QFrame):
         if self.timer.isActive():
             self.show_cursor = True
             return
+        if self.tm.parse_job is not None:
+            # don't interrupt the parse just to blink the cursor
+            return
         self.show_cursor ^= True
         self.update()
 
     def trigger_undotimer(self):
+        if self.tm.parse_job is not None and self.tm.pending_edit is None:
+            # retry once the background parse has finished
+            return
+        self.trigger_reparsetimer()
         self.tm.undo_snapshot()
         self.undotimer.stop()
 
+    def trigger_reparsetimer(self):
+        self.reparsetimer.stop()
+        if self.tm.flush_edits():
+            if self.tm.parse_job is None:
+                self.getWindow().btReparse([])
+            self.update()
+
+    def start_parse(self):
+        self.tm.start_parse(self.sig_parsed.emit)
+
+    def parse_finished(self):
+        if self.tm.parse_finished():
+            self.tm.publish_parse()
+            self.getWindow().btReparse([])
+            self.update()
+
     def setImageMode(self, boolean):
         self.imagemode = boolean
 
@@ -279,6 +316,16 @@ class NodeEditor(QFrame):
         self.scroll_width = max(0, max_width - current_width)
 
     def paintEvent(self, event):
+        if self.tm.parse_running():
+            if self.frame is not None:
+                paint = QtGui.QPainter()
+                paint.begin(self)
+                paint.drawPixmap(0, 0, self.frame)
+                paint.end()
+            return
+        if self.tm.option_background_parse:
+            QTimer.singleShot(0, self.start_parse)
+
         # Clear data in the visualisation overlay
         self.overlay.clear_data()
         self.autolboxlines.clear()
@@ -294,7 +341,11 @@ class NodeEditor(QFrame):
             self.image = QImage()
             paint.begin(self.image)
         else:
-            paint.begin(self)
+            ratio = self.devicePixelRatioF()
+            self.frame = QPixmap(int(self.width() * ratio), int(self.height() * ratio))
+            self.frame.setDevicePixelRatio(ratio)
+            self.frame.fill(Qt.transparent)
+            paint.begin(self.frame)
         paint.setFont(self.font)
 
         self.longest_column = 0
@@ -305,6 +356,10 @@ class NodeEditor(QFrame):
         self.paintLines(paint, self.viewport_y)
 
         paint.end()
+        if not self.imagemode:
+            paint.begin(self)
+            paint.drawPixmap(0, 0, self.frame)
+            paint.end()
 
         total_lines = 0
         max_width = 0
@@ -764,6 +819,7 @@ class NodeEditor(QFrame):
 
     def mousePressEvent(self, e):
         if e.button() == Qt.LeftButton:
+            self.trigger_reparsetimer()
             self.tm.input_log.append("# mousePressEvent")
             self.coordinate_to_cursor(e.x(), e.y())
             self.tm.selection_start = self.tm.cursor.copy()
@@ -777,6 +833,7 @@ class NodeEditor(QFrame):
 
     def mouseDoubleClickEvent(self, e):
         if e.button() == Qt.LeftButton:
+            self.tm.cancel_parse()
             self.coordinate_to_cursor(e.x(), e.y())
             node = self.tm.get_node_from_cursor()
             lbox = self.get_languagebox(node)
@@ -846,6 +903,7 @@ class NodeEditor(QFrame):
             self.tm.input_log.pop()
             self.tm.input_log.pop()
             self.tm.input_log.pop()
+        self.tm.cancel_parse()
         self.coordinate_to_cursor(e.x(), e.y())
         self.tm.selection_end = self.tm.cursor.copy()
         self.tm.input_log.append("self.selection_end = self.cursor.copy()")
@@ -867,6 +925,10 @@ class NodeEditor(QFrame):
         self.edit_rightnode = False
 
         reparse = True
+        app = QApplication.instance()
+        delay = app.reparse_delay
+        self.tm.option_coalesce_edits = delay > 0
+        self.tm.option_background_parse = app.background_parse
 
         if key.escape:
             self.tm.key_escape()
@@ -906,6 +968,13 @@ class NodeEditor(QFrame):
                     return
             self.tm.key_normal(text)
 
+        if self.tm.pending_edit is not None or self.tm.parse_job is not None:
+            # the edit hasn't been parsed yet
+            reparse = False
+        if self.tm.pending_edit is not None:
+            if not self.reparsetimer.isActive():
+                self.reparsetimer.start(delay)
+
         if reparse:
             self.getWindow().btReparse([])
         self.update()
@@ -926,7 +995,8 @@ class NodeEditor(QFrame):
                 self.tm.reparse(self.tm.selection_start.node)
             else:
                 self.tm.add_languagebox(self.sublanguage)
-            self.getWindow().btReparse([])
+            if self.tm.parse_job is None:
+                self.getWindow().btReparse([])
             self.update()
 
     def change_languagebox(self):
@@ -1130,6 +1200,8 @@ class NodeEditor(QFrame):
         pass
 
     def saveToJson(self, filename, swap=False):
+        self.trigger_reparsetimer()
+        self.tm.finish_parse()
         whitespaces = self.tm.get_mainparser().whitespaces
         root = self.tm.parsers[0][0].previous_version.parent
         language = self.tm.parsers[0][2]
@@ -0,0 +1,45 @@
+from batchparse import parse_file, batch_parse
+
+python = "Python 2.7.5"
+
+def write(tmpdir, name, text):
+    path = tmpdir.join(name)
+    path.write(text)
+    return str(path)
+
+class Test_BatchParse:
+
+    def test_ok(self, tmpdir):
+        filename = write(tmpdir, "ok.py", "x = 1\ny = 2\n")
+        result = parse_file((filename, python, True))
+        assert result["status"] == "ok"
+        assert result["errors"] == []
+        assert result["language"] == python
+        assert set(result["times"]) == {"load", "parse"}
+        assert result["stats"]["shifts"] > 0
+
+    def test_error_position(self, tmpdir):
+        filename = write(tmpdir, "error.py", "x = 1\ny = 2 +* 3\n")
+        result = parse_file((filename, python, False))
+        assert result["status"] == "error"
+        assert result["errors"] == [{"token": "*", "language": python, "line": 2, "column": 8, "offset": 13}]
+        assert "stats" not in result
+
+    def test_document(self):
+        result = parse_file(("test/calcerror.eco", None, False))
+        assert result["status"] == "error"
+        assert result["language"] == "Basic Calculator"
+        assert result["errors"][0]["line"] == 1
+
+    def test_failed(self, tmpdir):
+        result = parse_file((str(tmpdir.join("missing.py")), python, False))
+        assert result["status"] == "failed"
+        assert "missing.py" in result["message"]
+        filename = write(tmpdir, "nolang.py", "x = 1\n")
+        assert parse_file((filename, None, False))["status"] == "failed"
+
+    def test_pool(self, tmpdir):
+        files = [write(tmpdir, "f%s.py" % i, "x = %s\n" % ("1" if i % 2 else "")) for i in range(4)]
+        results = list(batch_parse(files, python, jobs=2))
+        assert [r["file"] for r in results] == files
+        assert [r["status"] for r in results] == ["error", "ok", "error", "ok"]
@@ -0,0 +1,44 @@
+from compilegrammars import compile_grammars
+from grammars import grammars, bundle
+from grammars.grammars import lang_dict, EcoFile
+from treemanager import TreeManager
+
+calc = "Basic Calculator"
+
+def forget(name):
+    for key in list(grammars._cache):
+        if key.startswith(name + "::"):
+            del grammars._cache[key]
+
+class Test_CompileGrammars:
+
+    def test_load_from_bundle(self, tmpdir, monkeypatch):
+        path = str(tmpdir.join("grammars.bundle"))
+        results = dict(compile_grammars([calc], path))
+        assert isinstance(results[calc], float)
+        assert set(bundle.read(path)) == {calc}
+
+        monkeypatch.setenv("ECO_GRAMMAR_BUNDLE", path)
+        monkeypatch.setattr(bundle, "_bundle", None)
+        def compile(self, buildlexer=True):
+            raise AssertionError("bundled grammar was compiled")
+        monkeypatch.setattr(EcoFile, "compile", compile)
+        forget(calc)
+        try:
+            parser, lexer = lang_dict[calc].load()
+            treemanager = TreeManager()
+            treemanager.add_parser(parser, lexer, calc)
+            treemanager.import_file("1+2*3")
+            assert parser.last_status == True
+        finally:
+            forget(calc)
+
+    def test_outdated(self, tmpdir, monkeypatch):
+        path = str(tmpdir.join("grammars.bundle"))
+        list(compile_grammars([calc], path))
+        monkeypatch.setenv("ECO_GRAMMAR_BUNDLE", path)
+        monkeypatch.setattr(bundle, "_bundle", None)
+        lang = lang_dict[calc]
+        assert bundle.load(lang) is not None
+        monkeypatch.setattr(lang, "extract", "other")
+        assert bundle.load(lang) is None
@@ -378,6 +378,27 @@ class Test_Python(Test_Helper):
 
         cls.treemanager.set_font_test(7, 17) # hard coded. PyQt segfaults in test suite
 
+class PythonProgram(object):
+    """Mixin for tests that compare separate tree managers editing the same
+    small Python program."""
+
+    program = "class X:\n    def x(self):\n        return [1, 2]\n\nx = X()\n"
+
+    def setup_treemanager(self, program=None, **options):
+        """Import `program` (default: self.program) into a new tree manager and
+        then set its `option_<name>` flags."""
+        parser, lexer = python.load()
+        treemanager = TreeManager()
+        treemanager.add_parser(parser, lexer, python.name)
+        treemanager.import_file(self.program if program is None else program)
+        for name, value in options.items():
+            setattr(treemanager, "option_" + name, value)
+        return treemanager
+
+    def fresh_tree(self, program):
+        tm = self.setup_treemanager(program)
+        return tm.get_mainparser().previous_version.parent
+
 class Test_Boogie(Test_Python):
     def test_simple(self):
         for c in "class X:\r    p":
@@ -3866,6 +3887,56 @@ class Test_Undo(Test_Python):
         self.move(RIGHT, 0)
         self.treemanager.key_normal("y")
 
+    def test_saved_nodes(self):
+        self.reset()
+        self.type_save("1")
+        self.type_save("+")
+        self.type_save("2")
+        versions = sorted(self.treemanager.saved_nodes)
+        assert versions[-1] == self.treemanager.get_max_version()
+        for v in versions:
+            for node in self.treemanager.saved_nodes[v]:
+                assert v in node.versions
+
+        self.treemanager.key_ctrl_z()
+        self.treemanager.key_ctrl_z()
+        self.compare("1")
+        self.type_save("3")
+        self.compare("13")
+        assert max(self.treemanager.saved_nodes) == self.treemanager.version
+        for v in self.treemanager.saved_nodes:
+            for node in self.treemanager.saved_nodes[v]:
+                assert node.versions[-1] <= self.treemanager.version
+
+    def test_history_limit(self):
+        self.reset()
+        self.treemanager.option_history_limit = 2
+        self.treemanager.import_file("x = 1")
+        self.treemanager.key_end()
+        for c in "+2+3+4+5":
+            self.type_save(c)
+        self.compare("x = 1+2+3+4+5")
+        assert self.treemanager.undo_snapshots == [13, 15, 17]
+        assert self.treemanager.min_version == 13
+        assert min(self.treemanager.saved_parsers) == 13
+        root = self.parser.previous_version.parent
+        for node in self.treemanager.get_history_nodes(root):
+            assert len([v for v in node.versions if v <= 13]) <= 1
+
+        for i in range(10):
+            self.treemanager.key_ctrl_z()
+        self.compare("x = 1+2+3+4")
+        for i in range(10):
+            self.treemanager.key_shift_ctrl_z()
+        self.compare("x = 1+2+3+4+5")
+
+        self.treemanager.key_ctrl_z()
+        self.compare("x = 1+2+3+4+")
+        self.type_save("6")
+        self.compare("x = 1+2+3+4+6")
+        self.treemanager.key_ctrl_z()
+        self.compare("x = 1+2+3+4+")
+
 
 class Test_Undo_LBoxes(Test_Helper):
 
@@ -4581,6 +4652,99 @@ class Test_TopDownReuse(Test_Python):
         assert E is E2
         assert Y is Y2
 
+class Test_BulkImport(PythonProgram, Test_Python):
+
+    def import_incremental(self, program):
+        parser, lexer = python.load()
+        treemanager = TreeManager()
+        treemanager.add_parser(parser, lexer, python.name)
+        parser.bulk_parse = lambda: False
+        treemanager.import_file(program)
+        return treemanager
+
+    def test_same_tree(self):
+        self.reset()
+        self.treemanager.import_file(self.program)
+        assert self.treemanager.version == 1
+        assert self.treemanager.undo_snapshots == [1]
+        assert self.parser.last_status is True
+        other = self.import_incremental(self.program)
+        self.tree_compare(self.parser.previous_version.parent, other.get_mainparser().previous_version.parent)
+
+        # continue editing both trees
+        for tm in [self.treemanager, other]:
+            tm.key_end()
+            tm.key_normal("+")
+            tm.undo_snapshot()
+            tm.key_normal("1")
+            tm.undo_snapshot()
+            tm.key_ctrl_z()
+            tm.key_ctrl_z()
+        assert self.treemanager.export_as_text() == other.export_as_text() == self.program
+        self.tree_compare(self.parser.previous_version.parent, other.get_mainparser().previous_version.parent)
+
+    def test_fallback_on_errors(self):
+        self.reset()
+        self.treemanager.import_file("x = (1\ny = 2\n")
+        assert self.parser.last_status is False
+        assert len(self.parser.error_nodes) > 0
+        assert self.treemanager.export_as_text() == "x = (1\ny = 2\n"
+
+    def test_failed_bulk_parse_keeps_tokens(self):
+        parser, lexer = python.load()
+        treemanager = TreeManager()
+        treemanager.add_parser(parser, lexer, python.name)
+        attrs = ["state", "exists", "position", "autobox", "local_error", "nested_errors"]
+        root = parser.previous_version.parent
+        snapshots = []
+        bulk_parse = parser.bulk_parse
+        def checked_bulk_parse():
+            before = [[getattr(n, a) for a in attrs] for n in root.children]
+            result = bulk_parse()
+            after = [[getattr(n, a) for a in attrs] for n in root.children]
+            snapshots.append((result, before, after, [n.parent is root for n in root.children]))
+            return result
+        parser.bulk_parse = checked_bulk_parse
+        treemanager.import_file("x = (1\ny = 2\n")
+        result, before, after, parents = snapshots[0]
+        assert result is False
+        assert len(before) > 3
+        assert after == before
+        assert all(parents)
+
+class Test_ParseStats(Test_Python):
+
+    def test_stats_per_version(self):
+        self.reset()
+        self.treemanager.import_file("x = 1\ny = 2\nz = 3")
+        version = self.treemanager.version
+        stats = self.treemanager.get_parse_stats()
+        assert stats.shifts > 0
+        assert stats.reductions > 0
+        assert stats.recoveries == 0
+        assert stats.times["parse"] >= 0
+
+        self.treemanager.key_end()
+        self.treemanager.key_normal("4")
+        stats2 = self.treemanager.get_parse_stats()
+        assert stats2 is not stats
+        assert stats2.optimistic_shifts > 0
+        assert stats2.left_breakdowns > 0
+        assert stats2.shifts < stats.shifts
+        assert self.treemanager.get_parse_stats(version) is stats
+
+        self.treemanager.key_normal("+")
+        stats3 = self.treemanager.get_parse_stats()
+        assert stats3.recoveries >= 1
+        assert stats3.isolated >= 1
+        assert "recovery" in stats3.times
+        assert self.parser.last_status is False
+
+        self.treemanager.key_ctrl_z()
+        self.treemanager.key_normal("5")
+        assert self.treemanager.get_parse_stats(self.treemanager.global_version) is not stats3
+        assert max(self.treemanager.parse_stats) == self.treemanager.version
+
 sql_single = lang_dict["SQL Statement"]
 javapy = lang_dict["Java + Python"]
 javasql = lang_dict["Java + SQL"]
@@ -5516,3 +5680,239 @@ y = 2"""
 
         assert len(treemanager.parsers) == 2
         assert parser.last_status == True
+
+class Test_CoalesceEdits(PythonProgram, Test_Python):
+
+    def edit(self, tm):
+        tm.cursor.line = 2
+        tm.key_end()
+        tm.cursor_movement(LEFT)
+        for c in ", x + abc":
+            tm.key_normal(c)
+        tm.key_backspace()
+        tm.key_backspace()
+        tm.key_normal("c")
+        tm.key_normal("d")
+        tm.undo_snapshot()
+        tm.key_end()
+        tm.key_normal("\r")
+        for c in "y = 1":
+            tm.key_normal(c)
+        tm.undo_snapshot()
+
+    def test_same_result(self):
+        normal = self.setup_treemanager(coalesce_edits=False)
+        batched = self.setup_treemanager(coalesce_edits=True)
+        self.edit(normal)
+        self.edit(batched)
+        assert batched.pending_edit is None
+        assert batched.export_as_text() == normal.export_as_text()
+        assert "return [1, 2, x + acd]\n        y = 1" in batched.export_as_text()
+        assert batched.get_mainparser().last_status is True
+        self.tree_compare(normal.get_mainparser().previous_version.parent, batched.get_mainparser().previous_version.parent)
+        # one version per batch
+        assert batched.version < normal.version
+        assert len(batched.undo_snapshots) == len(normal.undo_snapshots)
+
+        for tm in [normal, batched]:
+            tm.key_ctrl_z()
+        assert batched.export_as_text() == normal.export_as_text()
+        self.tree_compare(normal.get_mainparser().previous_version.parent, batched.get_mainparser().previous_version.parent)
+        for tm in [normal, batched]:
+            tm.key_ctrl_z()
+        assert batched.export_as_text() == normal.export_as_text() == self.program
+        for tm in [normal, batched]:
+            tm.key_shift_ctrl_z()
+        assert batched.export_as_text() == normal.export_as_text()
+        self.tree_compare(normal.get_mainparser().previous_version.parent, batched.get_mainparser().previous_version.parent)
+
+    def test_flush(self):
+        tm = self.setup_treemanager(coalesce_edits=True)
+        version = tm.version
+        tm.cursor.line = 4
+        tm.key_end()
+        tm.key_normal("1")
+        tm.key_normal("2")
+        assert tm.version == version
+        assert tm.pending_edit is not None
+        assert tm.flush_edits() is True
+        assert tm.flush_edits() is False
+        assert tm.version == version + 2
+        assert tm.export_as_text() == self.program.replace("X()", "X()12")
+        assert tm.get_mainparser().last_status is False
+
+class Test_ApplyEdits(PythonProgram, Test_Python):
+
+    def test_edits(self):
+        tm = self.setup_treemanager()
+        version = tm.version
+        tm.cursor.line = 4
+        tm.key_end()
+        tm.apply_edits([
+            (self.program.index("2]"), 1, "2, 3"),
+            (self.program.index("X:"), 1, "Foo"),
+            (self.program.index("\nx = ") + 1, 0, "y = 1\n"),
+            (self.program.index("X()"), 1, "Foo"),
+            (self.program.index("        return"), 0, "        z = 2\n"),
+        ])
+        expected = "class Foo:\n    def x(self):\n        z = 2\n        return [1, 2, 3]\n\ny = 1\nx = Foo()\n"
+        assert tm.export_as_text() == expected
+        assert len(tm.lines) == expected.count("\n") + 1
+        assert tm.get_mainparser().last_status is True
+        assert tm.version == version + 2
+        self.tree_compare(tm.get_mainparser().previous_version.parent, self.fresh_tree(expected))
+        # cursor stays at the end of the last line
+        assert tm.cursor.line == 6
+        assert tm.cursor.get_x() == len("x = Foo()")
+
+        tm.undo_snapshot()
+        tm.key_ctrl_z()
+        assert tm.export_as_text() == self.program
+        tm.key_shift_ctrl_z()
+        assert tm.export_as_text() == expected
+
+    def test_delete_lines(self):
+        tm = self.setup_treemanager()
+        start = self.program.index("    def")
+        end = self.program.index("\nx = ")
+        tm.apply_edits([(start, end - start, "    pass\n"), (len(self.program), 0, "y = x\n")])
+        expected = "class X:\n    pass\n\nx = X()\ny = x\n"
+        assert tm.export_as_text() == expected
+        assert len(tm.lines) == expected.count("\n") + 1
+        assert tm.get_mainparser().last_status is True
+        self.tree_compare(tm.get_mainparser().previous_version.parent, self.fresh_tree(expected))
+
+    def test_invalid(self):
+        tm = self.setup_treemanager()
+        version = tm.version
+        with pytest.raises(ValueError):
+            tm.apply_edits([(5, 3, "a"), (6, 0, "b")])
+        with pytest.raises(ValueError):
+            tm.apply_edits([(len(self.program), 1, "")])
+        assert tm.export_as_text() == self.program
+        assert tm.version == version
+
+    def test_languageboxes(self):
+        parser, lexer = pythonprolog.load()
+        tm = TreeManager()
+        tm.add_parser(parser, lexer, pythonprolog.name)
+        for c in "x = ":
+            tm.key_normal(c)
+        tm.add_languagebox(lang_dict["Prolog"])
+        for c in "a.":
+            tm.key_normal(c)
+        assert tm.export_as_text() == "x = a."
+        version = tm.version
+        tm.apply_edits([(0, 1, "y"), (4, 1, "b")])
+        assert tm.export_as_text() == "y = b."
+        assert tm.version == version + 2
+        assert tm.parsers[0][0].last_status is True
+        assert tm.parsers[1][0].last_status is True
+        with pytest.raises(ValueError):
+            tm.apply_edits([(2, 3, "")])
+
+    def test_languageboxes_stats(self):
+        parser, lexer = pythonprolog.load()
+        tm = TreeManager()
+        tm.add_parser(parser, lexer, pythonprolog.name)
+        for c in "x = ":
+            tm.key_normal(c)
+        tm.add_languagebox(lang_dict["Prolog"])
+        for c in "a.":
+            tm.key_normal(c)
+        tm.apply_edits([(0, 1, "y"), (4, 1, "b")])
+        # the statistics of both language boxes' parses are kept
+        stats = tm.get_parse_stats()
+        python_stats = tm.parsers[0][0].stats
+        prolog_stats = tm.parsers[1][0].stats
+        assert prolog_stats.shifts > 0
+        assert stats.shifts == python_stats.shifts + prolog_stats.shifts
+        assert stats.iterations == python_stats.iterations + prolog_stats.iterations
+        assert stats.times["parse"] == python_stats.times["parse"] + prolog_stats.times["parse"]
+
+class Test_BackgroundParse(PythonProgram, Test_Python):
+
+    def snapshot(self, root):
+        attrs = ["parent", "children", "left", "right", "next_term", "prev_term",
+                 "deleted", "changed", "nested_changes", "textlen", "position",
+                 "isolated", "state", "exists"]
+        nodes = {}
+        todo = [root]
+        while todo:
+            node = todo.pop()
+            nodes[node] = [getattr(node, a) for a in attrs]
+            todo.extend(node.children)
+        return nodes
+
+    def cancel_after(self, parser, shifts):
+        count = [0]
+        shift = parser.shift
+        def cancelling_shift(la, state=None, rb=False):
+            count[0] += 1
+            if count[0] == shifts:
+                parser.cancelled = True
+            return shift(la, state, rb)
+        parser.shift = cancelling_shift
+
+    def test_background(self):
+        tm = self.setup_treemanager(background_parse=True)
+        version = tm.version
+        tm.apply_edits([(self.program.index("2]"), 1, "2, 3")])
+        assert tm.parse_job is not None
+        assert not tm.parse_finished()
+        assert not tm.parse_running()
+        done = []
+        tm.start_parse(lambda: done.append(True))
+        assert tm.parse_running()
+        tm.parse_job.thread.join()
+        assert done == [True]
+        assert tm.parse_finished()
+        assert tm.parse_running()
+        assert tm.publish_parse() is True
+        assert tm.parse_job is None
+        assert not tm.parse_running()
+        assert tm.version == version + 2
+        expected = self.program.replace("2]", "2, 3]")
+        assert tm.get_mainparser().last_status is True
+        self.tree_compare(tm.get_mainparser().previous_version.parent, self.fresh_tree(expected))
+
+    def test_cancel(self):
+        tm = self.setup_treemanager(background_parse=True)
+        parser = tm.get_mainparser()
+        root = parser.previous_version.parent
+        tm.apply_edits([(self.program.index("X:"), 1, "Foo")])
+        before = self.snapshot(root)
+        self.cancel_after(parser, 3)
+        tm.start_parse()
+        tm.parse_job.thread.join()
+        del parser.shift
+        assert tm.cancel_parse() is False
+        assert self.snapshot(root) == before
+        # the parse is restarted from the same version
+        assert tm.parse_job.thread is None
+        tm.apply_edits([(tm.export_as_text().index("X()"), 1, "Foo")])
+        tm.finish_parse()
+        assert tm.parse_job is None and tm.unparsed_roots == []
+        expected = self.program.replace("X", "Foo")
+        assert tm.export_as_text() == expected
+        assert parser.last_status is True
+        self.tree_compare(root, self.fresh_tree(expected))
+
+        tm.undo_snapshot()
+        tm.key_ctrl_z()
+        assert tm.export_as_text() == self.program
+        assert parser.last_status is True
+        self.tree_compare(root, self.fresh_tree(self.program))
+
+    def test_cancel_error(self):
+        # Parses that have started error recovery are finished instead
+        tm = self.setup_treemanager(background_parse=True)
+        parser = tm.get_mainparser()
+        tm.apply_edits([(self.program.index("2]") + 1, 0, "+")])
+        self.cancel_after(parser, 1000)
+        tm.start_parse()
+        tm.parse_job.thread.join()
+        del parser.shift
+        assert tm.cancel_parse() is True
+        assert tm.parse_job is None
+        assert parser.last_status is False
@@ -0,0 +1,40 @@
+from grammars import grammars, bundle
+from grammars.grammars import lang_dict
+from grammars.preload import preload
+from treemanager import TreeManager
+
+names = ["Basic Calculator", "Prolog"]
+
+def forget(name):
+    for key in list(grammars._cache):
+        if key.startswith(name + "::"):
+            del grammars._cache[key]
+
+class Test_Preload:
+
+    def test_preload(self, tmpdir, monkeypatch):
+        # make sure nothing is loaded from a grammar bundle
+        monkeypatch.setenv("ECO_GRAMMAR_BUNDLE", str(tmpdir.join("none.bundle")))
+        monkeypatch.setattr(bundle, "_bundle", None)
+        langs = [lang_dict[name] for name in names]
+        for name in names:
+            forget(name)
+        loaded = []
+        preload(langs, jobs=2, progress=lambda lang, error: loaded.append((lang.name, error)))
+        assert sorted(loaded) == [(name, None) for name in names]
+        assert all(lang.is_cached() for lang in langs)
+
+        parser, lexer = lang_dict["Basic Calculator"].load()
+        treemanager = TreeManager()
+        treemanager.add_parser(parser, lexer, "Basic Calculator")
+        treemanager.import_file("1+2*3")
+        assert parser.last_status == True
+
+    def test_failed(self, monkeypatch):
+        lang = lang_dict["Prolog"]
+        forget(lang.name)
+        monkeypatch.setattr(lang, "filename", "missing.eco")
+        loaded = []
+        preload([lang], progress=lambda lang, error: loaded.append(error))
+        assert isinstance(loaded[0], IOError)
+        assert not lang.is_cached()
@@ -0,0 +1,45 @@
+import pytest
+
+from grammars.grammars import LanguageRegistry, LanguageList, EcoFile
+
+class Test_LanguageRegistry:
+
+    def test_lazy(self):
+        registry = LanguageRegistry()
+        assert registry.index is None
+        assert "Python + PHP" in registry
+        assert "Unknown" not in registry
+        assert dict.__len__(registry) == 0
+        lang = registry["Python + PHP"]
+        assert isinstance(lang, EcoFile)
+        assert lang.included_langs == {"PHP + Python"}
+        # compositions are resolved without creating the composed languages
+        assert dict.keys(registry) == {"Python + PHP"}
+        assert registry["Python + PHP"] is lang
+        with pytest.raises(KeyError):
+            registry["Unknown"]
+        assert registry.get("Unknown") is None
+
+    def test_lists(self):
+        registry = LanguageRegistry()
+        newfile = LanguageList(registry, registry.new)
+        names = [lang.name for lang in newfile]
+        assert "Python 2.7.5" in names
+        assert "Python expression" not in names
+        assert len(LanguageList(registry)) == len(registry)
+        assert len(newfile + []) == len(newfile)
+
+    def test_config(self):
+        registry = LanguageRegistry()
+        cfg = {"name": "Calc + Missing", "file": "grammars/basiccalc.eco", "base": "Calc",
+               "visibility": ["submenu"],
+               "compositions": [{"name": "Missing", "location": "factor"}]}
+        registry.build_index()
+        registry.index_config(cfg, "test.json")
+        assert "Calc + Missing" in registry
+        with pytest.raises(ValueError):
+            registry["Calc + Missing"]
+        # identical definitions are only registered once
+        registry.index_config(dict(cfg), "test.json")
+        with pytest.raises(ValueError):
+            registry.index_config(dict(cfg, base="Other"), "test.json")
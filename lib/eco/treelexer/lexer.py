@@ -1,3 +1,5 @@
+from bisect import bisect_right
+
 class RE_OR(object):
     def __init__(self, lhs, rhs):
         self.lhs = lhs
@@ -34,11 +36,226 @@ class RE_RANGE(RE_DEFAULT):
     def __init__(self, c, neg=False):
         RE_DEFAULT.__init__(self, c)
         self.neg = neg
+        # compiled once so that matching a character is a single lookup
+        self.cls = CharClass.from_codes(c, neg)
 
     def __repr__(self):
         return "%s(%s, %s)" % (self.__class__.__name__, self.c, self.neg)
 
+# Code of language boxes and indentation tokens in the automaton, which are
+# only matched by "." and negated ranges
+BOX = -1
+MAXCHAR = 0x10FFFF
+
+class CharClass(object):
+    """Set of characters stored as a table of sorted, disjoint ranges. Small
+    sets are also kept as a frozenset of character codes."""
+
+    # Maximum number of characters kept in a frozenset
+    SMALL = 64
+
+    def __init__(self, ranges, box=False):
+        self.starts = [lo for lo, hi in ranges]
+        self.ends = [hi for lo, hi in ranges]
+        self.box = box
+        self.codes = None
+        if sum(hi - lo + 1 for lo, hi in ranges) <= CharClass.SMALL:
+            self.codes = frozenset(c for lo, hi in ranges for c in range(lo, hi + 1))
+
+    @staticmethod
+    def from_codes(codes, neg=False):
+        """Return the characters of a (negated) range of character codes."""
+        ranges = []
+        for c in sorted(set(codes)):
+            if ranges and ranges[-1][1] + 1 == c:
+                ranges[-1][1] = c
+            else:
+                ranges.append([c, c])
+        if not neg:
+            return CharClass(ranges)
+        negated = []
+        lo = 0
+        for a, b in ranges:
+            if a > lo:
+                negated.append((lo, a - 1))
+            lo = b + 1
+        if lo <= MAXCHAR:
+            negated.append((lo, MAXCHAR))
+        return CharClass(negated, True)
+
+    @staticmethod
+    def from_pattern(pattern):
+        """Return the characters matched by a RE_CHAR or RE_RANGE."""
+        if type(pattern) is RE_RANGE:
+            return pattern.cls
+        c = pattern.c
+        if c == ".":
+            return CharClass([(0, MAXCHAR)], True)
+        if len(c) == 2 and c[0] == "\\":
+            c = c[1]
+        if len(c) != 1:
+            return CharClass([])
+        return CharClass([(ord(c), ord(c))])
+
+    def __contains__(self, code):
+        if code == BOX:
+            return self.box
+        if self.codes is not None:
+            return code in self.codes
+        i = bisect_right(self.starts, code) - 1
+        return i >= 0 and code <= self.ends[i]
+
+class DFAState(object):
+    __slots__ = ["positions", "accept", "finals", "tests", "transitions"]
+
+    def __init__(self, positions, accept, finals, tests):
+        self.positions = positions
+        self.accept = accept            # rule accepted in this state (or None)
+        self.finals = finals            # sorted rules accepted in this state
+        self.tests = tests              # sorted rules that read another char
+        self.transitions = {}           # char code -> DFAState (or None)
+
+class DFA(object):
+    """Deterministic automaton recognising several patterns at once.
+
+    The patterns are turned into a position automaton (every character class
+    in a pattern is a position, which is followed by the positions that may
+    match the next character). Its states are sets of positions, which are
+    created by subset construction when the lexer first reaches them. Every
+    state knows the patterns it accepts (the first accepted pattern wins) and
+    the patterns that still read another character, which is needed to
+    calculate the lookahead of tokens.
+
+    Only patterns for which `supports` is true can be used, as the pattern
+    matchers don't find the longest match of other patterns (e.g. a `|` is
+    committed to as soon as its left side matches)."""
+
+    def __init__(self, patterns):
+        """`patterns` is a list of (rule, pattern) pairs, where the rule is
+        used to identify (and prioritise) the pattern in results."""
+        self.classes = []   # character class of each position
+        self.follow = []    # positions following each position
+        self.rule = []      # rule of each position
+        self.last = set()   # positions that complete a match
+        start = []
+        for rule, pattern in patterns:
+            _, first, last = self.add(pattern, rule)
+            # pseudo position that is followed by the start of the pattern
+            p = self.new_position(None, rule)
+            self.follow[p].update(first)
+            self.last.update(last)
+            start.append(p)
+        self.follow = [tuple(sorted(f)) for f in self.follow]
+        self.start_positions = frozenset(start)
+        self.reset()
+
+    @staticmethod
+    def supports(pattern):
+        t = type(pattern)
+        if t is RE_CHAR or t is RE_RANGE:
+            return True
+        if t is list:
+            return len(pattern) > 0 and all(DFA.supports_nested(p) if type(p) is list else DFA.supports(p) for p in pattern)
+        if t is RE_STAR or t is RE_PLUS:
+            # Repetitions of groups aren't undone if the group only partly
+            # matches, and non-greedy repetitions end at the shortest match
+            return not pattern.ng and type(pattern.c) in (RE_CHAR, RE_RANGE)
+        return False
+
+    @staticmethod
+    def supports_nested(pattern):
+        # Repetitions at the end of groups don't give back any characters
+        return len(pattern) > 0 and all(DFA.supports_nested(p) if type(p) is list else type(p) in (RE_CHAR, RE_RANGE) for p in pattern)
+
+    def new_position(self, cls, rule):
+        self.classes.append(cls)
+        self.follow.append(set())
+        self.rule.append(rule)
+        return len(self.classes) - 1
+
+    def add(self, pattern, rule):
+        """Add the positions of a pattern and return whether it is nullable
+        and its first and last positions."""
+        t = type(pattern)
+        if t is RE_CHAR or t is RE_RANGE:
+            p = self.new_position(CharClass.from_pattern(pattern), rule)
+            return False, {p}, {p}
+        if t is list:
+            nullable, first, last = True, set(), set()
+            for p in pattern:
+                n, f, l = self.add(p, rule)
+                for q in last:
+                    self.follow[q].update(f)
+                if nullable:
+                    first |= f
+                last = last | l if n else l
+                nullable = nullable and n
+            return nullable, first, last
+        if t is RE_STAR or t is RE_PLUS:
+            n, first, last = self.add(pattern.c, rule)
+            for q in last:
+                self.follow[q].update(first)
+            return n or t is RE_STAR, first, last
+        raise ValueError("Pattern can't be matched by the automaton: %r" % (pattern,))
+
+    def reset(self):
+        self.states = {}
+        self.start = self.state(self.start_positions)
+
+    def state(self, positions):
+        try:
+            return self.states[positions]
+        except KeyError:
+            pass
+        finals = sorted(set(self.rule[p] for p in positions if p in self.last))
+        tests = sorted(set(self.rule[p] for p in positions if self.follow[p]))
+        state = DFAState(positions, finals[0] if finals else None, finals, tests)
+        self.states[positions] = state
+        return state
+
+    def next(self, state, code):
+        """Return the state following `state` on the character `code` (or
+        None)."""
+        try:
+            return state.transitions[code]
+        except KeyError:
+            pass
+        positions = set()
+        classes = self.classes
+        for p in state.positions:
+            for q in self.follow[p]:
+                if code in classes[q]:
+                    positions.add(q)
+        result = self.state(frozenset(positions)) if positions else None
+        state.transitions[code] = result
+        return result
+
+    def lookahead(self, path, lo, hi):
+        """Return the number of characters read by the patterns with rules in
+        (`lo`, `hi`] along a path of states."""
+        for i in range(len(path) - 1, -1, -1):
+            tests = path[i].tests
+            j = bisect_right(tests, lo)
+            if j < len(tests) and tests[j] <= hi:
+                return i + 1
+        return 0
+
+    def __getstate__(self):
+        # States are cheap to recreate and may form long chains
+        state = self.__dict__.copy()
+        del state["states"]
+        del state["start"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reset()
+
 class PatternMatcher(object):
+    """Matches a pattern against a string in place: the token is the text
+    between the position the match started at and the end of the last
+    character that was matched, so neither the input nor the token is
+    copied until the match is complete."""
 
     def __init__(self):
         self.pos = 0
@@ -52,11 +269,11 @@ class PatternMatcher(object):
         return self.text[self.pos]
 
     def append(self):
-        self.result.append(self.char())
+        self.end = self.pos + 1
 
     def get_token(self):
-        """Rejoins all matched characters back to a single token string"""
-        return "".join(self.result)
+        """Returns the matched characters as a single token string"""
+        return self.text[self.start:self.end]
 
     def isend(self):
         return self.pos >= len(self.text)
@@ -67,11 +284,11 @@ class PatternMatcher(object):
     def load_state(self, state):
         self.pos = state[0]
         self.exactmatch = state[1]
-        self.result = state[2]
+        self.end = state[2]
         self.la = state[3]
 
     def save_state(self):
-        return (self.pos, self.exactmatch, list(self.result), self.la)
+        return (self.pos, self.exactmatch, self.end, self.la)
 
     def match_one(self, pattern):
         if self.isend():
@@ -152,8 +369,7 @@ class PatternMatcher(object):
     def match_range(self, pattern):
         if self.isend():
             return False
-        if (pattern.neg and ord(self.char()) not in pattern.c) \
-                    or (not pattern.neg and ord(self.char()) in pattern.c):
+        if ord(self.char()) in pattern.cls:
             return True
         self.exactmatch = False
         return False
@@ -194,8 +410,9 @@ class PatternMatcher(object):
         # reset
         self.exactmatch = True
         self.pos = pos
+        self.start = pos
+        self.end = pos
         self.text = text
-        self.result = []
         self.la = 0
         if self._inner_match(pattern):
             return self.get_token()
@@ -328,10 +545,54 @@ class TreePatternMatcher(PatternMatcher):
             self.read_nodes = [text.parent]
         else:
             self.read_nodes = [text]
+        self.result = []
         self.la = 0
         self.lookahead = 0
         return PatternMatcher.match(self, pattern, text, pos)
 
+    def match_dfa(self, dfa, text, pos=0):
+        """Match all patterns of `dfa` at once and return the longest token
+        and its rule (or None), leaving the matcher in the state after the
+        token like `match`. The states that have been passed through (see
+        DFA.lookahead) are kept in `path`."""
+        if text.ismultichild():
+            self.read_nodes = [text.parent]
+        else:
+            self.read_nodes = [text]
+        self.exactmatch = True
+        self.pos = pos
+        self.text = text
+        self.result = []
+        self.la = 0
+        state = dfa.start
+        path = self.path = []
+        best = None
+        length = -1
+        while True:
+            path.append(state)
+            rule = state.accept
+            if rule is not None and self.result and \
+                    (len(self.result) > length or (len(self.result) == length and rule <= best[0])):
+                # the longest token wins, or the first rule among equally
+                # long tokens
+                length = len(self.result)
+                best = (rule, self.save_state())
+            if not state.tests or self.isend():
+                break
+            if type(self.text.symbol) in [MagicTerminal, IndentationTerminal]:
+                code = BOX
+            else:
+                code = ord(self.char())
+            state = dfa.next(state, code)
+            if state is None:
+                break
+            self.append()
+            self.inc()
+        if best is None:
+            return None
+        self.load_state(best[1])
+        return self.get_token(), best[0]
+
 class RegexParser(object):
 
     def __init__(self):
@@ -464,12 +725,21 @@ class LexingError(Exception):
 
 class Lexer(object):
 
-    def __init__(self, rules):
+    def __init__(self, rules, automaton=True):
         rp = RegexParser()
         self.patterns = []
         for name, rule in rules:
             pattern = rp.compile(rule)
             self.patterns.append((pattern, name))
+        # Patterns are matched by a combined automaton where possible (see
+        # DFA); all others (with their index in `patterns`) one by one
+        self.dfa = None
+        self.others = list(enumerate(self.patterns))
+        if automaton:
+            supported = [(i, p) for i, (p, n) in enumerate(self.patterns) if DFA.supports(p)]
+            if supported:
+                self.dfa = DFA(supported)
+                self.others = [(i, (p, n)) for i, (p, n) in enumerate(self.patterns) if not DFA.supports(p)]
 
     def lex(self, text):
         """Lexes a given string by trying all patterns. When a match is found a
@@ -483,25 +753,42 @@ class Lexer(object):
         pm = PatternMatcher()
         self.pos = 0
         result = []
-        progress = 0
         while True:
-            lookahead = 0
             oldpos = self.pos
-            tmpresult = ("", None, None)
-            for p, n in self.patterns:
-                if pm.match(p, text[self.pos:]):
-                    lookahead = max(pm.la, lookahead)
-                    value = text[self.pos:self.pos + pm.pos]
-                    lookahead = lookahead - len(value)
-                    if len(value) > len(tmpresult[0]):
-                        tmpresult = (value, n, lookahead)
-                        progress = pm.pos
-                    lookahead = 0
-                else:
-                    lookahead = max(pm.la, lookahead)
-            if tmpresult[0]:
-                result.append(tmpresult)
-                self.pos += progress
+            # the longest token (first pattern among equally long ones), the
+            # number of characters read by each pattern that was tried, and the
+            # patterns that matched
+            best = None
+            tried = []
+            matched = []
+            path = None
+            if self.dfa:
+                path, end = self.run_dfa(text, self.pos)
+                if end > self.pos:
+                    best = (end - self.pos, path[end - self.pos].accept)
+            for i, (p, n) in self.others:
+                if pm.match(p, text, self.pos):
+                    matched.append(i)
+                    length = pm.pos - self.pos
+                    if best is None or length > best[0] or (length == best[0] and i < best[1]):
+                        best = (length, i)
+                tried.append((i, pm.la))
+            if best:
+                length, rule = best
+                # The lookahead of a token includes everything read by the
+                # patterns tried since the last pattern that matched
+                last = max([i for i in matched if i < rule], default=-1)
+                if path:
+                    for state in path[1:]:
+                        j = bisect_right(state.finals, rule - 1)
+                        if j > 0:
+                            last = max(last, state.finals[j - 1])
+                lookahead = max([la for i, la in tried if last < i <= rule], default=0)
+                if path:
+                    lookahead = max(lookahead, self.dfa.lookahead(path, last, rule))
+                value = text[self.pos:self.pos + length]
+                result.append((value, self.patterns[rule][1], lookahead - length))
+                self.pos += length
             if self.pos == oldpos:
                 # no more matches
                 if self.pos < len(text):
@@ -509,6 +796,24 @@ class Lexer(object):
                 break
         return result
 
+    def run_dfa(self, text, pos):
+        """Run the automaton on `text` from `pos` on. Returns the states passed
+        through and the end of the longest match."""
+        dfa = self.dfa
+        state = dfa.start
+        path = [state]
+        end = pos
+        i = pos
+        while state.tests and i < len(text):
+            state = dfa.next(state, ord(text[i]))
+            if state is None:
+                break
+            i += 1
+            path.append(state)
+            if state.accept is not None:
+                end = i
+        return path, end
+
     def treelex(self, node):
         pm = TreePatternMatcher()
         pos = 0
@@ -559,26 +864,43 @@ class Lexer(object):
                 else:
                     node = node.next_term
                 continue
-            for p, n in self.patterns:
+            # The lookahead of a token includes everything read by the
+            # patterns up to the one that matched
+            best = None
+            if self.dfa:
+                match = pm.match_dfa(self.dfa, node, pos)
+                if match:
+                    token, rule = match
+                    best = rule
+                    result = (token, self.patterns[rule][1], pm.scanned_chars, pm.read_nodes, self.split(pm))
+                    progress = pm.pos, pm.text
+                path = pm.path
+            tried = []
+            for i, (p, n) in self.others:
                 token = pm.match(p, node, pos)
-                lookahead = max(pm.la, lookahead)
-                if token and self.tlen(token) > self.tlen(result[0]): # find longest match
-                    if pm.pos > 0 and pm.pos != len(pm.text.symbol.name):
-                        # Record when a node only produced a partial match
-                        split = pm.pos - len(pm.text.symbol.name)
-                    else:
-                        split = 0
-                    result = (token, n, lookahead - pm.scanned_chars, pm.read_nodes, split)
+                tried.append((i, pm.la))
+                if token and (self.tlen(token) > self.tlen(result[0]) or (self.tlen(token) == self.tlen(result[0]) and i < best)): # find longest match
+                    best = i
+                    result = (token, n, pm.scanned_chars, pm.read_nodes, self.split(pm))
                     progress = pm.pos, pm.text
-                    continue
-                else:
-                    pass
+            if best is not None:
+                lookahead = max([la for i, la in tried if i <= best], default=0)
+                if self.dfa:
+                    lookahead = max(lookahead, self.dfa.lookahead(path, -1, best))
+                token, name, scanned, read, split = result
+                result = (token, name, lookahead - scanned, read, split)
             pos, node = progress
             if oldnode is node and oldpos == pos:
                 # no progress means we failed to lex something
                 raise LexingError("Failed to lex node '{}' at position {})".format(node, pos))
             yield result
 
+    def split(self, pm):
+        if pm.pos > 0 and pm.pos != len(pm.text.symbol.name):
+            # Record when a node only produced a partial match
+            return pm.pos - len(pm.text.symbol.name)
+        return 0
+
     def tlen(self, token):
         if type(token) is list:
             return sum([len(t) for t in token])
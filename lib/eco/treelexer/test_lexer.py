@@ -1,4 +1,4 @@
-from .lexer import Lexer, PatternMatcher, RegexParser, LexingError, RE_CHAR, RE_OR, RE_STAR, RE_PLUS, lbph
+from .lexer import Lexer, PatternMatcher, RegexParser, LexingError, RE_CHAR, RE_OR, RE_STAR, RE_PLUS, lbph, DFA, CharClass, BOX
 import pytest
 
 class Test_RegexParser(object):
@@ -50,6 +50,14 @@ class Test_PatternMatcher(object):
         assert PatternMatcher().match(self.cmp("aa"), "aa") == "aa"
         assert PatternMatcher().match(self.cmp("a.b"), "axb") == "axb"
 
+    def test_match_pos(self):
+        pm = PatternMatcher()
+        assert pm.match(self.cmp("[a-z]+"), "12abc34", 2) == "abc"
+        assert pm.pos == 5
+        assert pm.match(self.cmp("ab|abcd?x"), "..abcx", 2) == "ab"
+        assert pm.match(self.cmp("a*?bc"), "xaabcd", 1) == "aabc"
+        assert pm.match(self.cmp("[a-z]"), "abc", 3) is None
+
     def test_match_question(self):
         assert PatternMatcher().match(self.cmp("ab?"), "a") == "a"
         assert PatternMatcher().match(self.cmp("ab?"), "ab") == "ab"
@@ -321,6 +329,87 @@ class Test_Lexer(object):
         l = Lexer([("name", "[a-z]+")])
         assert l.treelex(a) == [("ab", "name", 0)]
 
+class Test_DFA(object):
+
+    def setup_class(cls):
+        cls.regparse = RegexParser()
+
+    def test_supports(self):
+        compile = self.regparse.compile
+        assert DFA.supports(compile("[a-z_][a-z0-9_]*"))
+        assert DFA.supports(compile("\"[^\"]*\""))
+        assert DFA.supports(compile("(ab)c"))
+        assert not DFA.supports(compile("a|b"))
+        assert not DFA.supports(compile("ab?"))
+        assert not DFA.supports(compile("(ab)*"))
+        assert not DFA.supports(compile("a*?b"))
+        with pytest.raises(ValueError):
+            DFA([(0, compile("a|b"))])
+
+    def test_charclass(self):
+        cls = CharClass.from_pattern(self.regparse.compile("[^a-c]"))
+        assert ord("a") not in cls
+        assert ord("c") not in cls
+        assert ord("d") in cls
+        assert ord("\n") in cls
+        assert BOX in cls
+        cls = CharClass.from_pattern(self.regparse.compile("[a-c]"))
+        assert ord("b") in cls
+        assert ord("d") not in cls
+        assert BOX not in cls
+        # large classes are only stored as ranges
+        cls = CharClass.from_pattern(self.regparse.compile("[a-zA-Z0-9_$@]"))
+        assert cls.codes is None
+        assert ord("_") in cls
+        assert ord("Q") in cls
+        assert ord("-") not in cls
+        assert ord("[") not in cls
+        cls = CharClass.from_pattern(self.regparse.compile("[\\]\\t]"))
+        assert ord("]") in cls
+        assert ord("\t") in cls
+        assert ord("t") not in cls
+
+    def compare(self, rules, texts):
+        l1 = Lexer(rules)
+        l2 = Lexer(rules, automaton=False)
+        assert l1.dfa is not None
+        for text in texts:
+            assert l1.lex(text) == l2.lex(text)
+
+            ast = AST()
+            ast.init()
+            ast.parent.children[0].insert_after(TextNode(Terminal(text)))
+            node = ast.parent.children[1]
+            it1 = l1.get_token_iter(node)
+            it2 = l2.get_token_iter(node)
+            while True:
+                try:
+                    t2 = next(it2)
+                except (StopIteration, LexingError) as e:
+                    with pytest.raises(type(e)):
+                        next(it1)
+                    break
+                assert next(it1) == t2
+
+    def test_keywords(self):
+        rules = [("if", "if"), ("ifdef", "ifdef"), ("name", "[a-z]+"),
+                 ("int", "[0-9]+"), ("ws", "[ ]+")]
+        self.compare(rules, ["if ifde ifdef ifdefs x1", "i", "ifd", "12ab if"])
+
+    def test_mixed(self):
+        # Patterns the automaton doesn't support are still matched one by one
+        rules = [("float", "[0-9]+\\.[0-9]+"), ("int", "[0-9]+"),
+                 ("op", "\\+|\\+="), ("opt", "ab?c"), ("name", "[a-z]+"),
+                 ("string", "\"[^\"]*\""), ("ws", "[ ]+")]
+        self.compare(rules, ["1.5 + 12 + ac abc ab", "12 +=", "1. \"ab", "\"a b\" 3.14."])
+
+    def test_pickle(self):
+        import pickle
+        l = Lexer([("name", "[a-z]+"), ("num", "[0-9]+")])
+        l.lex("abc123")
+        l = pickle.loads(pickle.dumps(l))
+        assert l.lex("abc123") == [("abc","name",1),("123","num",1)]
+
 class Test_IncrementalLexing(object):
 
     def setup_class(cls):
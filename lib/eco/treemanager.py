@@ -19,10 +19,11 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
-from incparser.incparser import IncParser
+from incparser.incparser import IncParser, ParseCancelled
 from inclexer.inclexer import IncrementalLexer
 from treelexer.lexer import LexingError
 from incparser.astree import TextNode, BOS, EOS, MultiTextNode
+from incparser.stats import ParseStats
 from grammar_parser.gparser import Terminal, MagicTerminal, IndentationTerminal, Nonterminal
 try:
     import __pypy__
@@ -41,7 +42,11 @@ from export.cpython import CPythonExporter
 
 from autolboxdetector import IncrementalRecognizer
 
-import math, os
+import math, os, sys, gc, threading
+from bisect import bisect_left, bisect_right
+
+# Number of undo snapshots between two measurements of the history size
+HISTORY_CHECK_INTERVAL = 10
 
 def debug_trace():
   '''Set a tracepoint in the Python debugger that works with Qt'''
@@ -432,6 +437,72 @@ class Cursor(object):
     def __repr__(self):
         return "Cursor(%s, %s)" % (self.node, self.pos)
 
+class ParseJob(object):
+    """Parses the language boxes changed by an edit, possibly on a separate
+    thread.
+
+    A job running on a thread can be cancelled, in which case all changes it
+    has made to the tree are reverted. This isn't possible anymore once one of
+    its parsers has started error recovery, so such a job is always run to
+    the end."""
+
+    def __init__(self, parsers, roots, skipautolbox=False):
+        self.parsers = parsers
+        self.roots = roots
+        self.skipautolbox = skipautolbox
+        self.thread = None
+        self.callback = None
+        self.cancellable = False
+        self.cancelled = False
+        self.started = []       # parsers that have (partially) run
+        self.interrupted = False
+        self.finished = False
+        self.error = None
+
+    def run(self):
+        try:
+            for parser in self.parsers:
+                if self.cancelled and self.cancellable:
+                    self.interrupted = True
+                    break
+                self.started.append(parser)
+                parser.cancelled = self.cancelled
+                parser.touched = {} if self.cancellable else None
+                try:
+                    parser.inc_parse()
+                except ParseCancelled:
+                    self.interrupted = True
+                    break
+                if parser.touched is None:
+                    # The parse had errors, so the changes made so far can't
+                    # be reverted anymore
+                    self.cancellable = False
+        except Exception as e:
+            self.error = e
+        self.finished = True
+        if self.callback:
+            self.callback()
+
+    def start(self, callback=None):
+        self.callback = callback
+        self.cancellable = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel(self):
+        """Stop the parse and revert its changes. Returns False if that wasn't
+        possible, in which case the parse has been run to the end."""
+        self.cancelled = True
+        for parser in self.parsers:
+            parser.cancelled = True
+        self.thread.join()
+        if not (self.interrupted and self.cancellable) or self.error is not None:
+            return False
+        for parser in reversed(self.started):
+            parser.rollback()
+        return True
+
 class TreeManager(object):
     version = 1
 
@@ -449,9 +520,29 @@ class TreeManager(object):
         self.savenextparse = False
         self.saved_lines = {}
         self.saved_parsers = {}
+        self.saved_nodes = {}       # version -> nodes saved in that version
+        self.parse_stats = {}       # version -> stats of the parse creating it
         self.undo_snapshots = []
         self.min_version = 1
 
+        # Bound the undo history either by the number of undo snapshots or by
+        # the approximate size of the history in bytes (None = unbounded)
+        self.option_history_limit = None
+        self.option_history_size = None
+        self.history_checked = 0
+
+        # Apply single character edits to the tree right away, but only relex
+        # and reparse them when flush_edits is called, creating one version
+        # for all of them
+        self.option_coalesce_edits = False
+        self.pending_edit = None    # node with edits that haven't been parsed
+
+        # Run parses on a separate thread (see ParseJob). Parses that are
+        # still running when the tree is changed again are cancelled.
+        self.option_background_parse = False
+        self.parse_job = None       # parse that hasn't been published yet
+        self.unparsed_roots = []    # roots of cancelled parses
+
         self.tool_data_is_dirty = False
         self.autolboxdetector = None
         self.option_autolbox_find = True
@@ -630,6 +721,7 @@ class TreeManager(object):
         return None
 
     def analyse(self):
+        self.finish_parse()
         # for now only do cross-scope analysing for certain grammars
         crossscope = ["PHP + Python", "Java + Python"]
         lang = self.parsers[0][2]
@@ -650,6 +742,7 @@ class TreeManager(object):
                     p[3].analyse(p[0].previous_version.parent)
 
     def getCompletion(self):
+        self.finish_parse()
         for p in self.parsers:
             if p[3]:
                 return p[3].get_completion(self.cursor.node)
@@ -872,6 +965,7 @@ class TreeManager(object):
 
     def key_shift_ctrl_z(self):
         self.log_input("key_shift_ctrl_z")
+        self.finish_parse()
         try:
             i = self.undo_snapshots.index(self.version)
             if i == len(self.undo_snapshots) - 1:
@@ -884,15 +978,24 @@ class TreeManager(object):
             self.recover_version("redo", self.version - 1)
             self.cursor.load(self.version, self.lines)
 
+    def get_parse_stats(self, version=None):
+        """Return the statistics (see incparser.stats.ParseStats) of the parse
+        that created `version` (default: the current version), or None if that
+        version wasn't created by a parse. If the parse changed several
+        language boxes, the statistics of their parsers are added up."""
+        if version is None:
+            version = self.version
+        return self.parse_stats.get(version)
+
     def get_max_version(self):
         root = self.get_bos().parent
-        maxversion = 0
-        for (key, version) in list(root.log.keys()):
-            maxversion = max(maxversion, version)
-        return maxversion
+        if not root.versions:
+            return 0
+        return root.versions[-1]
 
     def key_ctrl_z(self):
         self.log_input("key_ctrl_z")
+        self.finish_parse()
         if len(self.undo_snapshots) == 0 and self.get_max_version() > 1:
             self.undo_snapshots.append(self.version)
         if not self.undo_snapshots or self.version == self.min_version:
@@ -920,40 +1023,30 @@ class TreeManager(object):
         for l in self.parsers:
             parser = l[0]
             parser.load_status(self.version)
-            root = parser.previous_version.parent
-            if direction == "undo":
-                self.undo(root)
-            elif direction == "redo":
-                self.redo(root, _from)
-
-    def undo(self, node):
-        if not node.log:
-            # Node was never integrated during parsing and thus hasn't been
-            # saved. Continue with its children. This could be also solved by
-            # having nodes version themselves as soon as their attributes
-            # changes. Requires rethinking the versioning system.
-            for c in node.children:
-                self.undo(c)
-            return
-        if node.version <= self.version and not node.has_unsaved_changes():
-            # node is already at this or an even earlier version and has no
-            # unsaved changes
-            return
-        for c in node.children:
-            self.undo(c)
-        if not node.is_new(node.version):
-            if node.autobox and len(node.autobox) == 1:
-                # block this node for autolboxes in the future
-                node.autobox = False
+        if direction == "undo":
+            self.undo(_from)
+        elif direction == "redo":
+            self.redo()
+
+    def undo(self, _from):
+        """Revert all nodes that were saved in version `_from` to the current
+        version. Nodes that weren't saved in `_from` are already at the
+        current version or earlier."""
+        for node in self.saved_nodes.get(_from, []):
+            if node.version <= self.version and not node.has_unsaved_changes():
+                # node is already at this or an even earlier version and has
+                # no unsaved changes
+                continue
+            if not node.is_new(node.version):
+                if node.autobox and len(node.autobox) == 1:
+                    # block this node for autolboxes in the future
+                    node.autobox = False
+                node.load(self.version)
+
+    def redo(self):
+        """Restore all nodes that were saved in the current version."""
+        for node in self.saved_nodes.get(self.version, []):
             node.load(self.version)
-            for c in node.children:
-                self.undo(c)
-
-    def redo(self, node, _from):
-        node.load(self.version)
-        if node.version > _from:
-            for c in node.children:
-                self.redo(c, _from)
 
     def pop_lookahead(self, la):
         while(la.right_sibling() is None):
@@ -974,27 +1067,13 @@ class TreeManager(object):
                 self.undo_snapshots = self.undo_snapshots[:i]
                 break
 
-        for l in self.parsers:
-            p = l[0]
-            root = p.previous_version.parent
-            bos = root.children[0]
-            self.delete_versions_from(bos, version)
-            self.delete_versions_from(root, version)
-            node = self.pop_lookahead(root.children[0])
-            while True:
-                if isinstance(node, EOS):
-                    break
-                self.delete_versions_from(node, version)
-                if len(node.children) > 0:
-                    node = node.children[0]
-                    continue
-                else:
-                    node = self.pop_lookahead(node)
-
-    def delete_versions_from(self, node, version):
-        for (key, v) in list(node.log.keys()):
+        for v in list(self.saved_nodes):
+            if v > version:
+                for node in self.saved_nodes.pop(v):
+                    node.delete_versions_from(version)
+        for v in list(self.parse_stats):
             if v > version:
-                del node.log[(key, v)]
+                del self.parse_stats[v]
 
     def save_lines(self):
         # check if lines have changed
@@ -1044,6 +1123,7 @@ class TreeManager(object):
         self.save_lines()
         self.save_parsers()
         self.cursor.save(self.version)
+        saved = self.saved_nodes.setdefault(self.version, [])
         for l in self.parsers:
             parser = l[0]
             parser.save_status(self.version)
@@ -1053,17 +1133,19 @@ class TreeManager(object):
             bos.save(self.version)
             eos = root.children[-1]
             eos.save(self.version)
-            self.save_and_textlen_rec(root, postparse)
+            saved.extend([root, bos, eos])
+            self.save_and_textlen_rec(root, postparse, saved)
 
-    def save_and_textlen_rec(self, node, postparse):
+    def save_and_textlen_rec(self, node, postparse, saved):
         if node.has_changes() or node.new:
             if postparse:
                 node.changed = False
                 node.nested_changes = False
             for c in node.children:
-                self.save_and_textlen_rec(c, postparse)
+                self.save_and_textlen_rec(c, postparse, saved)
             node.calc_textlength()
             node.save(self.version)
+            saved.append(node)
             # Make sure that all nodes are always marked as non-existent before
             # a new parse. This way only parsed subtrees are marked as exists,
             # and we avoid retaining not yet parsed subtrees. However, not yet
@@ -1074,6 +1156,7 @@ class TreeManager(object):
 
     def key_home(self, shift=False):
         self.log_input("key_home", str(shift))
+        self.flush_edits()
         self.unselect()
         lbox = self.get_languagebox(self.cursor.node)
         self.cursor.home()
@@ -1083,6 +1166,7 @@ class TreeManager(object):
 
     def key_end(self, shift=False):
         self.log_input("key_end", str(shift))
+        self.flush_edits()
         self.unselect()
         lbox = self.get_languagebox(self.cursor.node)
         self.cursor.end()
@@ -1092,6 +1176,10 @@ class TreeManager(object):
 
     def key_normal(self, text):
         self.log_input("key_normal", repr(str(text)))
+        self.cancel_parse()
+        if self.defer_insert(text):
+            return 0
+        self.flush_edits()
         indentation = 0
         self.tool_data_is_dirty = True
 
@@ -1190,6 +1278,10 @@ class TreeManager(object):
 
     def key_delete(self):
         self.log_input("key_delete")
+        self.cancel_parse()
+        if self.defer_delete():
+            return
+        self.flush_edits()
         self.tool_data_is_dirty = True
         node = self.get_node_from_cursor()
 
@@ -1246,6 +1338,57 @@ class TreeManager(object):
         self.reparse(repairnode, need_reparse)
         self.changed = True
 
+    def can_defer_edit(self):
+        """Checks if an edit at the cursor only changes the text of a normal
+        token and can thus be relexed and reparsed later (see
+        option_coalesce_edits)."""
+        if not self.option_coalesce_edits or self.hasSelection():
+            return False
+        node = self.get_node_from_cursor()
+        if self.pending_edit is not None and node is not self.pending_edit:
+            return False
+        if type(node.symbol) is not Terminal or isinstance(node, BOS):
+            return False
+        if node.symbol.name == "\r" or (node.image and not node.plain_mode):
+            return False
+        return True
+
+    def defer_insert(self, text):
+        if "\r" in text or "\n" in text or not self.can_defer_edit():
+            return False
+        node = self.get_node_from_cursor()
+        node.insert(text, self.cursor.pos)
+        self.cursor.pos += len(text)
+        self.pending_edit = node
+        self.tool_data_is_dirty = True
+        self.changed = True
+        return True
+
+    def defer_delete(self):
+        # Deleting the last character of a node removes the node
+        if not self.cursor.inside() or not self.can_defer_edit():
+            return False
+        node = self.get_node_from_cursor()
+        self.last_delchar = node.backspace(self.cursor.pos)
+        self.pending_edit = node
+        self.tool_data_is_dirty = True
+        self.changed = True
+        return True
+
+    def flush_edits(self):
+        """Relex and reparse all deferred edits at once. Returns True if there
+        were any."""
+        self.cancel_parse()
+        node = self.pending_edit
+        if node is None:
+            return False
+        self.pending_edit = None
+        need_reparse = self.relex(node)
+        need_reparse |= self.post_keypress("")
+        self.cursor.restore_last_x()
+        self.reparse(node, need_reparse)
+        return True
+
     def start_new_selection(self):
         self.selection_start = self.cursor.copy()
 
@@ -1260,6 +1403,7 @@ class TreeManager(object):
 
     def key_cursors(self, key, shift=False):
         self.log_input("key_cursors", arrow_keys[key.key], str(shift))
+        self.flush_edits()
         self.edit_rightnode = False
 
         # Four possible cases:
@@ -1315,6 +1459,7 @@ class TreeManager(object):
 
     def ctrl_cursor(self, key, shift=False):
         self.log_input("key_escape", arrow_keys[key.key])
+        self.flush_edits()
 
         if shift and not self.hasSelection():
             self.start_new_selection()
@@ -1328,6 +1473,7 @@ class TreeManager(object):
             self.selection_end = self.cursor.copy()
 
     def doubleclick_select(self):
+        self.flush_edits()
         self.selection_start = self.cursor.copy()
         self.selection_start.node = self.cursor.find_previous_visible(self.cursor.node)
         self.selection_start.pos = len(self.selection_start.node.symbol.name)
@@ -1337,6 +1483,7 @@ class TreeManager(object):
         self.cursor.node = self.selection_end.node
 
     def select_all(self):
+        self.flush_edits()
         self.selection_start = Cursor(self.get_bos(), -1, 0, self.lines)
         self.cursor.node = self.get_eos()
         self.cursor.jump_left() # for now ignore invisible nodes
@@ -1378,6 +1525,7 @@ class TreeManager(object):
             # coming from apply_inputlog
             language = lang_dict[language]
         self.log_input("add_languagebox", repr(language.name))
+        self.flush_edits()
         node = self.get_node_from_cursor()
         newnode = self.create_languagebox(language)
         root = self.cursor.node.get_root()
@@ -1407,6 +1555,7 @@ class TreeManager(object):
 
     def leave_languagebox(self):
         self.log_input("leave_languagebox")
+        self.flush_edits()
         if isinstance(self.cursor.node.next_term.symbol, MagicTerminal) and self.cursor.isend():
             self.cursor.node = self.cursor.node.next_term.symbol.ast.children[0]
             self.cursor.pos = 0
@@ -1433,6 +1582,7 @@ class TreeManager(object):
 
     def surround_with_languagebox(self, language, auto=False):
         self.log_input("surround_with_languagebox", repr(language.name))
+        self.flush_edits()
         #XXX if partly selected node, need to split it
         nodes, _, _ = self.get_nodes_from_selection()
         self.edit_rightnode = False
@@ -1448,6 +1598,7 @@ class TreeManager(object):
         return
 
     def remove_selected_lbox(self):
+        self.flush_edits()
         root = self.cursor.node.get_root()
         if hasattr(root, "magic_backpointer"):
             lbox = root.magic_backpointer
@@ -1497,6 +1648,7 @@ class TreeManager(object):
 
     def change_languagebox(self, language):
         self.log_input("change_languagebox", repr(language.name))
+        self.flush_edits()
         node = self.cursor.node
         root = node.get_root()
         lbox = root.get_magicterminal()
@@ -1631,9 +1783,9 @@ class TreeManager(object):
 
         return changed
 
-    def repair_indentations(self):
-        node = self.cursor.node
-        root = node.get_root()
+    def repair_indentations(self, root=None):
+        if root is None:
+            root = self.cursor.node.get_root()
         im = self.get_indentmanager(root)
         changed = False
         if im:
@@ -1694,6 +1846,7 @@ class TreeManager(object):
 
     def pasteCompletion(self, text):
         self.log_input("pasteCompletion", repr(text))
+        self.cancel_parse()
         node = self.cursor.node
         if text.startswith(node.symbol.name):
             node.symbol.name = text
@@ -1703,6 +1856,7 @@ class TreeManager(object):
 
     def pasteText(self, text):
         self.log_input("pasteText", repr(str(text)))
+        self.flush_edits()
         self.tool_data_is_dirty = True
 
         if self.hasSelection():
@@ -1750,6 +1904,7 @@ class TreeManager(object):
 
     def cutSelection(self):
         self.log_input("cutSelection")
+        self.flush_edits()
         self.tool_data_is_dirty = True
         if self.hasSelection():
             text = self.copySelection()
@@ -1760,6 +1915,7 @@ class TreeManager(object):
 
     def deleteSelection(self, reparse=True):
         #XXX simple version: later we might want to modify the nodes directly
+        self.flush_edits()
         self.tool_data_is_dirty = True
         nodes, diff_start, diff_end = self.get_nodes_from_selection()
         if nodes == []:
@@ -1823,7 +1979,179 @@ class TreeManager(object):
             self.clean_empty_lbox(node)
             node.parent.remove_child(node)
 
+    def text_nodes(self):
+        """Iterate over the nodes that make up the text of the document (see
+        `export_as_text`) starting with the BOS of the main language box."""
+        node = self.get_bos()
+        yield node
+        while True:
+            node = node.next_terminal()
+            if isinstance(node.symbol, IndentationTerminal):
+                continue
+            if isinstance(node, EOS):
+                lbox = self.get_languagebox(node)
+                if lbox is None:
+                    return
+                node = lbox
+                continue
+            if isinstance(node.symbol, MagicTerminal):
+                node = node.symbol.ast.children[0]
+                continue
+            yield node
+
+    def apply_edits(self, edits):
+        """Apply multiple text changes at once. `edits` is a list of `(offset,
+        delete_len, insert_text)` tuples where all offsets refer to the text
+        before any of the changes (see `export_as_text`). Each changed region
+        is relexed once and each affected language box is parsed once,
+        resulting in a single new version (independent of the number of
+        edits). Raises ValueError if edits overlap, are out of range or delete
+        text across language box boundaries."""
+        self.log_input("apply_edits", repr(edits))
+        self.flush_edits()
+        # sort by offset, keeping the given order of insertions at the same
+        # offset
+        edits = sorted(edits, key=lambda edit: edit[0])
+
+        nodes = list(self.text_nodes())
+        starts = []
+        line_starts = [0]
+        length = 0
+        for node in nodes[1:]: # skip BOS
+            starts.append(length)
+            length += len(node.symbol.name)
+            if node.symbol.name == "\r":
+                line_starts.append(length)
+        starts.insert(0, 0)
+
+        # check all edits before changing anything
+        end = 0
+        for offset, delete_len, _ in edits:
+            if offset < end or delete_len < 0 or offset + delete_len > length:
+                raise ValueError("Invalid edit at offset %s: edits must not overlap and must be within the text" % offset)
+            end = offset + delete_len
+            if delete_len > 0:
+                i = bisect_right(starts, offset) - 1
+                j = bisect_left(starts, end) - 1
+                roots = set(id(n.get_root()) for n in nodes[max(i, 1):j+1])
+                if len(roots) > 1:
+                    raise ValueError("Invalid edit at offset %s: can't delete across language boxes" % offset)
+
+        cursor = line_starts[self.cursor.line] + self.cursor.get_x()
+        for offset, delete_len, text in edits:
+            if cursor >= offset + delete_len:
+                cursor += len(text) - delete_len
+            elif cursor > offset:
+                cursor = offset + len(text)
+
+        # Apply the edits from last to first so the offsets of the remaining
+        # edits stay valid. Remember all changed nodes (in text order) so they
+        # can be relexed afterwards.
+        changed = {}
+        removed = set()
+        for offset, delete_len, text in reversed(edits):
+            text = text.replace("\r\n", "\r").replace("\n", "\r")
+            text = text.replace("\t", "    ")
+            # node left of the edit
+            i = max(bisect_left(starts, offset) - 1, 0)
+            node = nodes[i]
+            pos = offset - starts[i]
+            end = offset + delete_len
+            j = i
+            while delete_len > 0 and j < len(nodes) and starts[j] < end:
+                n = nodes[j]
+                s = max(offset - starts[j], 0)
+                e = min(end - starts[j], len(n.symbol.name))
+                j += 1
+                if s >= e:
+                    continue
+                # replace the text within the first deleted node so it ends up
+                # in the same language box
+                n.change_text(n.symbol.name[:s] + text + n.symbol.name[e:])
+                text = ""
+                changed[n] = (j-1, 0)
+                if n.symbol.name != "":
+                    continue
+                # remove empty node and relex its neighbours instead
+                removed.add(n)
+                changed[nodes[j-2]] = (j-2, 0)
+                if j < len(nodes):
+                    changed[nodes[j]] = (j, 0)
+                lbox = n.get_root().get_magicterminal()
+                if self.clean_empty_lbox(n):
+                    prev = lbox.prev_term
+                    while isinstance(prev.symbol, IndentationTerminal):
+                        prev = prev.prev_term
+                    changed[prev] = (j-2, 0)
+                else:
+                    n.parent.remove_child(n)
+                if n.ismultichild():
+                    n.parent.update_children()
+            if text == "":
+                continue
+            if 0 < pos < len(node.symbol.name):
+                node.insert(text, pos)
+            elif isinstance(node, BOS) or node.symbol.name == "\r":
+                # same as key_normal: insert new node after the indentation
+                old = node.next_term
+                while isinstance(old.symbol, IndentationTerminal):
+                    old = old.next_term
+                old = old.prev_term
+                node = TextNode(Terminal(text))
+                old.insert_after(node)
+            else:
+                node.insert(text, pos)
+            changed[node] = (i, 1)
+
+        # relex
+        roots = []
+        relexed = set()
+        for node in sorted(changed, key=changed.get):
+            if node in removed or node.deleted or node in relexed:
+                continue
+            root = node.get_root()
+            lexer = self.get_lexer(root)
+            if lexer is None:
+                continue # language box has been removed
+            if root not in roots:
+                roots.append(root)
+            if isinstance(node, BOS) or isinstance(node.symbol, MagicTerminal):
+                continue
+            try:
+                lexer.relex(node)
+            except LexingError:
+                pass
+            relexed.update(lexer.relexed)
+        if not roots:
+            return
+
+        # update lines and move the cursor to its new position
+        old_lines = dict((id(line.node), line) for line in self.lines)
+        lines = []
+        y = x = length = 0
+        for node in self.text_nodes():
+            if isinstance(node, BOS) or node.symbol.name == "\r":
+                lines.append(old_lines.get(id(node)) or Line(node))
+            if length < cursor:
+                length += len(node.symbol.name)
+                if node.symbol.name == "\r":
+                    y = len(lines) - 1
+                    x = 0
+                else:
+                    x += len(node.symbol.name) - max(length - cursor, 0)
+        self.lines[:] = lines
+
+        for root in roots:
+            self.repair_indentations(root)
+        self.cursor.line = y
+        self.cursor.move_to_x(x)
+        self.unselect()
+        self.reparse(None, roots=roots)
+        self.tool_data_is_dirty = True
+        self.changed = True
+
     def cursor_movement(self, key):
+        self.flush_edits()
         if key.up:
             self.cursor.up()
         elif key.down:
@@ -1834,6 +2162,7 @@ class TreeManager(object):
             self.cursor.right()
 
     def cursor_reset(self):
+        self.flush_edits()
         self.cursor.line = 0
         self.cursor.move_to_x(0)
 
@@ -1893,12 +2222,32 @@ class TreeManager(object):
 
     def import_file(self, text):
         self.log_input("import_file", repr(text))
+        self.cancel_parse()
+        self.pending_edit = None
+        self.unparsed_roots = []
         self.version = self.global_version = 0
         text = text.replace("\r\n","\r")
         text = text.replace("\n","\r")
         text = text.replace("\t","    ")
+        # Building the tree allocates a lot of objects that stay alive. This
+        # makes Python's garbage collector repeatedly scan the growing tree,
+        # so pause it until the import is done.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self.import_tokens(text)
+            self.publish_parse()
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self.changed = True
+        self.undo_snapshots = [self.version]
+        self.min_version = self.version
+        return
+
+    def import_tokens(self, text):
+        """Lex `text` into the main language box and parse it."""
         parser = self.parsers[0][0]
-        lexer = self.parsers[0][1]
         # lex text into tokens
         bos = parser.previous_version.parent.children[0]
         new = TextNode(Terminal(text))
@@ -1909,13 +2258,20 @@ class TreeManager(object):
         im = self.parsers[0][4]
         if im:
             im.repair_full()
-        self.reparse(bos)
-        self.undo_snapshot()
-        self.changed = True
-        self.reparse(bos)
-        self.undo_snapshots = [self.version]
-        self.min_version = self.version
-        return
+        if parser.bulk_parse():
+            # Fast path for syntactically correct files: build the tree in one
+            # go and save it as the base version
+            self.save_current_version(postparse=True)
+            # Saving marks all nodes as non-existent. Restore the state after
+            # an incremental parse that reused the entire tree.
+            parser.previous_version.parent.children[1].exists = True
+            self.parse_stats[self.version] = parser.stats
+            self.previous_version = parser.prev_version = self.version
+            self.reference_version = parser.reference_version = self.version
+        else:
+            self.reparse(bos)
+            self.undo_snapshot()
+            self.reparse(bos)
 
     def fast_export(self, language_boxes, path, source=None):
         # fix languagebox pointers
@@ -1977,6 +2333,7 @@ class TreeManager(object):
             return
 
     def export(self, path=None, run=False, profile=False, source=None, debug=False):
+        self.finish_parse()
         for p, _, _, _, _ in self.parsers:
             if p.last_status == False:
                 print("Cannot export a syntactically incorrect grammar")
@@ -2138,38 +2495,140 @@ class TreeManager(object):
         lexer = self.get_lexer(root)
         return lexer.relex(node)
 
-    def reparse(self, node, changed=True, skipautolbox=False):
+    def reparse(self, node, changed=True, skipautolbox=False, roots=None):
+        """Parse the language box containing `node` (or all language boxes in
+        `roots`) and save the result as a new version. With
+        option_background_parse the parse is only prepared here and has to be
+        run with start_parse or finish_parse."""
+        self.cancel_parse()
+        if self.unparsed_roots:
+            # language boxes whose parse has been cancelled
+            changed = True
+            if roots is None:
+                roots = [node.get_root()]
+            roots = roots + [r for r in self.unparsed_roots if r not in roots]
+            self.unparsed_roots = []
         if self.version < self.global_version:
             # we changed stuff after one or more undos
             # later versions are void -> delete
-            for l in self.parsers:
-                root = l[0].previous_version.parent
-                for v in reversed(list(range(self.version+1, self.global_version+1))):
-                    self.delete_version(v, root)
-                    try:
-                        self.undo_snapshots.remove(v)
-                    except ValueError:
-                        pass
+            for v in reversed(list(range(self.version+1, self.global_version+1))):
+                for n in self.saved_nodes.pop(v, []):
+                    n.delete_version(v)
+                self.parse_stats.pop(v, None)
+                try:
+                    self.undo_snapshots.remove(v)
+                except ValueError:
+                    pass
             self.global_version = self.version
         if changed:
             self.save_current_version() # save current changes
-            root = node.get_root()
-            parser = self.get_parser(root)
+            if roots is None:
+                roots = [node.get_root()]
             self.previous_version = self.version
-            parser.prev_version = self.version
-            parser.reference_version = self.reference_version
-            parser.option_autolbox_find = self.option_autolbox_find
-            parser.inc_parse()
+            parsers = []
+            for root in roots:
+                parser = self.get_parser(root)
+                parser.prev_version = self.version
+                parser.reference_version = self.reference_version
+                parser.option_autolbox_find = self.option_autolbox_find
+                parsers.append(parser)
+            self.parse_job = ParseJob(parsers, roots, skipautolbox)
+            if self.option_background_parse:
+                return
+            self.publish_parse()
+            return
+        # save changes without reparse (e.g. when a value has changed but
+        # the type remains the same)
+        self.save_current_version(postparse=True)
+        TreeManager.version = self.version
+        self.update_autolboxes(skipautolbox)
+
+    def publish_parse(self):
+        """Finish the scheduled parse (running it if it hasn't been started
+        yet) and save the resulting tree as a new version. Returns False if
+        there is no scheduled parse."""
+        job = self.parse_job
+        if job is None:
+            return False
+        self.parse_job = None
+        if job.thread is None:
+            job.run()
+        else:
+            job.thread.join()
+        if job.error is not None:
+            raise job.error
+        status = True
+        for parser in job.parsers:
+            parser.touched = None
             parser.top_down_reuse()
-            self.save_current_version(postparse=True) # save post parse tree
-            if parser.last_status == True:
-                self.reference_version = self.version
+            status = status and parser.last_status == True
+        self.save_current_version(postparse=True) # save post parse tree
+        if len(job.parsers) == 1:
+            stats = parser.stats
         else:
-            # save changes without reparse (e.g. when a value has changed but
-            # the type remains the same)
-            self.save_current_version(postparse=True)
+            # the edits changed several language boxes
+            stats = ParseStats()
+            for parser in job.parsers:
+                stats.merge(parser.stats)
+        self.parse_stats[self.version] = stats
+        if status:
+            self.reference_version = self.version
         TreeManager.version = self.version
+        self.update_autolboxes(job.skipautolbox)
+        return True
+
+    def cancel_parse(self):
+        """Stop a parse running in the background and revert its changes, so
+        it can be restarted (unless the tree is changed before that, in which
+        case its language boxes are parsed with the next reparse). If the
+        changes can't be reverted the parse is finished and True is
+        returned."""
+        job = self.parse_job
+        if job is None:
+            return False
+        if job.thread is None:
+            # Hasn't been started, but is about to become outdated
+            self.parse_job = None
+            self.unparsed_roots.extend(r for r in job.roots if r not in self.unparsed_roots)
+            return False
+        if not job.cancel():
+            return self.publish_parse()
+        self.parse_job = ParseJob(job.parsers, job.roots, job.skipautolbox)
+        return False
 
+    def start_parse(self, callback=None):
+        """Run the scheduled parse (or the parse of previously cancelled
+        language boxes) on a separate thread. `callback` is called from that
+        thread once the parse is done, after which it needs to be published
+        with publish_parse."""
+        if self.pending_edit is not None:
+            return
+        if self.parse_job is None and self.unparsed_roots:
+            self.reparse(None, roots=[])
+        job = self.parse_job
+        if job is not None and job.thread is None:
+            job.start(callback)
+
+    def parse_running(self):
+        """Checks if a parse has been started with start_parse and hasn't
+        been published yet. The tree can't be read until then."""
+        job = self.parse_job
+        return job is not None and job.thread is not None
+
+    def parse_finished(self):
+        """Checks if a parse started with start_parse has finished."""
+        job = self.parse_job
+        return job is not None and job.thread is not None and job.finished
+
+    def finish_parse(self):
+        """Parse all outstanding changes in the foreground."""
+        self.publish_parse()
+        self.flush_edits()
+        if self.unparsed_roots:
+            self.reparse(None, roots=[])
+        self.publish_parse()
+
+    def update_autolboxes(self, skipautolbox=False):
         # Now check for auto language boxes
         if self.skipautolbox or skipautolbox or self.option_autolbox_insert is False:
             return
@@ -2285,19 +2744,105 @@ class TreeManager(object):
         result =  r.parse(lbox.symbol.ast.children[0].next_term, lbox.next_term, status)
         return result
 
-    def delete_version(self, version, node):
-        if ("parent", version) in node.log:
-            children = node.log["children", version]
-            node.delete_version(version)
-            for c in children:
-                self.delete_version(version, c)
-
     def undo_snapshot(self):
+        self.finish_parse()
         if self.undo_snapshots and self.undo_snapshots[-1] == self.version:
             # Snapshot already taken (this can happen in fuzzy tests where
             # undo_snapshot is called without any changes)
             return
         self.undo_snapshots.append(self.version)
+        self.check_history()
+
+    def check_history(self):
+        """Squash the oldest versions if the undo history exceeds its budget.
+        To amortise the cost of walking the history, the snapshot limit is
+        allowed to overshoot by a quarter before compacting, and the size is
+        only measured every HISTORY_CHECK_INTERVAL snapshots."""
+        if self.version < self.global_version:
+            # Don't compact while there are versions that can be redone
+            return
+        keep = None
+        limit = self.option_history_limit
+        if limit is not None and len(self.undo_snapshots) > limit + limit // 4 + 1:
+            keep = limit
+        size = self.option_history_size
+        if size is not None and len(self.undo_snapshots) - self.history_checked >= HISTORY_CHECK_INTERVAL:
+            self.history_checked = len(self.undo_snapshots)
+            if self.history_size() > size:
+                # Drop the older half of the snapshots
+                keep = min(keep or len(self.undo_snapshots), len(self.undo_snapshots) // 2)
+        if keep is not None:
+            self.compact_history(self.undo_snapshots[-keep-1])
+
+    def compact_history(self, version):
+        """Squash all versions up to `version` into a single base version that
+        becomes the oldest version that can be restored via undo."""
+        if version <= self.min_version:
+            return
+        assert version <= self.version
+        parsers = set()
+        for v in list(self.saved_parsers):
+            if v >= version:
+                parsers.update(l[0] for l in self.saved_parsers[v])
+            else:
+                del self.saved_parsers[v]
+        parsers.update(l[0] for l in self.parsers)
+
+        base_lines = max([v for v in self.saved_lines if v <= version] or [0])
+        for v in list(self.saved_lines):
+            if v < base_lines:
+                del self.saved_lines[v]
+        for v in list(self.cursor.log):
+            if v < version:
+                del self.cursor.log[v]
+        for v in list(self.parse_stats):
+            if v < version:
+                del self.parse_stats[v]
+        for parser in parsers:
+            for log in [parser.status_by_version, parser.errornodes_by_version]:
+                for v in list(log):
+                    if v < version:
+                        del log[v]
+
+        for v in list(self.saved_nodes):
+            if v <= version:
+                for node in self.saved_nodes.pop(v):
+                    node.compact(version)
+
+        self.undo_snapshots = [v for v in self.undo_snapshots if v >= version]
+        if not self.undo_snapshots or self.undo_snapshots[0] != version:
+            self.undo_snapshots.insert(0, version)
+        self.min_version = version
+        self.history_checked = len(self.undo_snapshots)
+
+    def get_history_nodes(self, root):
+        """Collect all nodes that are or were part of the tree under `root` in
+        any of the saved versions."""
+        seen = set()
+        todo = [root]
+        while todo:
+            node = todo.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            yield node
+            for children in node.get_history("children")[1]:
+                todo.extend(children)
+            todo.extend(node.children)
+
+    def history_size(self):
+        """Approximate size in bytes of the undo history."""
+        size = 0
+        parsers = set(l[0] for l in self.parsers)
+        for v in self.saved_parsers:
+            parsers.update(l[0] for l in self.saved_parsers[v])
+        for parser in parsers:
+            root = parser.previous_version.parent
+            for node in self.get_history_nodes(root):
+                size += node.history_size()
+        for v in self.saved_lines:
+            size += sys.getsizeof(self.saved_lines[v])
+        return size
 
     def save_current_version(self, postparse=False):
         self.log_input("save_current_version")